@@ -0,0 +1,352 @@
+import numpy as np
+from django.conf import settings
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from portfolio.instrumentation import instrumented
+from portfolio.models import CURRENT_PRICE, Price, Ticker, Trade
+from portfolio.routers import current_portfolio
+
+"""
+    Vectorized analytics over the whole book - trades & quotes are loaded
+    into columnar NumPy arrays, one query per table, & aggregated into
+    (ticker, day) matrices with cumulative sums
+
+    Cost basis follows the AVERAGE method of lot queues - every sell
+    realizes against the average cost of the quantity open at that time,
+    later buys never rewriting realized P&L - quotes missing before a
+    ticker's first one falling back to CURRENT_PRICE like returns do
+        MAX_DAYS: Days a series may span, overridden by the
+            PORTFOLIO_ANALYTICS_MAX_DAYS setting
+"""
+MAX_DAYS = 3660
+
+
+def load_trades(ticker_ids=None, portfolio_id=None):
+
+    """
+    Loading trades of a portfolio into columns in one query
+
+    Parameters:
+    ticker_ids (iterable): Restricting trades to these tickers
+    portfolio_id (int): Portfolio, the current portfolio by default
+
+    Returns:
+    dict: Arrays of ticker_id, day (datetime64[D]), category, quantity &
+    price, in trade order
+    """
+    queryset = Trade.objects.filter(portfolio_id=current_portfolio()
+        if portfolio_id is None else portfolio_id).order_by('created_at', 'id')
+    if ticker_ids is not None:
+        queryset = queryset.filter(ticker_id__in=ticker_ids)
+    rows = list(queryset.annotate(day=TruncDate('created_at'))
+        .values_list('ticker_id', 'day', 'category', 'quantity', 'price'))
+    columns = list(zip(*rows)) or [()] * 5
+    return {
+        'ticker_id': np.array(columns[0], dtype=np.int64),
+        'day': np.array(columns[1], dtype='datetime64[D]'),
+        'category': np.array(columns[2], dtype=np.int64),
+        'quantity': np.array(columns[3], dtype=np.float64),
+        'price': np.array(columns[4], dtype=np.float64)
+    }
+
+
+def load_prices(ticker_ids=None):
+
+    """
+    Loading quotes into columns in one query
+
+    Parameters:
+    ticker_ids (iterable): Restricting quotes to these tickers
+
+    Returns:
+    dict: Arrays of ticker_id, day (datetime64[D]) & price, in quote order
+    """
+    queryset = Price.objects.order_by('quoted_at', 'id')
+    if ticker_ids is not None:
+        queryset = queryset.filter(ticker_id__in=ticker_ids)
+    rows = list(queryset.annotate(day=TruncDate('quoted_at'))
+        .values_list('ticker_id', 'day', 'price'))
+    columns = list(zip(*rows)) or [()] * 3
+    return {
+        'ticker_id': np.array(columns[0], dtype=np.int64),
+        'day': np.array(columns[1], dtype='datetime64[D]'),
+        'price': np.array(columns[2], dtype=np.float64)
+    }
+
+
+def daily_totals(rows, values, shape):
+
+    """
+    Summing values of rows into a (ticker, day) matrix
+
+    Parameters:
+    rows (tuple): Arrays of ticker & day indexes
+    values (ndarray): Values of rows
+    shape (tuple): Number of tickers & days
+
+    Returns:
+    ndarray: Matrix of per ticker per day totals
+    """
+    flat = np.ravel_multi_index(rows, shape)
+    return np.bincount(flat, weights=values,
+        minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def closing(flat, values, shape):
+
+    """
+    Last value of every (ticker, day) cell, forward filled, NaN before the
+    first value of a ticker
+
+    Parameters:
+    flat (ndarray): Flat cell indexes of values, in time order
+    values (ndarray): Values
+    shape (tuple): Number of tickers & days
+
+    Returns:
+    ndarray: Matrix of values per ticker per day
+    """
+    # Values are in time order, so the last occurrence of a cell wins
+    cells, last = np.unique(flat[::-1], return_index=True)
+    closes = np.full(shape[0] * shape[1], np.nan)
+    closes[cells] = values[::-1][last]
+    closes = closes.reshape(shape)
+    filled = np.where(np.isnan(closes), 0, np.arange(shape[1]))
+    np.maximum.accumulate(filled, axis=1, out=filled)
+    return np.take_along_axis(closes, filled, axis=1)
+
+
+def daily_prices(quotes, ticker_index, days):
+
+    """
+    Closing price of every ticker on every day - its latest quote up to
+    that day - forward filled, CURRENT_PRICE before its first quote
+
+    Parameters:
+    quotes (dict): Columns from load_prices
+    ticker_index (ndarray): Sorted ticker ids, position being the row
+    days (ndarray): Days of the series (datetime64[D])
+
+    Returns:
+    ndarray: Matrix of prices per ticker per day
+    """
+    shape = (len(ticker_index), len(days))
+    known = np.isin(quotes['ticker_id'], ticker_index) & \
+        (quotes['day'] <= days[-1])
+    rows = np.searchsorted(ticker_index, quotes['ticker_id'][known])
+    columns = np.maximum(
+        (quotes['day'][known] - days[0]).astype(np.int64), 0)
+    closes = closing(np.ravel_multi_index((rows, columns), shape),
+        quotes['price'][known], shape)
+    return np.where(np.isnan(closes), float(CURRENT_PRICE), closes)
+
+
+def average_costs(trades):
+
+    """
+    Matching trades in order by the AVERAGE lot method without a loop over
+    trades. Within a segment (a ticker's trades until held returns to 0) a
+    sell scales the open cost by held after / held before, so open cost is
+    the sum of buy costs times the cumulative product of those factors
+    since, summed as logs (logaddexp) so long segments can't overflow
+
+    Parameters:
+    trades (dict): Columns from load_trades
+
+    Returns:
+    tuple: Arrays of realized P&L of every trade & cost of the quantity
+    left open after it
+    """
+    count = len(trades['ticker_id'])
+    if not count:
+        return np.zeros(0), np.zeros(0)
+    order = np.argsort(trades['ticker_id'], kind='stable')
+    ticker_ids = trades['ticker_id'][order]
+    bought = trades['category'][order] == Trade.CATEGORY_BOUGHT
+    quantity = trades['quantity'][order]
+    price = trades['price'][order]
+    first = np.ones(count, dtype=bool)
+    first[1:] = ticker_ids[1:] != ticker_ids[:-1]
+    signed = np.where(bought, quantity, -quantity)
+    held = np.cumsum(signed)
+    held -= (held - signed)[np.maximum.accumulate(
+        np.where(first, np.arange(count), 0))]
+    held_before = held - signed
+    starts = first | (held_before <= 0)
+    log_scale = np.cumsum(np.log(np.where(~bought & (held > 0),
+        held / np.where(held_before > 0, held_before, 1), 1)))
+    buys = bought & (quantity > 0)
+    terms = np.full(count, -np.inf)
+    terms[buys] = np.log(quantity[buys] * price[buys]) - log_scale[buys]
+    # Shifting every segment 64 above the log-sum of the previous one, past
+    # float64 precision, so that accumulating resets at segment starts
+    bounds = np.flatnonzero(starts)
+    finite = np.where(buys, terms, np.nan)
+    with np.errstate(invalid='ignore'):
+        highest = np.fmax.reduceat(finite, bounds)
+        lowest = np.fmin.reduceat(finite, bounds)
+    highest = np.nan_to_num(highest, nan=0.0) + np.log(np.diff(bounds,
+        append=count))
+    lowest = np.nan_to_num(lowest, nan=0.0)
+    shift = np.concatenate(([0.0], np.cumsum(np.maximum(
+        highest[:-1] - lowest[1:] + 64, 0))))[np.cumsum(starts) - 1]
+    open_cost = np.where(held > 0, np.exp(log_scale - shift +
+        np.logaddexp.accumulate(terms + shift)), 0)
+    cost_before = np.where(starts, 0, np.roll(open_cost, 1))
+    realized = np.where(bought, 0, quantity * (price - np.divide(
+        cost_before, held_before, out=np.zeros(count),
+        where=held_before > 0)))
+    unsorted = np.empty_like(order)
+    unsorted[order] = np.arange(count)
+    return realized[unsorted], open_cost[unsorted]
+
+
+def window(first, start, end):
+
+    """
+    Days of a series - from start (the first trade day by default, at
+    most MAX_DAYS before end) to end, preceded by one day accumulating
+    every earlier trade
+
+    Returns:
+    tuple: Days (datetime64[D]) & first kept day
+
+    Raises:
+    ValueError: When start is after end or the window exceeds MAX_DAYS
+    """
+    max_days = getattr(settings, 'PORTFOLIO_ANALYTICS_MAX_DAYS', MAX_DAYS)
+    if start is None:
+        start = max(first, end - (max_days - 1))
+    start = np.datetime64(start, 'D')
+    if start > end:
+        raise ValueError('start must not be after end')
+    if (end - start).astype(np.int64) >= max_days:
+        raise ValueError('Analytics span at most {days} days'.format(
+            days=max_days))
+    return np.arange(start - 1 if first < start else start, end + 1,
+        dtype='datetime64[D]'), start
+
+
+@instrumented('aggregation')
+def series(start=None, end=None, ticker_ids=None, portfolio_id=None):
+
+    """
+    Computing positions, cost basis, realized/unrealized P&L, daily P&L
+    & time-weighted return of every ticker & of the book, for every day
+    from start to end
+
+    Parameters:
+    start (date): First day, the day of the first trade by default
+    end (date): Last day, today by default
+    ticker_ids (iterable): Restricting analytics to these tickers
+    portfolio_id (int): Portfolio, the current portfolio by default
+
+    Returns:
+    dict: days, tickers (sorted ids) & (ticker, day) matrices -
+    quantity, avg_cost, price, market_value, realized, unrealized,
+    daily_pnl - & book series - market_value, realized, unrealized,
+    daily_pnl, twr
+
+    Raises:
+    ValueError: When start is after end or the window exceeds MAX_DAYS
+    """
+    trades = load_trades(ticker_ids, portfolio_id)
+    end = np.datetime64(end or timezone.localdate(), 'D')
+    first = min(trades['day'].min(), end) if len(trades['day']) else end
+    # Trades before start are accumulated into the day before it, then
+    # sliced off
+    days, start = window(first, start, end)
+    ticker_index = np.unique(trades['ticker_id'])
+    shape = (len(ticker_index), len(days))
+    trade_realized, trade_open_cost = average_costs(trades)
+    rows = (np.searchsorted(ticker_index, trades['ticker_id']),
+        np.maximum((trades['day'] - days[0]).astype(np.int64), 0))
+    inside = rows[1] < shape[1]
+    rows = (rows[0][inside], rows[1][inside])
+    bought = trades['category'][inside] == Trade.CATEGORY_BOUGHT
+    quantity = trades['quantity'][inside]
+    amount = quantity * trades['price'][inside]
+
+    held = np.cumsum(daily_totals(rows,
+        np.where(bought, quantity, -quantity), shape), axis=1)
+    buy_cost = np.cumsum(daily_totals(rows,
+        np.where(bought, amount, 0), shape), axis=1)
+    sell_proceeds = np.cumsum(daily_totals(rows,
+        np.where(bought, 0, amount), shape), axis=1)
+    realized = np.cumsum(daily_totals(rows, trade_realized[inside],
+        shape), axis=1)
+    open_cost = np.nan_to_num(closing(np.ravel_multi_index(rows, shape),
+        trade_open_cost[inside], shape)) if shape[0] else np.zeros(shape)
+
+    avg_cost = np.divide(open_cost, held,
+        out=np.zeros(shape), where=held > 0)
+    prices = daily_prices(load_prices(ticker_index), ticker_index, days) \
+        if shape[0] else np.zeros(shape)
+    market_value = held * prices
+    unrealized = market_value - open_cost
+    total = realized + unrealized
+    daily_pnl = np.diff(total, axis=1, prepend=0)
+
+    # Flows (buys in, sells out) happen at the start of the day
+    book_value = market_value.sum(axis=0)
+    flows = np.diff(buy_cost - sell_proceeds, axis=1, prepend=0).sum(axis=0)
+    invested = np.concatenate(([0.0], book_value[:-1])) + flows
+    daily_return = np.divide(book_value - invested, invested,
+        out=np.zeros(len(days)), where=invested > 0)
+
+    keep = days >= start
+    held, avg_cost, prices, market_value, realized, unrealized, \
+        daily_pnl = (matrix[:, keep] for matrix in (held, avg_cost, prices,
+            market_value, realized, unrealized, daily_pnl))
+    days, book_value, daily_return = \
+        days[keep], book_value[keep], daily_return[keep]
+    return {
+        'days': days,
+        'tickers': ticker_index,
+        'quantity': held,
+        'avg_cost': avg_cost,
+        'price': prices,
+        'market_value': market_value,
+        'realized': realized,
+        'unrealized': unrealized,
+        'daily_pnl': daily_pnl,
+        'book': {
+            'market_value': book_value,
+            'realized': realized.sum(axis=0),
+            'unrealized': unrealized.sum(axis=0),
+            'daily_pnl': daily_pnl.sum(axis=0),
+            'twr': np.cumprod(1 + daily_return) - 1
+        }
+    }
+
+
+def report(start=None, end=None, ticker_ids=None, portfolio_id=None):
+
+    """
+    Analytics as JSON-ready data, amounts rounded to 2 decimal places &
+    returns to 6
+
+    Returns:
+    dict: dates, book series & latest figures of every ticker
+    """
+    result = series(start, end, ticker_ids, portfolio_id)
+    names = dict(Ticker.objects.filter(id__in=result['tickers'].tolist())
+        .values_list('id', 'symbol'))
+    book = result['book']
+    return {
+        'dates': [str(day) for day in result['days']],
+        'book': dict((key, np.round(values, 6 if key == 'twr' else 2)
+            .tolist()) for key, values in book.items()),
+        'tickers': [{
+                'id': ticker_id,
+                'symbol': names.get(ticker_id),
+                'final_quantity': int(result['quantity'][row, -1]),
+                'avg_cost': round(float(result['avg_cost'][row, -1]), 2),
+                'price': round(float(result['price'][row, -1]), 2),
+                'market_value': round(
+                    float(result['market_value'][row, -1]), 2),
+                'realized': round(float(result['realized'][row, -1]), 2),
+                'unrealized': round(float(result['unrealized'][row, -1]), 2)
+            } for row, ticker_id in enumerate(result['tickers'].tolist())]
+    }
@@ -0,0 +1,249 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import Http404, JsonResponse
+from rest_framework.exceptions import NotFound
+
+from portfolio.caching import cached_lookup
+from portfolio.instrumentation import record_queries
+from portfolio.middleware import QueryRecorder
+from portfolio.models import Ticker, Trade, TradeHistory
+from portfolio.pagination import KeysetPaginator
+from portfolio.prices import latest_prices
+from portfolio.routers import current_portfolio
+from portfolio.serializers import (FastHoldingSerializer,
+    FastReturnSerializer, FastTickerSerializer, FastTradeHistorySerializer,
+    FastTradeSerializer)
+from portfolio.snapshots import holdings_as_of, parse_as_of, returns_as_of
+
+"""
+    Async JSON read API, served without blocking the event loop under ASGI
+    (uvicorn workers), database & cache work running in worker threads
+"""
+
+
+def db_call(function):
+
+    """
+    Decorator turning a function doing database or cache work into a
+    coroutine run in a worker thread, so several calls of a request can
+    run concurrently, stale connections of the thread being closed
+    before & after like request boundaries do & its queries being
+    recorded for instrumentation
+
+    Parameters:
+    function (function): Blocking function
+
+    Returns:
+    function: Coroutine function
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            with QueryRecorder() as recorder:
+                return function(*args, **kwargs)
+        finally:
+            record_queries(recorder)
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)
+
+
+def page_payload(request, queryset, serializer_class, descending=False):
+
+    """
+    Serializing a keyset page of the values() of a queryset with a fast
+    serializer
+
+    Returns:
+    dict: Payload having next, previous & results
+    """
+    try:
+        page = KeysetPaginator(request, descending=descending) \
+            .paginate(queryset.values(*serializer_class.lookups))
+    except NotFound as error:
+        raise Http404(error.detail)
+    return {
+        'next': page.next_link,
+        'previous': page.previous_link,
+        'results': serializer_class(page.object_list, many=True).data
+    }
+
+
+def get_as_of(request):
+
+    """
+    Returns:
+    datetime: Parsed ?as_of= or None when missing
+
+    Raises:
+    ValueError: When ?as_of= is invalid
+    """
+    if not request.GET.get('as_of'):
+        return None
+    return parse_as_of(request.GET['as_of'])
+
+
+def get_int(request, name, default=None):
+
+    """
+    Returns:
+    int: Parsed integer query parameter or default when missing
+
+    Raises:
+    ValueError: When the parameter is not an integer
+    """
+    if not request.GET.get(name):
+        return default
+    try:
+        return int(request.GET[name])
+    except ValueError:
+        raise ValueError('{name} must be an integer'.format(name=name))
+
+
+def bad_request(error):
+    return JsonResponse({'errors': str(error)}, status=400)
+
+
+@db_call
+def trade_page(request, ticker_id=None):
+    queryset = Trade.objects.filter(portfolio_id=request.portfolio_id)
+    if ticker_id is not None:
+        queryset = queryset.filter(ticker__id=ticker_id)
+    return page_payload(request, queryset, FastTradeSerializer)
+
+
+@db_call
+def ticker_page(request):
+    return page_payload(request, Ticker.objects.with_trade_count(),
+        FastTickerSerializer)
+
+
+@db_call
+def trade_history_page(request, trade_id=None):
+    queryset = TradeHistory.objects.filter(
+        portfolio_id=request.portfolio_id)
+    if trade_id is not None:
+        queryset = queryset.filter(trade_reference__id=trade_id)
+    return page_payload(request, queryset, FastTradeHistorySerializer,
+        descending=True)
+
+
+@db_call
+def holding_rows(evaluated=True, as_of=None):
+    def load():
+        return FastHoldingSerializer(
+            Ticker.objects.holdings(evaluated=evaluated)).data
+    if as_of is not None:
+        return FastHoldingSerializer(holdings_as_of(as_of)).data
+    return cached_lookup('holdings', load, (current_portfolio(),)) \
+        if evaluated else load()
+
+
+@db_call
+def return_rows(as_of=None):
+    if as_of is not None:
+        return FastReturnSerializer(returns_as_of(as_of)).data
+    return cached_lookup('returns', lambda: FastReturnSerializer(
+        Ticker.objects.returns()).data, (current_portfolio(),))
+
+
+@db_call
+def price_rows():
+    prices = latest_prices.get_many(
+        ticker['id'] for ticker in Ticker.objects.choices())
+    return dict((str(ticker_id), str(price))
+        for ticker_id, price in prices.items())
+
+
+async def trades(request):
+
+    """
+    Generating a page of trades of the portfolio, filtered by ?ticker=
+
+    Returns:
+    json: next, previous & results
+    """
+    try:
+        ticker_id = get_int(request, 'ticker')
+    except ValueError as error:
+        return bad_request(error)
+    return JsonResponse(await trade_page(request, ticker_id))
+
+
+async def tickers(request):
+
+    """
+    Generating a page of tickers having their number of trades
+
+    Returns:
+    json: next, previous & results
+    """
+    return JsonResponse(await ticker_page(request))
+
+
+async def trade_history(request):
+
+    """
+    Generating a page of trade versions of the portfolio newest first,
+    filtered by ?trade=
+
+    Returns:
+    json: next, previous & results
+    """
+    try:
+        trade_id = get_int(request, 'trade')
+    except ValueError as error:
+        return bad_request(error)
+    return JsonResponse(await trade_history_page(request, trade_id))
+
+
+async def holdings(request):
+
+    """
+    Generating holdings of all tickers, at a point in time with ?as_of=
+
+    Returns:
+    json: results
+    """
+    try:
+        as_of = get_as_of(request)
+        evaluated = bool(get_int(request, 'evaluated', 1))
+    except ValueError as error:
+        return bad_request(error)
+    return JsonResponse({'results': await holding_rows(evaluated, as_of)})
+
+
+async def returns(request):
+
+    """
+    Generating cumulative returns of all tickers, at a point in time with
+    ?as_of=
+
+    Returns:
+    json: results
+    """
+    try:
+        as_of = get_as_of(request)
+    except ValueError as error:
+        return bad_request(error)
+    return JsonResponse({'results': await return_rows(as_of)})
+
+
+async def dashboard(request):
+
+    """
+    Generating holdings, returns & latest prices, read concurrently
+
+    Returns:
+    json: holdings, returns & prices keyed by ticker id
+    """
+    holding_list, return_list, prices = await asyncio.gather(
+        holding_rows(), return_rows(), price_rows())
+    return JsonResponse({
+        'holdings': holding_list,
+        'returns': return_list,
+        'prices': prices
+    })
@@ -0,0 +1,566 @@
+import datetime
+import math
+import platform
+import random
+import subprocess
+import time
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+from django.test import Client, override_settings
+
+from portfolio.lots import METHOD_CHOICES, replay as replay_lots
+from portfolio.models import LotQueue, Position, Ticker, Trade, TradeHistory
+from portfolio.serializers import (FastHoldingSerializer,
+    FastTradeSerializer, HoldingSerializer, TradeSerializer)
+from portfolio.snapshots import replay, state_as_of, take_snapshot
+
+
+def legacy_holdings(evaluated=True):
+
+    """ 
+    Reference copy of the former holdings engine, building avg_buy_price
+    calculation strings & evaluating them with eval(), kept for comparison
+      
+    Parameters: 
+    evaluated (bool): evaluated True sets avg_buy_price computed
+    result of calculation string otherwise not
+      
+    Returns: 
+    list: List of holdings having ticker details - id, name, symbol
+    avg_buy_price, final_quantity
+    """
+    queryset = Ticker.objects.all().prefetch_related('trade_set') \
+        .values('id', 'name', 'symbol', 'trade__price', 'trade__category') \
+        .order_by('trade__price') \
+        .annotate(final_quantity=Coalesce(models.Sum('trade__quantity'), 0))
+    holdings_data = []
+    holdings = {}
+    for qs in queryset:
+        try:
+            if qs.get('trade__category') == Trade.CATEGORY_BOUGHT:
+                if holdings[qs.get('id')].get('avg_buy_price'):
+                    holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([ 
+                        holdings[qs.get('id')]['avg_buy_price'],
+                        '*'.join([str(qs.get('trade__price')),
+                        str(qs.get('final_quantity'))])]
+                    )
+                    holdings[qs.get('id')]['divider'] = ' + '.join([
+                        holdings[qs.get('id')]['divider'],
+                        str(qs.get('final_quantity'))]
+                    )
+                    holdings[qs.get('id')]['bought'] += qs.get('final_quantity')
+                else:
+                    holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([
+                        '*'.join([str(qs.get('trade__price')),
+                        str(qs.get('final_quantity'))])]
+                    )
+                    holdings[qs.get('id')]['divider'] = str(qs.get('final_quantity'))
+                    holdings[qs.get('id')]['bought'] = qs.get('final_quantity')
+            if qs.get('trade__category') == Trade.CATEGORY_SOLD:
+                try:
+                    holdings[qs.get('id')]['sold'] += qs.get('final_quantity')
+                except:
+                    holdings[qs.get('id')]['sold'] = qs.get('final_quantity')
+            holdings[qs.get('id')]['id'] = qs.get('name')
+            holdings[qs.get('id')]['name'] = qs.get('name')
+            holdings[qs.get('id')]['symbol'] = qs.get('symbol')
+            holdings[qs.get('id')]['final_quantity'] += qs.get('final_quantity')
+        except:
+            holdings[qs.get('id')] = {}
+            holdings[qs.get('id')]['id'] = qs.get('name')
+            holdings[qs.get('id')]['name'] = qs.get('name')
+            holdings[qs.get('id')]['final_quantity'] = qs.get('final_quantity')
+            holdings[qs.get('id')]['avg_buy_price'] = 0
+            holdings[qs.get('id')]['divider'] = ''
+            if (qs.get('trade__price') or (qs.get('trade__price') == 0) and 
+                    qs.get('trade__category') == Trade.CATEGORY_BOUGHT):
+                holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([
+                    '*'.join([str(qs.get('trade__price')), 
+                    str(qs.get('final_quantity'))])]
+                )
+                holdings[qs.get('id')]['divider'] = str(qs.get('final_quantity'))
+                holdings[qs.get('id')]['bought'] = qs.get('final_quantity')
+            if qs.get('trade__category') == Trade.CATEGORY_SOLD:
+                holdings[qs.get('id')]['sold'] = qs.get('final_quantity')
+            holdings[qs.get('id')]['id'] = qs.get('name')
+            holdings[qs.get('id')]['name'] = qs.get('name')
+            holdings[qs.get('id')]['symbol'] = qs.get('symbol')
+    for k, v in holdings.items():
+        if v.get('divider'):
+            v['avg_buy_price'] = '/'.join([
+                ''.join(['(', v['avg_buy_price'], ')']), 
+                ''.join(['(', v['divider'], ')'])
+            ])
+        if evaluated:
+            v['avg_buy_price'] = '%.2f'%eval(str(v['avg_buy_price']))
+        if isinstance(v['avg_buy_price'], int):
+            v['avg_buy_price'] = '%.2f'%v['avg_buy_price']
+        v['final_quantity'] = (v.get('bought') or 0) - (v.get('sold') or 0)
+        holdings_data.append(v)
+    return holdings_data
+
+
+def generate_trades(tickers, trades, seed=0):
+
+    """ 
+    Inserting a deterministic synthetic trade book with bulk_create, sells
+    never exceeding the quantity held, & rebuilding positions for it
+      
+    Parameters: 
+    tickers (int): Number of tickers
+    trades (int): Number of trades
+    seed (int): Random seed
+    """
+    rnd = random.Random(seed)
+    ticker_ids = [Ticker.objects.create(
+        name='bench {index}'.format(index=index),
+        symbol='BENCH{seed}X{index}'.format(seed=seed, index=index)).id
+        for index in range(tickers)]
+    held = dict.fromkeys(ticker_ids, 0)
+    batch = []
+    for _ in range(trades):
+        ticker_id = rnd.choice(ticker_ids)
+        quantity = rnd.randint(1, 100)
+        category = Trade.CATEGORY_BOUGHT
+        if held[ticker_id] >= quantity and rnd.random() < 0.3:
+            category = Trade.CATEGORY_SOLD
+        held[ticker_id] += quantity if category == Trade.CATEGORY_BOUGHT \
+            else -quantity
+        batch.append(Trade(ticker_id=ticker_id, category=category,
+            quantity=quantity,
+            price=Decimal(rnd.randint(100, 50000)) / 100))
+        if len(batch) == 5000:
+            Trade.objects.bulk_create(batch)
+            batch = []
+    Trade.objects.bulk_create(batch)
+    Position.objects.rebuild()
+
+
+def best_of(function, repeat=3):
+
+    """ 
+    Timing a callable
+      
+    Returns: 
+    float: Best wall-clock seconds out of repeat runs
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+HOLDINGS_ENGINES = (
+    ('legacy_eval', lambda: legacy_holdings(evaluated=True)),
+    ('legacy_formula', lambda: legacy_holdings(evaluated=False)),
+    ('aggregate', lambda: Position.objects.from_trades(Trade.objects.all())),
+    ('materialized', lambda: Ticker.objects.holdings(evaluated=True)),
+    ('materialized_formula', lambda: Ticker.objects.holdings(evaluated=False))
+)
+
+
+def bench_holdings(sizes, tickers=100, repeat=3):
+
+    """ 
+    Comparing holdings engines over synthetic books, each generated inside
+    a transaction which is rolled back afterwards
+      
+    Parameters: 
+    sizes (list): Trade counts to benchmark
+    tickers (int): Number of tickers per book
+    repeat (int): Runs per engine, best one being reported
+      
+    Returns: 
+    list: List of results having trades, engine & seconds
+    """
+    results = []
+    for size in sizes:
+        with transaction.atomic():
+            generate_trades(tickers, size)
+            for engine, function in HOLDINGS_ENGINES:
+                results.append({
+                    'trades': size,
+                    'engine': engine,
+                    'seconds': best_of(function, repeat)
+                })
+            transaction.set_rollback(True)
+    return results
+
+
+def generate_history(tickers, trades, every, seed=0):
+
+    """ 
+    Inserting a deterministic synthetic book with one TradeHistory version
+    per trade, checkpointing positions every `every` versions
+      
+    Parameters: 
+    tickers (int): Number of tickers
+    trades (int): Number of trades
+    every (int): History rows between checkpoints
+    seed (int): Random seed
+
+    Returns: 
+    list: created_at of every history row, in insertion order
+    """
+    generate_trades(tickers, trades, seed)
+    created = []
+    batch = []
+    for trade in Trade.objects.order_by('pk').values('id', 'portfolio_id',
+            'ticker_id', 'category', 'quantity', 'price') \
+            .iterator(chunk_size=5000):
+        batch.append(TradeHistory(trade_reference_id=trade.pop('id'),
+            **trade))
+        if len(batch) == every:
+            created.extend(row.created_at for row in
+                TradeHistory.objects.bulk_create(batch))
+            take_snapshot(force=True, lag=0)
+            batch = []
+    created.extend(row.created_at for row in
+        TradeHistory.objects.bulk_create(batch))
+    return created
+
+
+def bench_as_of(sizes, tickers=100, every=10000, points=10, repeat=3):
+
+    """ 
+    Comparing point-in-time reconstruction from the nearest checkpoint
+    with a full replay of TradeHistory, over books generated inside a
+    transaction which is rolled back afterwards
+      
+    Parameters: 
+    sizes (list): Trade counts to benchmark
+    tickers (int): Number of tickers per book
+    every (int): History rows between checkpoints
+    points (int): as_of points spread over the history
+    repeat (int): Runs per engine, best one being reported
+      
+    Returns: 
+    list: List of results having trades, engine & mean seconds per as_of
+    """
+    engines = (
+        ('full_replay', lambda as_of: replay({}, 0, as_of)),
+        ('checkpoint', state_as_of)
+    )
+    results = []
+    for size in sizes:
+        with transaction.atomic():
+            created = generate_history(tickers, size, every)
+            moments = [created[(len(created) - 1) * index // max(points - 1, 1)]
+                for index in range(points)]
+            for engine, function in engines:
+                results.append({
+                    'trades': size,
+                    'engine': engine,
+                    'seconds': best_of(lambda: [function(as_of)
+                        for as_of in moments], repeat) / points
+                })
+            transaction.set_rollback(True)
+    return results
+
+
+def generate_lot_trades(tickers, trades, seed=0):
+
+    """ 
+    Generating a deterministic synthetic trade stream in memory, sells
+    never exceeding the quantity held
+      
+    Returns: 
+    list: Tuples of ticker id, category, quantity & price in cents
+    """
+    rnd = random.Random(seed)
+    held = [0] * tickers
+    rows = []
+    for _ in range(trades):
+        ticker_id = rnd.randrange(tickers)
+        quantity = rnd.randint(1, 100)
+        category = Trade.CATEGORY_BOUGHT
+        if held[ticker_id] >= quantity and rnd.random() < 0.4:
+            category = Trade.CATEGORY_SOLD
+            held[ticker_id] -= quantity
+        else:
+            held[ticker_id] += quantity
+        rows.append((ticker_id, category, quantity, rnd.randint(100, 50000)))
+    return rows
+
+
+def bench_lots(sizes, tickers=100, repeat=3):
+
+    """ 
+    Timing lot matching replays of synthetic trade streams for every method
+      
+    Parameters: 
+    sizes (list): Trade counts to benchmark
+    tickers (int): Number of tickers
+    repeat (int): Runs per method, best one being reported
+      
+    Returns: 
+    list: List of results having trades, method, seconds & trades per
+    second
+    """
+    results = []
+    for size in sizes:
+        rows = generate_lot_trades(tickers, size)
+        for method, name in METHOD_CHOICES:
+            seconds = best_of(lambda: replay_lots(rows, method), repeat)
+            results.append({
+                'trades': size,
+                'method': name,
+                'seconds': seconds,
+                'trades_per_second': int(size / seconds) if seconds else None
+            })
+    return results
+
+
+def checked(response):
+
+    """ 
+    Returns: 
+    HttpResponse: Response of a scenario, which must have succeeded so
+    error pages are never timed
+    """
+    if response.status_code >= 400:
+        raise RuntimeError('{status} from {url}'.format(
+            status=response.status_code, url=response.request['PATH_INFO']))
+    return response
+
+
+def trade_create_scenario(client, rnd, ticker_ids):
+    def run():
+        checked(client.post('/portfolio/trade/', {
+            'category': Trade.CATEGORY_BOUGHT,
+            'ticker_id': rnd.choice(ticker_ids),
+            'quantity': rnd.randint(1, 100),
+            'price': '{:.2f}'.format(rnd.randint(100, 50000) / 100)
+        }))
+    return run
+
+
+def trade_update_scenario(client, rnd, trade_ids):
+    def run():
+        trade = Trade.objects.get(pk=rnd.choice(trade_ids))
+        # Buys only grow, so no sell is ever left oversold
+        checked(client.post('/portfolio/trade/{pk}/update_record/'.format(
+            pk=trade.pk), {
+                'category': trade.category,
+                'ticker_id': trade.ticker_id,
+                'quantity': trade.quantity + 1,
+                'price': str(trade.price)
+            }))
+    return run
+
+
+def get_scenario(client, url):
+    def run():
+        response = checked(client.get(url))
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    return run
+
+
+def scenarios(client, rnd):
+
+    """ 
+    Timed scenarios over the generated book, requests going through the
+    whole middleware & view stack
+      
+    Returns: 
+    list: Tuples of scenario name & callable
+    """
+    ticker_ids = list(Ticker.objects.values_list('id', flat=True))
+    trade_ids = list(Trade.objects.filter(category=Trade.CATEGORY_BOUGHT) \
+        .values_list('id', flat=True)[:1000])
+    return [
+        ('trade_create', trade_create_scenario(client, rnd, ticker_ids)),
+        ('trade_update', trade_update_scenario(client, rnd, trade_ids)),
+        ('ticker_list', get_scenario(client,
+            '/portfolio/ticker/?format=json')),
+        ('holdings_evaluated', get_scenario(client,
+            '/portfolio/holding/?evaluated=1')),
+        ('holdings_formula', get_scenario(client,
+            '/portfolio/holding/?evaluated=0')),
+        ('returns', get_scenario(client, '/portfolio/return/')),
+        ('trade_export', get_scenario(client,
+            '/portfolio/trade/export/?export_format=csv'))
+    ]
+
+
+def scaling_exponents(results):
+
+    """ 
+    Estimating how every scenario scales with the book, as the log-log
+    slope of seconds against trades between consecutive sizes (1 being
+    linear)
+      
+    Returns: 
+    list: List of scenario, from & to trades & exponent
+    """
+    series = {}
+    for result in results:
+        series.setdefault(result['scenario'], []).append(
+            (result['trades'], result['seconds']))
+    exponents = []
+    for scenario, points in series.items():
+        points.sort()
+        for (small, before), (large, after) in zip(points, points[1:]):
+            if small == large or not before or not after:
+                continue
+            exponents.append({
+                'scenario': scenario,
+                'from_trades': small,
+                'to_trades': large,
+                'exponent': round(math.log(after / before) /
+                    math.log(large / small), 3)
+            })
+    return exponents
+
+
+def compare_results(baseline, current, tolerance=0.2):
+
+    """ 
+    Comparing suite results with a baseline (e.g. of the previous commit)
+      
+    Parameters: 
+    baseline (dict): Suite output of the baseline
+    current (dict): Suite output being checked
+    tolerance (float): Slowdown ratio allowed before being reported
+      
+    Returns: 
+    list: List of scenario, trades, baseline & current seconds & ratio
+    of regressions
+    """
+    before = dict(((result['scenario'], result['trades']), result['seconds'])
+        for result in baseline['results'])
+    regressions = []
+    for result in current['results']:
+        seconds = before.get((result['scenario'], result['trades']))
+        if seconds and result['seconds'] > seconds * (1 + tolerance):
+            regressions.append({
+                'scenario': result['scenario'],
+                'trades': result['trades'],
+                'baseline': seconds,
+                'seconds': result['seconds'],
+                'ratio': round(result['seconds'] / seconds, 3)
+            })
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=str(settings.BASE_DIR), capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(sizes, tickers=100, repeat=5, seed=0, superlinear=1.2):
+
+    """ 
+    Running the endpoint scenarios over deterministic synthetic books of
+    every size, each generated inside a transaction which is rolled back
+    afterwards. Responses, fragments & prices are never cached (dummy cache
+    backend for every alias) so every run does the full work
+      
+    Parameters: 
+    sizes (list): Trade counts to benchmark
+    tickers (int): Number of tickers per book
+    repeat (int): Runs per scenario, best one being reported
+    seed (int): Random seed of books & scenario inputs
+    superlinear (float): Scaling exponent above which a scenario is
+        flagged
+      
+    Returns: 
+    dict: meta (database, versions, commit...), results having trades,
+    scenario & seconds, exponents & superlinear scenarios
+    """
+    results = []
+    cache = dict((alias, {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+        for alias in settings.CACHES)
+    hosts = list(settings.ALLOWED_HOSTS) + ['testserver']
+    with override_settings(CACHES=cache, ALLOWED_HOSTS=hosts):
+        for size in sorted(sizes):
+            with transaction.atomic():
+                generate_trades(tickers, size, seed)
+                LotQueue.objects.rebuild()
+                client = Client()
+                for scenario, function in scenarios(client,
+                        random.Random(seed)):
+                    results.append({
+                        'trades': size,
+                        'scenario': scenario,
+                        'seconds': best_of(function, repeat)
+                    })
+                transaction.set_rollback(True)
+    exponents = scaling_exponents(results)
+    return {
+        'meta': {
+            'created_at': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'tickers': tickers,
+            'repeat': repeat,
+            'seed': seed
+        },
+        'results': results,
+        'exponents': exponents,
+        'superlinear': [exponent for exponent in exponents
+            if exponent['exponent'] > superlinear]
+    }
+
+
+def bench_serializers(sizes, tickers=100, repeat=3):
+
+    """ 
+    Comparing DRF serializers with fast list serializers over rows fetched
+    beforehand, so serialization only is timed, books being generated
+    inside a transaction which is rolled back afterwards
+      
+    Parameters: 
+    sizes (list): Trade counts to benchmark
+    tickers (int): Number of tickers per book
+    repeat (int): Runs per serializer, best one being reported
+      
+    Returns: 
+    list: List of results having rows, serializer, seconds & rows per
+    second
+    """
+    results = []
+    for size in sizes:
+        with transaction.atomic():
+            generate_trades(tickers, size)
+            trades = Trade.objects.order_by('created_at', 'id')
+            instances = list(trades.select_related('ticker'))
+            rows = list(trades.values(*FastTradeSerializer.lookups))
+            holdings = Ticker.objects.holdings()
+            serializers = (
+                ('trade_drf', len(instances),
+                    lambda: TradeSerializer(instances, many=True).data),
+                ('trade_fast', len(rows),
+                    lambda: FastTradeSerializer(rows).data),
+                ('holding_drf', len(holdings),
+                    lambda: HoldingSerializer(holdings, many=True).data),
+                ('holding_fast', len(holdings),
+                    lambda: FastHoldingSerializer(holdings).data)
+            )
+            for serializer, count, function in serializers:
+                seconds = best_of(function, repeat)
+                results.append({
+                    'rows': count,
+                    'serializer': serializer,
+                    'seconds': seconds,
+                    'rows_per_second': int(count / seconds) if seconds
+                        else None
+                })
+            transaction.set_rollback(True)
+    return results
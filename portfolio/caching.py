@@ -0,0 +1,124 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from portfolio.routers import current_database
+
+"""
+    Constants for response caching
+        VERSION_KEY: Cache key of the version of a cached view
+        RESPONSE_KEY: Cache key of a cached response, by ETag
+        LOOKUP_KEY: Cache key of a cached lookup table, by version
+        CACHED_VIEWS: Names of views cached with version keys
+"""
+VERSION_KEY = 'portfolio:version:{name}'
+RESPONSE_KEY = 'portfolio:response:{etag}'
+LOOKUP_KEY = 'portfolio:lookup:{name}:{version}:{vary}'
+CACHED_VIEWS = ('holdings', 'returns')
+
+
+def get_version(name):
+
+    """
+    Reading the version of a cached view, starting a new one from the clock
+    when missing (e.g. evicted) so stale responses are never matched again
+
+    Returns:
+    int: Version
+    """
+    key = VERSION_KEY.format(name=name)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(*names):
+
+    """
+    Bumping versions of cached views once the current transaction of the
+    database being routed commits, invalidating their cached responses &
+    ETags
+
+    Parameters:
+    names (str): Names of views, all CACHED_VIEWS by default
+    """
+    def bump():
+        for name in names or CACHED_VIEWS:
+            try:
+                cache.incr(VERSION_KEY.format(name=name))
+            except ValueError:
+                get_version(name)
+    transaction.on_commit(bump, using=current_database())
+
+
+def cached_lookup(name, loader, vary=()):
+
+    """
+    Reading a lookup table (e.g. select box choices) from the cache under
+    its version, loading & caching it on a miss
+
+    Parameters:
+    name (str): Name of the lookup, its version being bumped on changes
+    loader (function): Callable returning the lookup table
+    vary (tuple): Values changing the lookup table, e.g. a portfolio id
+
+    Returns:
+    object: Lookup table
+    """
+    key = LOOKUP_KEY.format(name=name, version=get_version(name),
+        vary=':'.join(str(value) for value in vary))
+    lookup = cache.get(key)
+    if lookup is None:
+        lookup = loader()
+        cache.set(key, lookup,
+            getattr(settings, 'PORTFOLIO_RESPONSE_CACHE_TIMEOUT', 3600))
+    return lookup
+
+
+def cached_response(name, vary_on=()):
+
+    """
+    Decorator caching rendered responses of a viewset method under the
+    view's version & answering If-None-Match with 304 without rendering
+
+    Parameters:
+    name (str): Name of the view, one of CACHED_VIEWS
+    vary_on (tuple): Query parameters changing the response
+
+    Returns:
+    function: Decorator
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            etag = '"{digest}"'.format(digest=hashlib.md5(':'.join(
+                [name, str(get_version(name))] +
+                [request.GET.get(param, '') for param in vary_on]
+            ).encode('utf-8')).hexdigest())
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+            key = RESPONSE_KEY.format(etag=etag)
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached[0], content_type=cached[1])
+            else:
+                response = view(self, request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                cache.set(key, (response.content, response['Content-Type']),
+                    getattr(settings, 'PORTFOLIO_RESPONSE_CACHE_TIMEOUT', 3600))
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,105 @@
+import csv
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+"""
+    Constants for streaming exports
+        EXPORT_FORMATS: Content type keyed by supported export format
+        EXPORT_CHUNK_SIZE: Rows fetched per database round trip
+"""
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson'
+}
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+
+    """
+    Pseudo-buffer returning written values instead of storing them, letting
+    csv.writer produce lines for a streaming response
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_rows(header, rows, export_format):
+
+    """
+    Generating export lines one row at a time
+
+    Parameters:
+    header (tuple): Column names
+    rows (iterable): Value tuples in header order
+    export_format (str): csv or jsonl
+
+    Returns:
+    generator: Lines of the export
+    """
+    if export_format == 'jsonl':
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(header, row))) + '\n'
+        return
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([value.isoformat()
+            if isinstance(value, datetime.datetime) else value
+            for value in row])
+
+
+def export_response(request, name, header, rows):
+
+    """
+    Building a constant memory streaming response of rows in the format
+    requested by export_format query parameter (csv by default)
+
+    Parameters:
+    request (Request): Request having export_format query parameter
+    name (str): File name without extension
+    header (tuple): Column names
+    rows (iterable): Value tuples in header order
+
+    Returns:
+    StreamingHttpResponse: Streaming export
+    """
+    export_format = request.GET.get('export_format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    response = StreamingHttpResponse(
+        stream_rows(header, rows, export_format),
+        content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = \
+        'attachment; filename="{name}.{extension}"'.format(
+            name=name, extension=export_format)
+    return response
+
+
+def filter_created(queryset, request):
+
+    """
+    Filtering a queryset by ticker & created_at date range from ticker,
+    start_date & end_date (YYYY-MM-DD, inclusive) query parameters
+
+    Returns:
+    QuerySet: Filtered queryset
+    """
+    if request.GET.get('ticker'):
+        queryset = queryset.filter(ticker_id=request.GET.get('ticker'))
+    start_date = parse_date(request.GET.get('start_date') or '')
+    if start_date:
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(
+            datetime.datetime.combine(start_date, datetime.time.min)))
+    end_date = parse_date(request.GET.get('end_date') or '')
+    if end_date:
+        queryset = queryset.filter(created_at__lt=timezone.make_aware(
+            datetime.datetime.combine(end_date + datetime.timedelta(days=1),
+            datetime.time.min)))
+    return queryset
@@ -0,0 +1,107 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+"""
+    Cached fragments of list pages - every table row is rendered once per
+    version through its own row template & cached, tables being rebuilt
+    from cached rows with one get_many so rendering scales with changed
+    rows, whole tables being cached under the versions of their rows in
+    the fragments cache
+        FRAGMENT_KEY: Cache key of a rendered row or table
+        FRAGMENT_VERSION: Part of FRAGMENT_KEY, bumped whenever row
+            templates change so markup cached before is never served
+        FRAGMENT_TIMEOUT: Seconds fragments are kept, overridden by the
+            PORTFOLIO_FRAGMENT_CACHE_TIMEOUT setting
+"""
+FRAGMENT_KEY = 'portfolio:fragment:{version}:{template}:{digest}'
+FRAGMENT_VERSION = 2
+FRAGMENT_TIMEOUT = 86400
+
+
+def fragment_cache():
+    return caches['fragments']
+
+
+def digest(value):
+
+    """
+    Returns:
+    str: Digest of the repr of a version, e.g. a tuple of id & modified_at
+    """
+    return hashlib.md5(repr(value).encode('utf-8')).hexdigest()
+
+
+def render_rows(template_name, name, rows, versions):
+
+    """
+    Rendering table rows, rows of a version rendered before being read
+    from the cache & the others rendered through the row template &
+    cached
+
+    Parameters:
+    template_name (str): Row template, getting the row as `name` &
+        its 1-based position as counter
+    name (str): Context name of the row
+    rows (list): Serialized rows
+    versions (list): Version of every row, the same version always
+        rendering the same markup (e.g. id & modified_at)
+
+    Returns:
+    SafeString: Markup of the rows
+    """
+    keys = [FRAGMENT_KEY.format(version=FRAGMENT_VERSION,
+            template=template_name, digest=digest((counter, version)))
+        for counter, version in enumerate(versions, 1)]
+    cached = fragment_cache().get_many(keys)
+    template = None
+    missing = {}
+    fragments = []
+    for counter, (key, row) in enumerate(zip(keys, rows), 1):
+        fragment = cached.get(key)
+        if fragment is None:
+            if template is None:
+                template = get_template(template_name)
+            fragment = missing[key] = template.render({
+                name: row, 'counter': counter})
+        fragments.append(fragment)
+    if missing:
+        fragment_cache().set_many(missing, getattr(settings,
+            'PORTFOLIO_FRAGMENT_CACHE_TIMEOUT', FRAGMENT_TIMEOUT))
+    return mark_safe(''.join(fragments))
+
+
+def render_table(template_name, name, rows, versions):
+
+    """
+    Rendering table rows from the cached table of the same row versions,
+    from cached rows otherwise
+
+    Returns:
+    SafeString: Markup of the rows
+    """
+    key = FRAGMENT_KEY.format(version=FRAGMENT_VERSION,
+        template=template_name, digest=digest(('table', list(versions))))
+    table = fragment_cache().get(key)
+    if table is None:
+        table = render_rows(template_name, name, rows, versions)
+        fragment_cache().set(key, table, getattr(settings,
+            'PORTFOLIO_FRAGMENT_CACHE_TIMEOUT', FRAGMENT_TIMEOUT))
+    return mark_safe(table)
+
+
+def cached_table(template_name, name, rows, versions):
+
+    """
+    Lazy render_table for template contexts, called by the template engine
+    only when the HTML page renders (never for JSON responses)
+
+    Returns:
+    function: Callable returning the markup of the rows
+    """
+    return functools.partial(render_table, template_name, name, rows,
+        list(versions))
@@ -0,0 +1,493 @@
+import datetime
+import gzip
+import heapq
+import itertools
+import json
+import mmap
+import os
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.utils import timezone
+
+from portfolio.models import (HistoryArchive, PositionSnapshot, Ticker,
+    Trade, TradeHistory)
+from portfolio.routers import (DEFAULT_PORTFOLIO, atomic, current_database,
+    portfolio_databases, routed_databases)
+
+"""
+    Constants for TradeHistory storage
+        HOT_DAYS: Days versions stay in the database before being archived
+        ARCHIVE_BLOCK: Versions per independently compressed archive block
+        PARTITION_TABLE: Partitioned table on PostgreSQL
+        ARCHIVE_FIELDS: Fields of archived versions
+        PURGE_DAYS: Days soft deleted rows are kept before being purged
+        PURGE_BATCH: Rows purged per transaction
+"""
+HOT_DAYS = 365
+PURGE_DAYS = 180
+PURGE_BATCH = 500
+ARCHIVE_BLOCK = 1000
+PARTITION_TABLE = 'portfolio_tradehistory'
+ARCHIVE_FIELDS = ('id', 'trade_reference_id', 'ticker_id', 'category',
+    'quantity', 'price', 'active', 'created_at', 'modified_at',
+    'portfolio_id')
+
+
+def archive_dir():
+    return getattr(settings, 'PORTFOLIO_HISTORY_ARCHIVE_DIR',
+        os.path.join(str(settings.BASE_DIR), 'archive'))
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partitioned(using=None):
+
+    """
+    Returns:
+    bool: Whether TradeHistory is stored in monthly partitions in the
+    database being routed (or using), i.e. on PostgreSQL once migrated
+    """
+    return connections[using or current_database()].vendor == 'postgresql'
+
+
+def ensure_partitions(months_ahead=2):
+
+    """
+    Creating monthly partitions of TradeHistory up to months_ahead months
+    from now in every portfolio database, before any row lands in the
+    default partition
+
+    Returns:
+    list: Names of partitions created
+    """
+    created = []
+    for alias in routed_databases():
+        if partitioned(alias):
+            created.extend(create_partitions(alias, months_ahead))
+    return created
+
+
+def create_partitions(using, months_ahead):
+
+    """
+    Creating the missing monthly partitions of TradeHistory of a database
+
+    Returns:
+    list: Names of partitions created
+    """
+    created = []
+    month = month_start(timezone.now().date())
+    with connections[using].cursor() as cursor:
+        for _ in range(months_ahead + 1):
+            name = '{table}_p{month}'.format(table=PARTITION_TABLE,
+                month=month.strftime('%Y%m'))
+            cursor.execute('SELECT to_regclass(%s)', [name])
+            if cursor.fetchone()[0] is None:
+                cursor.execute(
+                    "CREATE TABLE {name} PARTITION OF {table} "
+                    "FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                        name=name, table=PARTITION_TABLE,
+                        start=month.isoformat(),
+                        end=next_month(month).isoformat()))
+                created.append(name)
+            month = next_month(month)
+    return created
+
+
+def drop_empty_partitions(before):
+
+    """
+    Detaching & dropping monthly partitions of the database being routed
+    older than the month of before left empty by archival
+
+    Returns:
+    list: Names of partitions dropped
+    """
+    if not partitioned():
+        return []
+    dropped = []
+    with connections[current_database()].cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = %s AND child.relname ~ '_p[0-9]{6}$'",
+            [PARTITION_TABLE])
+        cold = '{table}_p{month}'.format(table=PARTITION_TABLE,
+            month=month_start(before).strftime('%Y%m'))
+        for name, in cursor.fetchall():
+            if name >= cold:
+                continue
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM {name})'.format(
+                name=name))
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute('ALTER TABLE {table} DETACH PARTITION {name}'
+                .format(table=PARTITION_TABLE, name=name))
+            cursor.execute('DROP TABLE {name}'.format(name=name))
+            dropped.append(name)
+    return dropped
+
+
+def archivable(checkpoint_id, before):
+
+    """
+    Versions which can leave the database - created before `before` &
+    superseded by a newer version of their trade at or before the
+    checkpoint, so replays from that checkpoint never need them & the
+    latest version of every trade stays hot
+
+    Returns:
+    QuerySet: TradeHistory versions
+    """
+    newer = TradeHistory.objects.filter(
+        trade_reference=models.OuterRef('trade_reference'),
+        pk__gt=models.OuterRef('pk'), pk__lte=checkpoint_id)
+    return TradeHistory.objects.filter(pk__lte=checkpoint_id,
+        created_at__lt=before).filter(models.Exists(newer))
+
+
+def encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def write_archive(path, versions, block_size=ARCHIVE_BLOCK):
+
+    """
+    Writing versions as gzipped JSONL, each block a separate gzip member
+    (the file stays readable with zcat), block by block so versions are
+    streamed rather than held in memory
+
+    Parameters:
+    path (str): Archive file path
+    versions (iterable): Version dicts in id order
+
+    Returns:
+    dict: HistoryArchive fields - first_id, last_id, rows, blocks as
+    [offset, length, first_id, last_id] & trades (block numbers keyed by
+    trade id), None when there was no version
+    """
+    versions = iter(versions)
+    summary = {'rows': 0, 'blocks': [], 'trades': {}}
+    with open(path, 'wb') as stream:
+        while True:
+            block = list(itertools.islice(versions, block_size))
+            if not block:
+                break
+            data = gzip.compress(''.join(
+                json.dumps(version, default=encode) + '\n'
+                for version in block).encode('utf-8'))
+            for trade_id in set(version['trade_reference_id']
+                    for version in block):
+                summary['trades'].setdefault(str(trade_id), []).append(
+                    len(summary['blocks']))
+            summary['blocks'].append([stream.tell(), len(data),
+                block[0]['id'], block[-1]['id']])
+            summary['rows'] += len(block)
+            summary.setdefault('first_id', block[0]['id'])
+            summary['last_id'] = block[-1]['id']
+            stream.write(data)
+    if not summary['rows']:
+        os.remove(path)
+        return None
+    return summary
+
+
+def archive(days=None, block_size=ARCHIVE_BLOCK):
+
+    """
+    Moving cold, superseded TradeHistory versions of every portfolio
+    database into one archive file per database & month, checkpointing
+    positions first
+
+    Parameters:
+    days (int): Versions older than days are archived,
+        PORTFOLIO_HISTORY_HOT_DAYS setting by default
+    block_size (int): Versions per compressed block
+
+    Returns:
+    list: List of HistoryArchive written
+    """
+    if days is None:
+        days = getattr(settings, 'PORTFOLIO_HISTORY_HOT_DAYS', HOT_DAYS)
+    ensure_partitions()
+    archives = []
+    for alias in routed_databases():
+        archives.extend(archive_database(alias, days, block_size))
+    return archives
+
+
+def archive_database(alias, days, block_size=ARCHIVE_BLOCK):
+
+    """
+    Archiving cold, superseded TradeHistory versions of the database being
+    routed month by month, the versions of a month being streamed into its
+    file & archives being indexed alongside the versions they replace
+
+    Returns:
+    list: List of HistoryArchive written
+    """
+    from portfolio.snapshots import snapshot_database
+    snapshot_database(alias, force=True)
+    checkpoint_id, taken_at = PositionSnapshot.objects.checkpoint()
+    if not checkpoint_id:
+        return []
+    before = min(timezone.now() - datetime.timedelta(days=days), taken_at)
+    os.makedirs(archive_dir(), exist_ok=True)
+    archives = []
+    versions = archivable(checkpoint_id, before)
+    first = versions.aggregate(first=models.Min('created_at'))['first']
+    month = first and month_start(first.date())
+    while month is not None and month <= before.date():
+        start, end = (datetime.datetime.combine(day, datetime.time(),
+            datetime.timezone.utc) for day in (month, next_month(month)))
+        rows = versions.filter(created_at__gte=start, created_at__lt=end)
+        path = os.path.join(archive_dir(),
+            'trade_history_{prefix}{month}.jsonl.gz.tmp'.format(
+                prefix=archive_prefix(alias), month=month.strftime('%Y%m')))
+        summary = write_archive(path, rows.order_by('pk')
+            .values(*ARCHIVE_FIELDS).iterator(chunk_size=block_size),
+            block_size)
+        if summary is not None:
+            name = 'trade_history_{prefix}{month}_{first}_{last}.jsonl.gz' \
+                .format(prefix=archive_prefix(alias),
+                    month=month.strftime('%Y%m'), first=summary['first_id'],
+                    last=summary['last_id'])
+            os.replace(path, os.path.join(archive_dir(), name))
+            with atomic():
+                archives.append(HistoryArchive.objects.create(path=name,
+                    month=month, checkpoint_id=checkpoint_id, **summary))
+                rows.filter(pk__lte=summary['last_id']).delete()
+        month = next_month(month)
+    drop_empty_partitions(before)
+    return archives
+
+
+def archive_prefix(alias):
+
+    """
+    Returns:
+    str: Archive file name prefix keeping files of databases apart, history
+    ids being per database
+    """
+    return '' if alias == DEFAULT_DB_ALIAS else '{alias}_'.format(
+        alias=alias)
+
+
+def purge_inactive(days=None, batch_size=PURGE_BATCH):
+
+    """
+    Hard deleting trades & tickers soft deleted for longer than days from
+    every portfolio database, in batches each locking its own rows for one
+    short transaction. Versions of purged trades are archived first & the
+    archive horizon moves to the latest checkpoint, which already accounts
+    for them
+
+    Parameters:
+    days (int): Rows inactive for longer than days are purged,
+        PORTFOLIO_PURGE_DAYS setting by default
+    batch_size (int): Rows per transaction
+
+    Returns:
+    tuple: Number of trades & tickers purged
+    """
+    if days is None:
+        days = getattr(settings, 'PORTFOLIO_PURGE_DAYS', PURGE_DAYS)
+    before = timezone.now() - datetime.timedelta(days=days)
+    purged_trades = 0
+    for alias in routed_databases():
+        purged_trades += purge_trades(alias, before, batch_size)
+    return purged_trades, purge_tickers(before, batch_size)
+
+
+def purge_trades(alias, before, batch_size=PURGE_BATCH):
+
+    """
+    Hard deleting trades of the portfolio database being routed which were
+    soft deleted before before & have no version after its checkpoint
+
+    Returns:
+    int: Number of trades purged
+    """
+    from portfolio.snapshots import snapshot_database
+    snapshot_database(alias, force=True)
+    checkpoint_id, taken_at = PositionSnapshot.objects.db_manager(alias) \
+        .checkpoint()
+    if not checkpoint_id:
+        return 0
+    pending = TradeHistory.objects.filter(
+        trade_reference=models.OuterRef('pk'), pk__gt=checkpoint_id)
+    trades = Trade.all_objects.using(alias).filter(active=False,
+            modified_at__lt=min(before, taken_at)) \
+        .exclude(models.Exists(pending)).order_by('modified_at', 'id')
+    os.makedirs(archive_dir(), exist_ok=True)
+    purged = 0
+    while True:
+        with transaction.atomic(using=alias):
+            ids = list(trades.select_for_update(skip_locked=True,
+                of=('self',)).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            versions = list(TradeHistory.objects.using(alias).filter(
+                    trade_reference__in=ids).order_by('pk') \
+                .values(*ARCHIVE_FIELDS))
+            if versions:
+                path = 'trade_history_purge_{prefix}{first}_{last}' \
+                    '.jsonl.gz'.format(prefix=archive_prefix(alias),
+                        first=versions[0]['id'], last=versions[-1]['id'])
+                HistoryArchive.objects.using(alias).create(path=path,
+                    month=month_start(versions[0]['created_at'].date()),
+                    checkpoint_id=checkpoint_id,
+                    **write_archive(os.path.join(archive_dir(), path),
+                        versions))
+                TradeHistory.objects.using(alias).filter(
+                    trade_reference__in=ids).delete()
+            Trade.all_objects.using(alias).filter(pk__in=ids).delete()
+        purged += len(ids)
+    return purged
+
+
+def purge_tickers(before, batch_size=PURGE_BATCH):
+
+    """
+    Hard deleting tickers soft deleted before before from the default
+    database & their copies, tickers still referenced by a trade or
+    version of any portfolio database being kept
+
+    Returns:
+    int: Number of tickers purged
+    """
+    referenced = set()
+    for alias in portfolio_databases():
+        if alias != DEFAULT_DB_ALIAS:
+            for manager in (Trade.all_objects, TradeHistory.objects):
+                referenced.update(manager.using(alias).order_by() \
+                    .values_list('ticker_id', flat=True).distinct())
+    tickers = Ticker.all_objects.using(DEFAULT_DB_ALIAS).filter(
+            active=False, modified_at__lt=before) \
+        .exclude(models.Exists(Trade.all_objects.filter(
+            ticker=models.OuterRef('pk')))) \
+        .exclude(models.Exists(TradeHistory.objects.filter(
+            ticker=models.OuterRef('pk')))) \
+        .exclude(pk__in=referenced) \
+        .order_by('modified_at', 'id')
+    purged = 0
+    while True:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            ids = list(tickers.select_for_update(skip_locked=True,
+                of=('self',)).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            for alias in portfolio_databases():
+                Ticker.all_objects.using(alias).filter(pk__in=ids).delete()
+        purged += len(ids)
+    return purged
+
+
+class ArchiveReader:
+
+    """
+    ArchiveReader class reading archived versions through a memory map of
+    archive files, decompressing the blocks needed only
+    """
+
+    def versions(self, archive, before_id=None, trade_id=None):
+
+        """
+        Reading versions of an archive newest first
+
+        Parameters:
+        archive (HistoryArchive): Archive
+        before_id (int): Reading versions with a smaller id only
+        trade_id (int): Reading versions of a trade only, from the blocks
+            its index lists
+
+        Returns:
+        generator: Version dicts
+        """
+        blocks = archive.blocks
+        if trade_id is not None:
+            blocks = [blocks[number]
+                for number in archive.trades.get(str(trade_id), [])]
+        path = os.path.join(archive_dir(), archive.path)
+        with open(path, 'rb') as stream, \
+                mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, length, first_id, _ in reversed(blocks):
+                if before_id is not None and first_id >= before_id:
+                    continue
+                lines = zlib.decompress(data[offset:offset + length],
+                    zlib.MAX_WBITS | 16).decode('utf-8').splitlines()
+                for line in reversed(lines):
+                    version = json.loads(line)
+                    if (before_id is None or version['id'] < before_id) and \
+                            (trade_id is None or
+                            version['trade_reference_id'] == trade_id):
+                        yield version
+
+    def page(self, trade_id=None, before_id=None, page_size=50,
+            portfolio_id=None):
+
+        """
+        Reading a page of archived versions newest first
+
+        Parameters:
+        trade_id (int): Restricting versions to a trade
+        before_id (int): Cursor, versions with a smaller id only
+        page_size (int): Versions per page
+        portfolio_id (int): Restricting versions to a portfolio, versions
+            archived before portfolios belonging to the default one
+
+        Returns:
+        tuple: List of versions & whether more exist
+        """
+        # Only ids & paths are loaded up front, blocks & the trade index of
+        # an archive being loaded once the page reaches its last_id
+        archives = HistoryArchive.objects.order_by('-last_id') \
+            .defer('blocks', 'trades')
+        if before_id is not None:
+            archives = archives.filter(first_id__lt=before_id)
+        archives = iter(archives)
+        upcoming = next(archives, None)
+        # Archives of purges overlap monthly ones, so their versions are
+        # merged newest first
+        heap, counter, rows = [], itertools.count(), []
+        while True:
+            while upcoming is not None and (not heap or
+                    -heap[0][0] <= upcoming.last_id):
+                upcoming.refresh_from_db(fields=['blocks', 'trades'])
+                # trades__has_key reads digit keys as array indexes on SQLite
+                if trade_id is None or str(trade_id) in upcoming.trades:
+                    self.push(heap, counter, self.versions(upcoming,
+                        before_id, trade_id))
+                upcoming = next(archives, None)
+            if not heap:
+                return rows, False
+            _, _, version, versions = heapq.heappop(heap)
+            self.push(heap, counter, versions)
+            if portfolio_id is None or portfolio_id == \
+                    version.get('portfolio_id', DEFAULT_PORTFOLIO):
+                rows.append(version)
+                if len(rows) > page_size:
+                    return rows[:page_size], True
+
+    @staticmethod
+    def push(heap, counter, versions):
+
+        """
+        Pushing the next version of a generator of versions newest first
+        onto the heap merging archives, dropping exhausted generators
+        """
+        version = next(versions, None)
+        if version is not None:
+            heapq.heappush(heap, (-version['id'], next(counter), version,
+                versions))
@@ -0,0 +1,225 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.db import connections
+
+from portfolio.caching import bump_version
+from portfolio.models import LotQueue, Position, Ticker, Trade, TradeHistory
+from portfolio.routers import atomic, current_portfolio, routed
+from portfolio.serializers import TradeImportSerializer
+
+"""
+    Constants for trade imports
+        FORMATS: Supported file formats
+        DEFAULT_CHUNK_SIZE: Rows written per bulk_create
+"""
+FORMATS = ('csv', 'jsonl', 'json')
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def guess_format(filename, file_format=None):
+
+    """
+    Resolving the format of a trade file from an explicit format or the
+    file extension
+
+    Returns:
+    str: One of FORMATS
+    """
+    file_format = (file_format or
+        os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    if file_format not in FORMATS:
+        raise ValueError('Unsupported trade file format {file_format!r}, '
+            'expected one of {formats}'.format(file_format=file_format,
+            formats=', '.join(FORMATS)))
+    return file_format
+
+
+def read_rows(stream, file_format):
+
+    """
+    Reading trade rows from a CSV, JSON lines or JSON array file
+
+    Parameters:
+    stream (file): Text or binary file object
+    file_format (str): One of FORMATS
+
+    Returns:
+    iterator: Row dicts having ticker_id or ticker_symbol, category,
+    quantity & price
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8')
+    if file_format == 'csv':
+        return csv.DictReader(stream)
+    if file_format == 'jsonl':
+        return (json.loads(line) for line in stream if line.strip())
+    return iter(json.load(stream))
+
+
+class TradeImporter:
+
+    """
+    TradeImporter class validating a batch of trades in memory & writing
+    Trade/TradeHistory rows with bulk_create inside one transaction
+
+    Attributes:
+        chunk_size (int): Rows written per bulk_create
+        strict (bool): strict True writes nothing when any row is invalid
+        portfolio_id (int): Portfolio of the trades, the current portfolio
+            by default
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, strict=False,
+            portfolio_id=None):
+        if int(chunk_size) < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        self.chunk_size = int(chunk_size)
+        self.strict = strict
+        self.portfolio_id = current_portfolio() if portfolio_id is None \
+            else portfolio_id
+
+    def run(self, rows):
+
+        """
+        Importing trade rows, rows being applied in the given
+        (chronological) order so sells are checked against the quantity
+        available at that point
+
+        Parameters:
+        rows (iterable): Row dicts
+
+        Returns:
+        dict: Import summary - received, imported, errors having row
+        number & errors, seconds, rows_per_second
+        """
+        started = time.perf_counter()
+        rows = list(rows)
+        errors = []
+        with routed(self.portfolio_id), atomic():
+            trades = self.validate(rows, errors)
+            if errors and self.strict:
+                trades = []
+            trades = self.write(trades)
+        seconds = time.perf_counter() - started
+        return {
+            'received': len(rows),
+            'imported': len(trades),
+            'errors': sorted(errors, key=lambda error: error['row']),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(len(rows) / seconds) if seconds else 0
+        }
+
+    def validate(self, rows, errors):
+
+        """
+        Validating rows field by field, then oversell per ticker against
+        positions locked for the transaction
+
+        Returns:
+        list: List of unsaved Trade instances for valid rows
+        """
+        symbols = set(row.get('ticker_symbol') for row in rows
+            if not row.get('ticker_id') and row.get('ticker_symbol'))
+        ticker_by_symbol = dict(Ticker.objects.filter(symbol__in=symbols) \
+            .values_list('symbol', 'id')) if symbols else {}
+        validated = []
+        for number, row in enumerate(rows, 1):
+            row = dict(row)
+            if not row.get('ticker_id') and row.get('ticker_symbol'):
+                row['ticker_id'] = ticker_by_symbol.get(row['ticker_symbol'])
+                if row['ticker_id'] is None:
+                    errors.append({'row': number, 'errors': {
+                        'ticker_symbol': 'Unknown ticker symbol {symbol}' \
+                        .format(symbol=row['ticker_symbol'])}})
+                    continue
+            serializer = TradeImportSerializer(data=row)
+            if not serializer.is_valid():
+                errors.append({'row': number, 'errors': serializer.errors})
+                continue
+            validated.append((number, serializer.validated_data))
+        ticker_ids = set(data['ticker_id'] for _, data in validated)
+        existing = set(Ticker.objects.filter(id__in=ticker_ids) \
+            .values_list('id', flat=True))
+        available = dict(Position.objects.select_for_update() \
+            .filter(portfolio_id=self.portfolio_id,
+                ticker_id__in=ticker_ids) \
+            .values_list('ticker_id', 'final_quantity'))
+        trades = []
+        for number, data in validated:
+            ticker_id = data['ticker_id']
+            available_qty = available.get(ticker_id, 0)
+            error = None
+            if ticker_id not in existing:
+                error = {'ticker_id': 'Ticker {ticker_id} does not exist' \
+                    .format(ticker_id=ticker_id)}
+            elif data['category'] == Trade.CATEGORY_SOLD:
+                if available_qty <= 0:
+                    error = {'Quantity': 'No quantity available to sell'}
+                elif data['quantity'] > available_qty:
+                    error = {'Quantity': 'Available quantity to sell '
+                        '{available_qty}'.format(available_qty=available_qty)}
+            if error:
+                errors.append({'row': number, 'errors': error})
+                continue
+            available[ticker_id] = available_qty + (data['quantity']
+                if data['category'] == Trade.CATEGORY_BOUGHT
+                else -data['quantity'])
+            trades.append(Trade(portfolio_id=self.portfolio_id, **data))
+        return trades
+
+    def write(self, trades):
+
+        """
+        Writing trades & their first TradeHistory version in chunks &
+        applying the totals of the rows written over positions & lot
+        queues once per ticker. Backends unable to return the ids of bulk
+        inserts (SQLite) insert trades one by one
+
+        Returns:
+        list: List of Trade instances written
+        """
+        returning = connections[Trade.objects.db].features \
+            .can_return_rows_from_bulk_insert
+        deltas = {}
+        written = []
+        for start in range(0, len(trades), self.chunk_size):
+            chunk = trades[start:start + self.chunk_size]
+            if returning:
+                chunk = Trade.objects.bulk_create(chunk)
+            else:
+                for trade in chunk:
+                    # save_base inserts the row & sets its id, bypassing
+                    # Trade.save as the batch maintains positions & history
+                    trade.save_base()
+            TradeHistory.objects.bulk_create([TradeHistory(
+                    trade_reference_id=trade.pk,
+                    portfolio_id=trade.portfolio_id,
+                    category=trade.category,
+                    quantity=trade.quantity,
+                    ticker_id=trade.ticker_id,
+                    price=trade.price
+                ) for trade in chunk])
+            for trade in chunk:
+                Position.objects.add_delta(deltas, {
+                    'portfolio_id': trade.portfolio_id,
+                    'ticker_id': trade.ticker_id,
+                    'category': trade.category,
+                    'quantity': trade.quantity,
+                    'price': trade.price
+                })
+            written.extend(chunk)
+        Position.objects.apply_deltas(deltas)
+        LotQueue.objects.apply_trades([{
+                'portfolio_id': trade.portfolio_id,
+                'ticker_id': trade.ticker_id,
+                'category': trade.category,
+                'quantity': trade.quantity,
+                'price': trade.price
+            } for trade in written])
+        if written:
+            bump_version()
+        return written
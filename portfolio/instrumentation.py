@@ -0,0 +1,342 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from django.shortcuts import render as render_template
+
+logger = logging.getLogger(__name__)
+
+"""
+    Constants for request instrumentation, overridden by settings
+        METRICS_BUFFER: Requests kept by the ring buffer for quantiles
+        PROFILE_SLOW_MS: Sampled requests slower than this are dumped
+        QUANTILES: Quantiles of request time exposed per endpoint
+        PHASES: Phases timed within requests - db (queries), aggregation
+            (Python holdings/returns/analytics), validation (trade
+            validation), serialization (serializers) & render (templates).
+            Phases are inclusive, db time overlapping the others
+"""
+METRICS_BUFFER = 10000
+PROFILE_SLOW_MS = 500
+QUANTILES = (0.5, 0.9, 0.99)
+PHASES = ('db', 'aggregation', 'validation', 'serialization', 'render')
+
+current = contextvars.ContextVar('timings', default=None)
+
+Sample = collections.namedtuple('Sample',
+    ('endpoint', 'method', 'status', 'seconds', 'queries', 'phases'))
+
+
+class RequestTimings:
+
+    """
+    RequestTimings class accumulating phase timings & queries of one
+    request, shared by the worker threads of its async database calls
+
+    Attributes:
+        phases (dict): Seconds keyed by phase
+        queries (int): Number of queries executed
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.queries = 0
+
+    def add(self, phase, seconds, queries=0):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            self.queries += queries
+
+
+@contextlib.contextmanager
+def timed(phase):
+
+    """
+    Context manager adding its wall time to a phase of the current
+    request, doing nothing outside instrumented requests
+
+    Parameters:
+    phase (str): One of PHASES
+    """
+    timings = current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def instrumented(phase):
+
+    """
+    Decorator timing a function as a phase of the current request
+
+    Parameters:
+    phase (str): One of PHASES
+
+    Returns:
+    function: Decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_queries(recorder):
+
+    """
+    Adding queries & database time of a QueryRecorder to the current request
+    """
+    timings = current.get()
+    if timings is not None:
+        timings.add('db', recorder.duration, recorder.count)
+
+
+@instrumented('render')
+def render(request, template_name, context=None, **kwargs):
+
+    """
+    django.shortcuts.render timed as the render phase
+
+    Returns:
+    HttpResponse: Rendered template
+    """
+    return render_template(request, template_name, context, **kwargs)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def quantile(values, q):
+
+    """
+    Returns:
+    float: Nearest-rank quantile of sorted values
+    """
+    rank = int(round(q * len(values))) - 1
+    return values[min(len(values) - 1, max(0, rank))]
+
+
+class MetricsBuffer:
+
+    """
+    MetricsBuffer class keeping the latest requests in a ring buffer, for
+    quantiles, & per-endpoint totals since the process started, rendered
+    in the Prometheus text format
+
+    Attributes:
+        samples (deque): Latest Sample of requests
+        totals (dict): Requests, seconds & queries keyed by endpoint
+        phase_totals (dict): Seconds keyed by endpoint & phase
+        statuses (dict): Requests keyed by endpoint & status code
+    """
+
+    def __init__(self, size=None):
+        self.lock = threading.Lock()
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.samples = collections.deque(maxlen=self.size or getattr(
+                settings, 'PORTFOLIO_METRICS_BUFFER', METRICS_BUFFER))
+            self.totals = {}
+            self.phase_totals = {}
+            self.statuses = {}
+
+    def record(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+            totals = self.totals.setdefault(sample.endpoint, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += sample.seconds
+            totals[2] += sample.queries
+            for phase, seconds in sample.phases.items():
+                key = (sample.endpoint, phase)
+                self.phase_totals[key] = self.phase_totals.get(key, 0.0) + \
+                    seconds
+            key = (sample.endpoint, sample.status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self):
+
+        """
+        Returns:
+        str: Metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            samples = list(self.samples)
+            totals = dict(self.totals)
+            phase_totals = dict(self.phase_totals)
+            statuses = dict(self.statuses)
+        windows = {}
+        for sample in samples:
+            windows.setdefault(sample.endpoint, []).append(sample.seconds)
+        lines = [
+            '# HELP portfolio_request_seconds Request wall time, quantiles '
+            'over the latest {size} requests'.format(size=len(samples)),
+            '# TYPE portfolio_request_seconds summary']
+        for endpoint, (count, seconds, _) in sorted(totals.items()):
+            label = 'endpoint="{endpoint}"'.format(endpoint=escape(endpoint))
+            window = sorted(windows.get(endpoint, ()))
+            if window:
+                lines.extend('portfolio_request_seconds{{{label},'
+                    'quantile="{q}"}} {value:.6f}'.format(label=label, q=q,
+                        value=quantile(window, q)) for q in QUANTILES)
+            lines.append('portfolio_request_seconds_sum{{{label}}} '
+                '{value:.6f}'.format(label=label, value=seconds))
+            lines.append('portfolio_request_seconds_count{{{label}}} '
+                '{count}'.format(label=label, count=count))
+        lines.extend([
+            '# HELP portfolio_request_queries_total Queries run by requests',
+            '# TYPE portfolio_request_queries_total counter'])
+        lines.extend('portfolio_request_queries_total{{endpoint='
+            '"{endpoint}"}} {count}'.format(endpoint=escape(endpoint),
+                count=queries)
+            for endpoint, (_, _, queries) in sorted(totals.items()))
+        lines.extend([
+            '# HELP portfolio_phase_seconds_total Time spent in phases of '
+            'requests, db overlapping other phases',
+            '# TYPE portfolio_phase_seconds_total counter'])
+        lines.extend('portfolio_phase_seconds_total{{endpoint="{endpoint}",'
+            'phase="{phase}"}} {value:.6f}'.format(endpoint=escape(endpoint),
+                phase=phase, value=seconds)
+            for (endpoint, phase), seconds in sorted(phase_totals.items()))
+        lines.extend([
+            '# HELP portfolio_requests_total Requests by status code',
+            '# TYPE portfolio_requests_total counter'])
+        lines.extend('portfolio_requests_total{{endpoint="{endpoint}",'
+            'status="{status}"}} {count}'.format(endpoint=escape(endpoint),
+                status=status, count=count)
+            for (endpoint, status), count in sorted(statuses.items()))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsBuffer()
+
+
+def endpoint_of(request):
+
+    """
+    Returns:
+    str: URL name of the view of a request, keeping label cardinality low
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+def sync_and_async(middleware_class):
+
+    """
+    Turning a middleware class into a middleware factory serving both
+    modes, async requests being passed to the __acall__ coroutine method
+    of the instance so the handler chain sees a coroutine function
+
+    Parameters:
+    middleware_class (class): Middleware class having an __acall__ method
+
+    Returns:
+    function: Middleware factory
+    """
+    @sync_and_async_middleware
+    @functools.wraps(middleware_class, updated=())
+    def factory(get_response):
+        middleware = middleware_class(get_response)
+        if asyncio.iscoroutinefunction(get_response):
+            return middleware.__acall__
+        return middleware
+    return factory
+
+
+class InstrumentationMiddleware:
+
+    """
+    Middleware timing every request & its phases into the metrics ring
+    buffer. With PORTFOLIO_PROFILE_RATE setting above 0, that fraction of
+    synchronous requests runs under cProfile, profiles of requests slower
+    than PORTFOLIO_PROFILE_SLOW_MS being dumped as pstats files into
+    PORTFOLIO_PROFILE_DIR
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current.set(timings)
+        profiler = None
+        if random.random() < getattr(settings, 'PORTFOLIO_PROFILE_RATE', 0):
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        seconds = time.perf_counter() - started
+        self.record(request, response, timings, seconds)
+        if profiler is not None:
+            self.dump(request, profiler, seconds)
+        return response
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.record(request, response, timings,
+            time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, timings, seconds):
+        with timings.lock:
+            phases = dict(timings.phases)
+            queries = timings.queries
+        metrics.record(Sample(endpoint_of(request), request.method,
+            response.status_code, seconds, queries, phases))
+
+    def dump(self, request, profiler, seconds):
+        if seconds * 1000 < getattr(settings, 'PORTFOLIO_PROFILE_SLOW_MS',
+                PROFILE_SLOW_MS):
+            return
+        directory = getattr(settings, 'PORTFOLIO_PROFILE_DIR',
+            os.path.join(str(settings.BASE_DIR), 'profiles'))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{stamp}_{endpoint}_{ms}ms.prof' \
+            .format(stamp=time.strftime('%Y%m%dT%H%M%S'),
+            endpoint=re.sub(r'\W+', '-', endpoint_of(request)),
+            ms=int(seconds * 1000)))
+        profiler.dump_stats(path)
+        logger.warning('%s %s took %.0fms, profile written to %s',
+            request.method, request.path, seconds * 1000, path)
+
+
+instrumentation_middleware = sync_and_async(InstrumentationMiddleware)
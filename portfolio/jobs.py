@@ -0,0 +1,274 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+
+from portfolio.history import ARCHIVE_BLOCK, archive, ensure_partitions
+from portfolio.imports import DEFAULT_CHUNK_SIZE, TradeImporter, read_rows
+from portfolio.models import Job, LotQueue, Position
+from portfolio.routers import DEFAULT_PORTFOLIO, routed
+
+logger = logging.getLogger(__name__)
+
+"""
+    Constants for background jobs, overridden by settings
+        WORKERS: Worker processes of run_workers
+        POLL: Seconds an idle worker waits before polling the queue again
+        TIMEOUT: Seconds a job may run before being presumed dead & requeued
+        RETENTION_DAYS: Days finished jobs are kept
+        MAINTENANCE_EVERY: Seconds between requeues of stale jobs, pruning
+            of finished jobs & creation of upcoming TradeHistory
+            partitions by each idle worker
+"""
+WORKERS = 2
+POLL = 1.0
+TIMEOUT = 3600
+RETENTION_DAYS = 7
+MAINTENANCE_EVERY = 60
+
+HANDLERS = {}
+
+
+def handler(kind):
+
+    """
+    Decorator registering a function as the handler of a kind of job, its
+    keyword arguments being the arguments of the job & its JSON
+    serializable return value the result
+
+    Parameters:
+    kind (str): Kind of job
+
+    Returns:
+    function: Decorator
+    """
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+    return decorator
+
+
+def upload_dir():
+    return getattr(settings, 'PORTFOLIO_JOB_UPLOAD_DIR',
+        os.path.join(str(settings.BASE_DIR), 'uploads'))
+
+
+@handler('recompute_ticker')
+def recompute_ticker(portfolio_id, ticker_id):
+
+    """
+    Replaying trades of a ticker into its lot queues & refreshing returns
+    of dirty positions
+    """
+    with routed(portfolio_id):
+        queues = LotQueue.objects.rebuild([ticker_id], portfolio_id)
+        positions = Position.objects.refresh_returns()
+    return {'lot_queues': queues, 'positions': positions}
+
+
+@handler('rebuild_positions')
+def rebuild_positions():
+
+    """
+    Rebuilding the Position & LotQueue tables of every portfolio database
+    from Trade
+    """
+    return {'positions': Position.objects.rebuild(),
+        'lot_queues': LotQueue.objects.rebuild()}
+
+
+@handler('import_trades')
+def import_trades(path, file_format, portfolio_id=DEFAULT_PORTFOLIO,
+        strict=False, chunk_size=DEFAULT_CHUNK_SIZE, remove=False):
+
+    """
+    Importing trades of a file, removed once imported when remove is True
+    (uploads)
+    """
+    with open(path, newline='', encoding='utf-8') as stream:
+        result = TradeImporter(chunk_size=chunk_size, strict=strict,
+            portfolio_id=portfolio_id).run(read_rows(stream, file_format))
+    if remove:
+        os.remove(path)
+    return result
+
+
+@handler('archive_history')
+def archive_history(days=None, block_size=ARCHIVE_BLOCK):
+
+    """
+    Archiving cold, superseded trade versions
+    """
+    return {'archives': [history_archive.path
+        for history_archive in archive(days, block_size)]}
+
+
+def save_upload(upload, file_format):
+
+    """
+    Writing an uploaded trade file where workers can read it
+
+    Parameters:
+    upload (UploadedFile): Uploaded file
+    file_format (str): One of portfolio.imports.FORMATS
+
+    Returns:
+    str: Path of the written file
+    """
+    os.makedirs(upload_dir(), exist_ok=True)
+    path = os.path.join(upload_dir(), '{name}.{file_format}'.format(
+        name=uuid.uuid4().hex, file_format=file_format))
+    with open(path, 'wb') as stream:
+        for chunk in upload.chunks():
+            stream.write(chunk)
+    return path
+
+
+def run(job):
+
+    """
+    Running a claimed job through its handler, a failed attempt being
+    retried later
+
+    Returns:
+    bool: Whether the job succeeded
+    """
+    function = HANDLERS.get(job.kind)
+    started = time.perf_counter()
+    try:
+        if function is None:
+            raise ValueError('Unknown job kind {kind!r}'.format(
+                kind=job.kind))
+        result = function(**job.arguments)
+    except Exception as error:
+        logger.exception('Job %s (%s) failed on attempt %s', job.pk,
+            job.kind, job.attempts)
+        job.retry('{name}: {error}'.format(name=type(error).__name__,
+            error=error))
+        return False
+    job.finish(result)
+    logger.info('Job %s (%s) done in %.3fs', job.pk, job.kind,
+        time.perf_counter() - started)
+    return True
+
+
+def work(worker=None, kinds=None, once=False, poll=None, stop=None):
+
+    """
+    Claiming & running jobs one at a time, an idle worker requeuing stale
+    jobs, pruning finished ones & creating upcoming TradeHistory
+    partitions every MAINTENANCE_EVERY seconds
+
+    Parameters:
+    worker (str): Name of the worker, host & pid by default
+    kinds (iterable): Restricting jobs to these kinds
+    once (bool): once True returns when no job is due instead of polling
+    poll (float): Seconds between polls, PORTFOLIO_JOB_POLL setting by
+        default
+    stop (Event): Event set to stop after the job running
+
+    Returns:
+    int: Number of jobs run
+    """
+    if worker is None:
+        worker = '{host}:{pid}'.format(host=socket.gethostname(),
+            pid=os.getpid())
+    if poll is None:
+        poll = getattr(settings, 'PORTFOLIO_JOB_POLL', POLL)
+    processed = 0
+    maintained = 0
+    while stop is None or not stop.is_set():
+        job = Job.objects.claim(worker, kinds)
+        if job is not None:
+            run(job)
+            processed += 1
+            continue
+        if time.monotonic() - maintained > MAINTENANCE_EVERY:
+            Job.objects.requeue_stale(getattr(settings,
+                'PORTFOLIO_JOB_TIMEOUT', TIMEOUT))
+            Job.objects.prune(getattr(settings,
+                'PORTFOLIO_JOB_RETENTION_DAYS', RETENTION_DAYS))
+            ensure_partitions()
+            maintained = time.monotonic()
+        if once:
+            break
+        if stop is not None:
+            stop.wait(poll)
+        else:
+            time.sleep(poll)
+    return processed
+
+
+def serve(index, kinds, once, poll, stop):
+
+    """
+    Entry point of a worker process, stopping after its current job on
+    SIGTERM & leaving SIGINT to the pool
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    connections.close_all()
+    try:
+        work('{host}:{pid}:{index}'.format(host=socket.gethostname(),
+            pid=os.getpid(), index=index), kinds, once, poll, stop)
+    finally:
+        connections.close_all()
+
+
+def run_workers(processes=None, kinds=None, once=False, poll=None):
+
+    """
+    Running a pool of worker processes (forked, each opening its own
+    database connections), dead workers being replaced until SIGINT or
+    SIGTERM asks every worker to stop after its current job
+
+    Parameters:
+    processes (int): Worker processes, PORTFOLIO_JOB_WORKERS setting by
+        default, 1 working in this process
+    kinds (iterable): Restricting jobs to these kinds
+    once (bool): once True stops workers when no job is due
+    poll (float): Seconds between polls of idle workers
+
+    Returns:
+    int: Number of jobs run, when working in this process only
+    """
+    if processes is None:
+        processes = getattr(settings, 'PORTFOLIO_JOB_WORKERS', WORKERS)
+    if processes <= 1:
+        return work(kinds=kinds, once=once, poll=poll)
+    context = multiprocessing.get_context('fork')
+    stop = context.Event()
+    previous = dict((signum, signal.signal(signum,
+            lambda *args: stop.set()))
+        for signum in (signal.SIGINT, signal.SIGTERM))
+    connections.close_all()
+
+    def start(index):
+        process = context.Process(target=serve,
+            args=(index, kinds, once, poll, stop), daemon=True)
+        process.start()
+        return process
+
+    pool = [start(index) for index in range(processes)]
+    try:
+        while any(process.is_alive() for process in pool):
+            for index, process in enumerate(pool):
+                process.join(0.5 / processes)
+                if not process.is_alive() and process.exitcode and \
+                        not once and not stop.is_set():
+                    logger.warning('Worker %s exited with %s, restarting',
+                        index, process.exitcode)
+                    pool[index] = start(index)
+    finally:
+        stop.set()
+        for process in pool:
+            process.join()
+        for signum, function in previous.items():
+            signal.signal(signum, function)
+    return None
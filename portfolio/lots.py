@@ -0,0 +1,254 @@
+import struct
+from array import array
+from decimal import Decimal
+
+"""
+    Constants for lot matching methods
+        FIFO: Sells close the oldest open lots first
+        LIFO: Sells close the newest open lots first
+        AVERAGE: Sells close open quantity at its running average cost
+"""
+FIFO = 1
+LIFO = 2
+AVERAGE = 3
+METHOD_CHOICES = (
+        (FIFO, 'fifo'),
+        (LIFO, 'lifo'),
+        (AVERAGE, 'average')
+    )
+METHODS = dict((name, method) for method, name in METHOD_CHOICES)
+
+CENT = Decimal('0.01')
+
+"""
+    Constants for checkpoints of lot matching state
+        CHECKPOINT_TAIL: Trades of a book replayed after its checkpoint,
+            edits of those trades resuming from the checkpoint
+        HEADER: Open quantity, open cost & realized P&L packed before lots
+"""
+CHECKPOINT_TAIL = 1000
+HEADER = struct.Struct('<qqq')
+
+
+def to_cents(price):
+
+    """
+    Returns:
+    int: Price/amount in integer cents
+    """
+    return int((Decimal(str(price)) / CENT).to_integral_value())
+
+
+def from_cents(cents):
+
+    """
+    Returns:
+    Decimal: Amount from integer cents
+    """
+    return Decimal(cents) * CENT
+
+
+class Lots:
+
+    """
+    Lots class keeping open lots of a ticker in two parallel int64 arrays
+    (quantity & price in cents) consumed from the head (FIFO) or the tail
+    (LIFO), average cost keeping open quantity & cost only
+
+    Attributes:
+        method (int): FIFO, LIFO or AVERAGE
+        quantities (array): Open quantity of lots
+        prices (array): Price in cents of lots
+        head (int): First lot still open (FIFO)
+        open_quantity (int): Total open quantity
+        open_cost (int): Total cost in cents of open quantity
+        realized (int): Realized P&L in cents
+    """
+    __slots__ = ('method', 'quantities', 'prices', 'head', 'open_quantity',
+        'open_cost', 'realized')
+
+    def __init__(self, method, data=b'', open_quantity=0, open_cost=0,
+            realized=0):
+        self.method = method
+        self.quantities = array('q')
+        self.prices = array('q')
+        if data:
+            self.quantities.frombytes(data[:len(data) // 2])
+            self.prices.frombytes(data[len(data) // 2:])
+        self.head = 0
+        self.open_quantity = open_quantity
+        self.open_cost = open_cost
+        self.realized = realized
+
+    def buy(self, quantity, price):
+
+        """
+        Opening a lot
+
+        Parameters:
+        quantity (int): Quantity bought
+        price (int): Price in cents
+        """
+        self.open_quantity += quantity
+        self.open_cost += quantity * price
+        if self.method != AVERAGE:
+            self.quantities.append(quantity)
+            self.prices.append(price)
+
+    def sell(self, quantity, price):
+
+        """
+        Closing open quantity by the lot matching method & realizing its
+        P&L, quantity beyond open lots (never accepted by validation) being
+        left unmatched
+
+        Parameters:
+        quantity (int): Quantity sold
+        price (int): Price in cents
+
+        Returns:
+        int: Realized P&L of the sell in cents
+        """
+        quantity = min(quantity, self.open_quantity)
+        if self.method == AVERAGE:
+            cost = (self.open_cost * quantity * 2 + self.open_quantity) // \
+                (self.open_quantity * 2) if quantity else 0
+        elif self.method == FIFO:
+            cost = self.close_head(quantity)
+        else:
+            cost = self.close_tail(quantity)
+        self.open_quantity -= quantity
+        self.open_cost -= cost
+        realized = quantity * price - cost
+        self.realized += realized
+        return realized
+
+    def close_head(self, quantity):
+        cost = 0
+        quantities, prices, head = self.quantities, self.prices, self.head
+        while quantity:
+            taken = min(quantity, quantities[head])
+            cost += taken * prices[head]
+            quantity -= taken
+            quantities[head] -= taken
+            if not quantities[head]:
+                head += 1
+        if head > 64 and head * 2 > len(quantities):
+            del quantities[:head]
+            del prices[:head]
+            head = 0
+        self.head = head
+        return cost
+
+    def close_tail(self, quantity):
+        cost = 0
+        quantities, prices = self.quantities, self.prices
+        while quantity:
+            taken = min(quantity, quantities[-1])
+            cost += taken * prices[-1]
+            quantity -= taken
+            quantities[-1] -= taken
+            if not quantities[-1]:
+                quantities.pop()
+                prices.pop()
+        return cost
+
+    def apply(self, category, quantity, price):
+
+        """
+        Applying a trade, category 1 being a buy & 2 a sell (as Trade)
+
+        Returns:
+        int: Realized P&L of the trade in cents
+        """
+        if category == 1:
+            self.buy(quantity, price)
+            return 0
+        return self.sell(quantity, price)
+
+    def to_bytes(self):
+
+        """
+        Returns:
+        bytes: Open lots packed as quantities followed by prices
+        """
+        return self.quantities[self.head:].tobytes() + \
+            self.prices[self.head:].tobytes()
+
+    def pack(self):
+
+        """
+        Returns:
+        bytes: Whole matching state, open lots preceded by HEADER
+        """
+        return HEADER.pack(self.open_quantity, self.open_cost,
+            self.realized) + self.to_bytes()
+
+    @classmethod
+    def unpack(cls, method, data):
+
+        """
+        Returns:
+        Lots: Matching state packed by pack
+        """
+        open_quantity, open_cost, realized = HEADER.unpack_from(data)
+        return cls(method, bytes(data[HEADER.size:]), open_quantity,
+            open_cost, realized)
+
+
+def replay(trades, method=FIFO):
+
+    """
+    Matching lots over trades in memory
+
+    Parameters:
+    trades (iterable): Tuples of book key (e.g. ticker id), category,
+        quantity & price in cents, in trade order
+    method (int): FIFO, LIFO or AVERAGE
+
+    Returns:
+    dict: Lots keyed by book key
+    """
+    books = {}
+    for key, category, quantity, price in trades:
+        lots = books.get(key)
+        if lots is None:
+            lots = books[key] = Lots(method)
+        lots.apply(category, quantity, price)
+    return books
+
+
+def replay_from(trades, method=FIFO, books=None, tail=CHECKPOINT_TAIL):
+
+    """
+    Matching lots over trades in memory from given states, packing the
+    state of every book `tail` trades before its last one
+
+    Parameters:
+    trades (iterable): Tuples of book key, category, quantity, price in
+        cents & position of the trade (e.g. created_at & id), in trade order
+    method (int): FIFO, LIFO or AVERAGE
+    books (dict): Lots keyed by book key to continue from, updated in place
+    tail (int): Trades of a book left after its checkpoint
+
+    Returns:
+    tuple: Lots keyed by book key & checkpoints - packed state & position
+    of the last trade matched - keyed by book key, for books with over
+    `tail` trades
+    """
+    books = {} if books is None else books
+    grouped = {}
+    for trade in trades:
+        grouped.setdefault(trade[0], []).append(trade)
+    checkpoints = {}
+    for key, rows in grouped.items():
+        lots = books.get(key)
+        if lots is None:
+            lots = books[key] = Lots(method)
+        cut = len(rows) - tail
+        for index, (_, category, quantity, price, position) in \
+                enumerate(rows, 1):
+            lots.apply(category, quantity, price)
+            if index == cut:
+                checkpoints[key] = (lots.pack(), position)
+    return books, checkpoints
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from portfolio.history import ARCHIVE_BLOCK, archive, ensure_partitions
+from portfolio.models import Job
+
+
+class Command(BaseCommand):
+
+    """
+    Command moving cold, superseded trade versions into gzipped JSONL
+    archive files & maintaining monthly partitions on PostgreSQL
+    """
+    help = 'Archive cold trade history and maintain history partitions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+            help='Archive versions older than days.')
+        parser.add_argument('--block-size', type=int, default=ARCHIVE_BLOCK,
+            help='Versions per compressed block.')
+        parser.add_argument('--partitions-only', action='store_true',
+            help='Only create upcoming monthly partitions.')
+        parser.add_argument('--defer', action='store_true',
+            help='Queue the archival for run_workers instead.')
+
+    def handle(self, *args, **options):
+        if options['defer']:
+            job, created = Job.objects.enqueue('archive_history',
+                days=options['days'], block_size=options['block_size'])
+            self.stdout.write(self.style.SUCCESS('{state} job {pk}.'.format(
+                state='Queued' if created else 'Already queued', pk=job.pk)))
+            return
+        if options['partitions_only']:
+            for name in ensure_partitions():
+                self.stdout.write('Created partition {name}.'.format(
+                    name=name))
+            return
+        archives = archive(options['days'], options['block_size'])
+        for history_archive in archives:
+            self.stdout.write('Archived {rows} version(s) into {path}.'
+                .format(rows=history_archive.rows, path=history_archive.path))
+        self.stdout.write(self.style.SUCCESS('{count} archive(s) written.'
+            .format(count=len(archives))))
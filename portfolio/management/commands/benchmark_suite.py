@@ -0,0 +1,108 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.benchmarks import (bench_as_of, bench_holdings, bench_lots,
+    bench_serializers, bench_suite, compare_results)
+
+"""
+    Single benchmarks run by --only instead of the endpoint suite
+        BENCHMARKS: Function, default sizes, options passed on & result
+            line of every benchmark
+"""
+BENCHMARKS = {
+    'holdings': (bench_holdings, [10000, 100000, 1000000], (),
+        '{trades:>10} trades  {engine:<22}{seconds:10.4f}s'),
+    'lots': (bench_lots, [10000, 100000, 1000000], (),
+        '{trades:>10} trades  {method:<8}{seconds:10.4f}s '
+        '{trades_per_second:>12} trades/s'),
+    'serializers': (bench_serializers, [1000, 10000, 100000], (),
+        '{rows:>10} rows  {serializer:<14}{seconds:10.4f}s '
+        '{rows_per_second:>12} rows/s'),
+    'as_of': (bench_as_of, [10000, 100000, 1000000], ('every', 'points'),
+        '{trades:>10} trades  {engine:<14}{seconds:10.4f}s per as_of'),
+}
+
+
+class Command(BaseCommand):
+
+    """
+    Command timing endpoint scenarios over synthetic trade books of growing
+    sizes, flagging superlinear scaling & regressions against a baseline,
+    or running one of BENCHMARKS with --only
+    """
+    help = 'Benchmark endpoints over synthetic trade books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=sorted(BENCHMARKS),
+            help='Running this benchmark instead of the endpoint suite.')
+        parser.add_argument('--sizes', nargs='+', type=int,
+            help='Trade counts to benchmark (default 1000 10000 100000, '
+                'up to 1000000 for holdings, lots & as_of).')
+        parser.add_argument('--tickers', type=int, default=100)
+        parser.add_argument('--repeat', type=int,
+            help='Timings per size, the best kept (default 5, 3 with '
+                '--only).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--every', type=int, default=10000,
+            help='History rows between checkpoints (as_of).')
+        parser.add_argument('--points', type=int, default=10,
+            help='as_of points spread over the history (as_of).')
+        parser.add_argument('--superlinear', type=float, default=1.2,
+            help='Scaling exponent above which a scenario is flagged.')
+        parser.add_argument('--output',
+            help='Writing results as JSON to this file.')
+        parser.add_argument('--compare',
+            help='JSON results of a baseline (e.g. the previous commit).')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+            help='Slowdown ratio allowed against the baseline.')
+        parser.add_argument('--strict', action='store_true',
+            help='Failing on superlinear scenarios or regressions.')
+
+    def handle(self, *args, **options):
+        if options['only']:
+            return self.handle_only(options)
+        suite = bench_suite(options['sizes'] or [1000, 10000, 100000],
+            options['tickers'], options['repeat'] or 5, options['seed'],
+            options['superlinear'])
+        if options['compare']:
+            with open(options['compare']) as stream:
+                suite['regressions'] = compare_results(json.load(stream),
+                    suite, options['tolerance'])
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(suite, stream, indent=2)
+        for result in suite['results']:
+            self.stdout.write('{trades:>10} trades  {scenario:<20}'
+                '{seconds:10.4f}s'.format(**result))
+        for exponent in suite['superlinear']:
+            self.stdout.write(self.style.WARNING('superlinear {scenario}: '
+                'exponent {exponent} from {from_trades} to {to_trades} trades'
+                .format(**exponent)))
+        for regression in suite.get('regressions', ()):
+            self.stdout.write(self.style.WARNING('regression {scenario} at '
+                '{trades} trades: {baseline:.4f}s -> {seconds:.4f}s '
+                '(x{ratio})'.format(**regression)))
+        if options['strict'] and (suite['superlinear'] or
+                suite.get('regressions')):
+            raise CommandError('Benchmarks flagged superlinear scaling or '
+                'regressions.')
+
+    def handle_only(self, options):
+
+        """
+        Running the benchmark selected by --only, its results written as
+        JSON to --output
+        """
+        if options['compare'] or options['strict']:
+            raise CommandError('--compare & --strict apply to the endpoint '
+                'suite only.')
+        function, sizes, names, line = BENCHMARKS[options['only']]
+        results = function(options['sizes'] or sizes, options['tickers'],
+            repeat=options['repeat'] or 3,
+            **dict((name, options[name]) for name in names))
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(results, stream, indent=2)
+        for result in results:
+            self.stdout.write(line.format(**result))
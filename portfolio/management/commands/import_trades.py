@@ -0,0 +1,58 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.imports import (DEFAULT_CHUNK_SIZE, FORMATS, TradeImporter,
+    guess_format, read_rows)
+from portfolio.models import Job
+from portfolio.routers import DEFAULT_PORTFOLIO
+
+
+class Command(BaseCommand):
+
+    """
+    Command importing trades from a CSV, JSON lines or JSON array file
+    """
+    help = 'Import trades in bulk from a CSV/JSONL/JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=FORMATS,
+            help='File format, guessed from the extension by default.')
+        parser.add_argument('--chunk-size', type=int,
+            default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--strict', action='store_true',
+            help='Import nothing when any row is invalid.')
+        parser.add_argument('--portfolio', type=int,
+            default=DEFAULT_PORTFOLIO, help='Portfolio of the trades.')
+        parser.add_argument('--defer', action='store_true',
+            help='Queue the import for run_workers instead.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive integer.')
+        try:
+            file_format = guess_format(options['path'],
+                options['file_format'])
+        except ValueError as error:
+            raise CommandError(error)
+        if options['defer']:
+            job, created = Job.objects.enqueue('import_trades',
+                path=os.path.abspath(options['path']),
+                file_format=file_format, portfolio_id=options['portfolio'],
+                strict=options['strict'], chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS('{state} job {pk}.'.format(
+                state='Queued' if created else 'Already queued', pk=job.pk)))
+            return
+        with open(options['path'], newline='', encoding='utf-8') as stream:
+            result = TradeImporter(chunk_size=options['chunk_size'],
+                strict=options['strict'],
+                portfolio_id=options['portfolio']).run(
+                    read_rows(stream, file_format))
+        for error in result['errors']:
+            self.stderr.write('Row {row}: {errors}'.format(
+                row=error['row'], errors=json.dumps(error['errors'])))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {imported} of {received} row(s) in {seconds}s '
+            '({rows_per_second} rows/sec).'.format(**result)))
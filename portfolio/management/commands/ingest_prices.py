@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from portfolio.prices import DEFAULT_BATCH_SIZE, get_price_source, ingest
+
+
+class Command(BaseCommand):
+
+    """
+    Command ingesting quotes from the configured price source
+    """
+    help = 'Ingest quotes in batches from a price source.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+            help='Location passed to the price source, e.g. a CSV file.')
+        parser.add_argument('--source',
+            help='Dotted path of a PriceSource class, '
+                'PORTFOLIO_PRICE_SOURCE setting by default.')
+        parser.add_argument('--batch-size', type=int,
+            default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['source']:
+            source = import_string(options['source'])(options['path'])
+        else:
+            source = get_price_source(options['path'])
+        summary = ingest(source, options['batch_size'])
+        if summary['unknown']:
+            self.stderr.write('Unknown symbol(s): {symbols}'.format(
+                symbols=', '.join(sorted(summary['unknown']))))
+        self.stdout.write(self.style.SUCCESS(
+            'Ingested {quotes} quote(s), {changed} ticker price(s) '
+            'changed.'.format(quotes=summary['quotes'],
+                changed=len(summary['changed']))))
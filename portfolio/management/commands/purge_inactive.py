@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from portfolio.history import PURGE_BATCH, purge_inactive
+
+
+class Command(BaseCommand):
+
+    """
+    Command hard deleting long soft deleted trades & tickers in batches,
+    versions of purged trades being archived first
+    """
+    help = 'Purge trades and tickers soft deleted for a long time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+            help='Purge rows inactive for longer than days.')
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH,
+            help='Rows deleted per transaction.')
+
+    def handle(self, *args, **options):
+        trades, tickers = purge_inactive(options['days'],
+            options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Purged {trades} trade(s) and {tickers} ticker(s).'.format(
+                trades=trades, tickers=tickers)))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.models import Job, LotQueue, Position
+
+
+class Command(BaseCommand):
+
+    """
+    Command rebuilding the Position & LotQueue tables of every portfolio
+    database from Trade & verifying positions against Trade/TradeHistory
+    """
+    help = 'Rebuild and verify materialized positions from trades.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+            help='Only verify stored positions, without rebuilding them.')
+        parser.add_argument('--defer', action='store_true',
+            help='Queue the rebuild for run_workers instead.')
+
+    def handle(self, *args, **options):
+        if options['defer']:
+            job, created = Job.objects.enqueue('rebuild_positions')
+            self.stdout.write(self.style.SUCCESS('{state} job {pk}.'.format(
+                state='Queued' if created else 'Already queued', pk=job.pk)))
+            return
+        if not options['verify']:
+            count = Position.objects.rebuild()
+            self.stdout.write('Rebuilt {count} position(s).'.format(
+                count=count))
+            count = LotQueue.objects.rebuild()
+            self.stdout.write('Rebuilt {count} lot queue(s).'.format(
+                count=count))
+        mismatches = Position.objects.verify()
+        for mismatch in mismatches:
+            self.stderr.write(mismatch)
+        if mismatches:
+            raise CommandError('{count} position mismatch(es) found.'.format(
+                count=len(mismatches)))
+        self.stdout.write(self.style.SUCCESS('Positions verified.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from portfolio.jobs import HANDLERS, run_workers
+
+
+class Command(BaseCommand):
+
+    """
+    Command running a pool of worker processes over the job queue -
+    ticker recomputations, position rebuilds, trade imports & archival
+    """
+    help = 'Run background job workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+            help='Worker processes, 1 working in this process.')
+        parser.add_argument('--kinds', nargs='+', choices=sorted(HANDLERS),
+            help='Only run jobs of these kinds.')
+        parser.add_argument('--once', action='store_true',
+            help='Stop once no job is due.')
+        parser.add_argument('--poll', type=float,
+            help='Seconds between polls of idle workers.')
+
+    def handle(self, *args, **options):
+        processed = run_workers(options['processes'], options['kinds'],
+            options['once'], options['poll'])
+        if processed is not None:
+            self.stdout.write(self.style.SUCCESS('Ran {count} job(s).'
+                .format(count=processed)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Workers stopped.'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from portfolio.snapshots import prune_snapshots, take_snapshot
+
+
+class Command(BaseCommand):
+
+    """
+    Command checkpointing positions of every portfolio database for
+    point-in-time queries, meant to be run periodically (e.g. from cron), &
+    pruning expired checkpoints
+    """
+    help = 'Checkpoint positions from trade history and prune old checkpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+            help='Checkpoint whatever the number of new history rows.')
+        parser.add_argument('--every', type=int,
+            help='History rows between checkpoints.')
+        parser.add_argument('--retention-days', type=int,
+            help='Days checkpoints are kept.')
+        parser.add_argument('--no-prune', action='store_true',
+            help='Keep expired checkpoints.')
+
+    def handle(self, *args, **options):
+        checkpoints = take_snapshot(force=options['force'],
+            every=options['every'])
+        if not checkpoints:
+            self.stdout.write('No checkpoint needed.')
+        for alias, history_id in checkpoints.items():
+            self.stdout.write(self.style.SUCCESS(
+                'Checkpointed history of {alias} up to {history_id}.'.format(
+                    alias=alias, history_id=history_id)))
+        if not options['no_prune']:
+            deleted = prune_snapshots(options['retention_days'])
+            self.stdout.write('Pruned {deleted} snapshot row(s).'.format(
+                deleted=deleted))
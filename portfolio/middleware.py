@@ -0,0 +1,188 @@
+import contextlib
+import functools
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import (HttpResponseBadRequest, HttpResponseForbidden,
+    HttpResponseNotFound)
+
+from portfolio.instrumentation import record_queries, sync_and_async
+from portfolio.models import Portfolio
+from portfolio.routers import DEFAULT_PORTFOLIO, portfolio_databases, routed
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+
+    """
+    Raised when a view runs more queries than its budget while
+    PORTFOLIO_QUERY_BUDGET_STRICT setting is enabled (e.g. in tests)
+    """
+
+
+class QueryRecorder:
+
+    """
+    QueryRecorder context manager counting queries & database time through
+    execute wrappers of the connections of every portfolio database
+
+    Attributes:
+        count (int): Number of queries executed
+        duration (float): Seconds spent in the database
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+    def __enter__(self):
+        self.wrappers = contextlib.ExitStack()
+        for alias in portfolio_databases():
+            self.wrappers.enter_context(
+                connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.wrappers.__exit__(*exc_info)
+
+
+def check_budget(name, recorder, budget):
+
+    """
+    Reporting a query budget overrun, raising QueryBudgetExceeded when
+    PORTFOLIO_QUERY_BUDGET_STRICT setting is enabled
+    """
+    if budget is None or recorder.count <= budget:
+        return
+    message = '{name} ran {count} queries, budget is {budget}'.format(
+        name=name, count=recorder.count, budget=budget)
+    if getattr(settings, 'PORTFOLIO_QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def query_budget(max_queries):
+
+    """
+    Decorator asserting a viewset method runs at most max_queries queries,
+    whatever the number of rows involved
+
+    Parameters:
+    max_queries (int): Query budget of the method
+
+    Returns:
+    function: Decorator
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            with QueryRecorder() as recorder:
+                response = view(self, request, *args, **kwargs)
+            check_budget('{view}.{method}'.format(
+                view=type(self).__name__, method=view.__name__),
+                recorder, max_queries)
+            return response
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+class QueryBudgetMiddleware:
+
+    """
+    Middleware recording queries & database time of every request, exposed
+    through X-Query-Count & X-Query-Time-Ms response headers, requests over
+    PORTFOLIO_QUERY_BUDGET setting being reported
+
+    Under ASGI, async views run their queries in worker threads, so async
+    requests are passed through unrecorded (db_call records them for
+    instrumentation)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        record_queries(recorder)
+        request.query_count = recorder.count
+        request.query_duration = recorder.duration
+        response['X-Query-Count'] = recorder.count
+        response['X-Query-Time-Ms'] = '{:.1f}'.format(
+            recorder.duration * 1000)
+        check_budget(request.path, recorder,
+            getattr(settings, 'PORTFOLIO_QUERY_BUDGET', None))
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class PortfolioMiddleware:
+
+    """
+    Middleware scoping a request to the portfolio of ?portfolio=, the
+    default (shared) portfolio otherwise, set as request.portfolio_id &
+    routing queries of portfolio data to its database. A portfolio named
+    by ?portfolio= must exist & be shared, owned by the user or requested
+    by staff, so it follows AuthenticationMiddleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def scope(self, request):
+
+        """
+        Setting request.portfolio_id from ?portfolio=
+
+        Returns:
+        HttpResponse: Error response when ?portfolio= is not an integer,
+        not a portfolio or one of another user, None otherwise
+        """
+        request.portfolio_id = DEFAULT_PORTFOLIO
+        if 'portfolio' not in request.GET:
+            return None
+        try:
+            request.portfolio_id = int(request.GET['portfolio'])
+        except ValueError:
+            return HttpResponseBadRequest('portfolio must be an integer')
+        owners = list(Portfolio.objects.filter(pk=request.portfolio_id) \
+            .values_list('owner_id', flat=True))
+        if not owners:
+            return HttpResponseNotFound('portfolio not found')
+        if owners[0] is not None and owners[0] != request.user.pk and \
+                not request.user.is_staff:
+            return HttpResponseForbidden('portfolio of another user')
+        return None
+
+    def __call__(self, request):
+        error = self.scope(request)
+        if error is not None:
+            return error
+        with routed(request.portfolio_id):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        error = await sync_to_async(self.scope)(request)
+        if error is not None:
+            return error
+        with routed(request.portfolio_id):
+            return await self.get_response(request)
+
+
+query_budget_middleware = sync_and_async(QueryBudgetMiddleware)
+portfolio_middleware = sync_and_async(PortfolioMiddleware)
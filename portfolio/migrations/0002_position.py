@@ -0,0 +1,67 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:17
+
+from decimal import Decimal, ROUND_HALF_UP
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_positions(apps, schema_editor):
+    Trade = apps.get_model('portfolio', 'Trade')
+    Position = apps.get_model('portfolio', 'Position')
+    positions = {}
+    for ticker_id, category, quantity, price in Trade.objects.values_list(
+            'ticker_id', 'category', 'quantity', 'price').iterator():
+        position = positions.setdefault(ticker_id, Position(
+            ticker_id=ticker_id, total_buy_cost=Decimal(0)))
+        if category == 1:
+            position.bought_quantity += quantity
+            position.total_buy_cost += price * quantity
+        else:
+            position.sold_quantity += quantity
+    for position in positions.values():
+        position.final_quantity = \
+            position.bought_quantity - position.sold_quantity
+        if position.bought_quantity:
+            position.avg_buy_price = (position.total_buy_cost /
+                position.bought_quantity).quantize(
+                    Decimal('0.01'), ROUND_HALF_UP)
+    Position.objects.bulk_create(positions.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('ticker', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='portfolio.ticker')),
+                ('bought_quantity', models.BigIntegerField(default=0)),
+                ('sold_quantity', models.BigIntegerField(default=0)),
+                ('total_buy_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('final_quantity', models.BigIntegerField(default=0)),
+                ('avg_buy_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='quantity',
+            field=models.IntegerField(validators=[django.core.validators.MaxValueValidator(9999999), django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AlterField(
+            model_name='tradehistory',
+            name='quantity',
+            field=models.IntegerField(validators=[django.core.validators.MaxValueValidator(9999999), django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.RunPython(populate_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0002_position'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticker',
+            index=models.Index(fields=['created_at', 'id'], name='ticker_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['created_at', 'id'], name='trade_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['ticker', 'created_at', 'id'], name='trade_ticker_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradehistory',
+            index=models.Index(fields=['created_at', 'id'], name='history_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradehistory',
+            index=models.Index(fields=['trade_reference', 'created_at', 'id'], name='history_trade_created_id_idx'),
+        ),
+    ]
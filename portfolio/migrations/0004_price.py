@@ -0,0 +1,30 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Price',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('quoted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ticker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio.ticker')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['ticker', '-quoted_at', '-id'], name='price_ticker_quoted_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0004_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='cumulative_return',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='current_price',
+            field=models.DecimalField(decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(condition=models.Q(dirty=True), fields=['dirty'], name='position_dirty_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0005_position_returns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticker',
+            index=models.Index(condition=models.Q(active=True), fields=['id'], name='ticker_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['category', 'ticker', 'price'], name='trade_cat_tkr_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['ticker', 'category'], name='trade_active_tkr_cat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradehistory',
+            index=models.Index(fields=['trade_reference', '-id'], name='history_trade_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0006_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('history_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('bought_quantity', models.BigIntegerField(default=0)),
+                ('sold_quantity', models.BigIntegerField(default=0)),
+                ('total_buy_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('ticker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio.ticker')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='positionsnapshot',
+            index=models.Index(fields=['taken_at', 'history_id'], name='snapshot_taken_history_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='positionsnapshot',
+            constraint=models.UniqueConstraint(fields=('history_id', 'ticker'), name='unique snapshot ticker'),
+        ),
+    ]
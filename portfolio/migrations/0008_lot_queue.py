@@ -0,0 +1,53 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from portfolio.lots import METHOD_CHOICES, from_cents, replay, to_cents
+
+
+def populate_lot_queues(apps, schema_editor):
+    Trade = apps.get_model('portfolio', 'Trade')
+    LotQueue = apps.get_model('portfolio', 'LotQueue')
+    rows = [(ticker_id, category, quantity, to_cents(price))
+        for ticker_id, category, quantity, price in Trade.objects \
+            .order_by('created_at', 'id') \
+            .values_list('ticker_id', 'category', 'quantity', 'price') \
+            .iterator()]
+    queues = []
+    for method, _ in METHOD_CHOICES:
+        for ticker_id, book in replay(rows, method).items():
+            queues.append(LotQueue(ticker_id=ticker_id, method=method,
+                lots=book.to_bytes(), open_quantity=book.open_quantity,
+                open_cost=from_cents(book.open_cost),
+                realized=from_cents(book.realized)))
+    LotQueue.objects.bulk_create(queues, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0007_position_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotQueue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('method', models.IntegerField(choices=[(1, 'fifo'), (2, 'lifo'), (3, 'average')])),
+                ('lots', models.BinaryField(default=b'')),
+                ('open_quantity', models.BigIntegerField(default=0)),
+                ('open_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('realized', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('ticker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio.ticker')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lotqueue',
+            constraint=models.UniqueConstraint(fields=('ticker', 'method'), name='unique lot queue method'),
+        ),
+        migrations.RunPython(populate_lot_queues, migrations.RunPython.noop),
+    ]
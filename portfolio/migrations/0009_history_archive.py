@@ -0,0 +1,107 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:38
+
+import datetime
+
+from django.db import migrations, models
+
+
+def month_ranges(first, last):
+    month = first.replace(day=1)
+    while month <= last:
+        following = (month + datetime.timedelta(days=32)).replace(day=1)
+        yield month, following
+        month = following
+
+
+def partition_trade_history(apps, schema_editor):
+    """
+    Turning portfolio_tradehistory into a table partitioned by month of
+    created_at on PostgreSQL (11+), other backends keeping the plain table
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    table = 'portfolio_tradehistory'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE tablename = %s AND indexname <> %s",
+            [table, table + '_pkey'])
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute('SELECT MIN(created_at), MAX(created_at) FROM ' +
+            table)
+        first, last = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE {table} RENAME TO {table}_old'.format(
+            table=table))
+        for name, _ in foreign_keys:
+            cursor.execute('ALTER TABLE {table}_old DROP CONSTRAINT '
+                '"{name}"'.format(table=table, name=name))
+        for name, _ in indexes:
+            cursor.execute('DROP INDEX "{name}"'.format(name=name))
+        cursor.execute(
+            'CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS '
+            'INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)'.format(
+                table=table))
+        # The partition key has to be part of the primary key
+        cursor.execute('ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)'
+            .format(table=table))
+        cursor.execute('ALTER SEQUENCE {sequence} OWNED BY {table}.id'.format(
+            sequence=sequence, table=table))
+        today = datetime.date.today()
+        first = first.date() if first else today
+        last = max(last.date() if last else today,
+            today + datetime.timedelta(days=62))
+        for start, end in month_ranges(first, last):
+            cursor.execute(
+                "CREATE TABLE {table}_p{month} PARTITION OF {table} "
+                "FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                    table=table, month=start.strftime('%Y%m'),
+                    start=start.isoformat(), end=end.isoformat()))
+        cursor.execute('CREATE TABLE {table}_default PARTITION OF {table} '
+            'DEFAULT'.format(table=table))
+        cursor.execute('INSERT INTO {table} SELECT * FROM {table}_old'.format(
+            table=table))
+        cursor.execute('DROP TABLE {table}_old'.format(table=table))
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute('ALTER TABLE {table} ADD CONSTRAINT "{name}" '
+                '{definition}'.format(table=table, name=name,
+                    definition=definition))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0008_lot_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('month', models.DateField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('rows', models.IntegerField()),
+                ('checkpoint_id', models.BigIntegerField()),
+                ('blocks', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['-last_id'],
+            },
+        ),
+        migrations.RunPython(partition_trade_history,
+            migrations.RunPython.noop),
+    ]
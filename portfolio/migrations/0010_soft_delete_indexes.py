@@ -0,0 +1,53 @@
+# Generated by Django 3.1.1 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0009_history_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ticker',
+            name='ticker_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_ticker_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_cat_tkr_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ticker',
+            index=models.Index(condition=models.Q(active=True), fields=['created_at', 'id'], name='ticker_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticker',
+            index=models.Index(condition=models.Q(active=False), fields=['modified_at', 'id'], name='ticker_inactive_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['created_at', 'id'], name='trade_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['ticker', 'created_at', 'id'], name='trade_ticker_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['category', 'ticker', 'price'], name='trade_cat_tkr_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=False), fields=['modified_at', 'id'], name='trade_inactive_idx'),
+        ),
+    ]
@@ -0,0 +1,165 @@
+# Generated by Django 3.1.1 on 2026-10-18 05:02
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import portfolio.routers
+
+
+def create_default_portfolio(apps, schema_editor):
+    Portfolio = apps.get_model('portfolio', 'Portfolio')
+    Portfolio.objects.using(schema_editor.connection.alias).get_or_create(
+        pk=1, defaults={'name': 'Default'})
+
+
+def populate_positions(apps, schema_editor):
+    Trade = apps.get_model('portfolio', 'Trade')
+    Position = apps.get_model('portfolio', 'Position')
+    db_alias = schema_editor.connection.alias
+    positions = {}
+    for portfolio_id, ticker_id, category, quantity, price in \
+            Trade.objects.using(db_alias).filter(active=True).values_list(
+                'portfolio_id', 'ticker_id', 'category', 'quantity',
+                'price').iterator():
+        position = positions.setdefault((portfolio_id, ticker_id), Position(
+            portfolio_id=portfolio_id, ticker_id=ticker_id,
+            total_buy_cost=Decimal(0)))
+        if category == 1:
+            position.bought_quantity += quantity
+            position.total_buy_cost += price * quantity
+        else:
+            position.sold_quantity += quantity
+    for position in positions.values():
+        position.final_quantity = \
+            position.bought_quantity - position.sold_quantity
+        if position.bought_quantity:
+            position.avg_buy_price = (position.total_buy_cost /
+                position.bought_quantity).quantize(
+                    Decimal('0.01'), ROUND_HALF_UP)
+    Position.objects.using(db_alias).bulk_create(positions.values(),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('portfolio', '0010_soft_delete_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Portfolio',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=200)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='portfolios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_default_portfolio,
+            migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='trade',
+            name='portfolio',
+            field=models.ForeignKey(default=portfolio.routers.current_portfolio, on_delete=django.db.models.deletion.CASCADE, to='portfolio.portfolio'),
+        ),
+        migrations.AddField(
+            model_name='tradehistory',
+            name='portfolio',
+            field=models.ForeignKey(default=portfolio.routers.current_portfolio, on_delete=django.db.models.deletion.CASCADE, to='portfolio.portfolio'),
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_ticker_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='trade',
+            name='trade_cat_tkr_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['portfolio', 'created_at', 'id'], name='trade_pf_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['portfolio', 'ticker', 'created_at', 'id'], name='trade_pf_tkr_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(condition=models.Q(active=True), fields=['portfolio', 'category', 'ticker', 'price'], name='trade_pf_cat_tkr_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tradehistory',
+            index=models.Index(fields=['portfolio', 'created_at', 'id'], name='history_pf_created_id_idx'),
+        ),
+        # Positions are keyed by portfolio & ticker now, rebuilt from trades
+        migrations.DeleteModel(
+            name='Position',
+        ),
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('bought_quantity', models.BigIntegerField(default=0)),
+                ('sold_quantity', models.BigIntegerField(default=0)),
+                ('total_buy_cost', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('final_quantity', models.BigIntegerField(default=0)),
+                ('avg_buy_price', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('current_price', models.DecimalField(decimal_places=2, max_digits=8, null=True)),
+                ('cumulative_return', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('dirty', models.BooleanField(default=True)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio.portfolio')),
+                ('ticker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio.ticker')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(condition=models.Q(dirty=True), fields=['dirty'], name='position_dirty_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='position',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'ticker'), name='unique position ticker'),
+        ),
+        migrations.RunPython(populate_positions, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='lotqueue',
+            name='unique lot queue method',
+        ),
+        migrations.AddField(
+            model_name='lotqueue',
+            name='portfolio',
+            field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, to='portfolio.portfolio'),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='lotqueue',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'ticker', 'method'), name='unique lot queue method'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='positionsnapshot',
+            name='unique snapshot ticker',
+        ),
+        migrations.AddField(
+            model_name='positionsnapshot',
+            name='portfolio',
+            field=models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, to='portfolio.portfolio'),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='positionsnapshot',
+            constraint=models.UniqueConstraint(fields=('history_id', 'portfolio', 'ticker'), name='unique snapshot ticker'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.1 on 2026-10-18 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0011_portfolio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticker',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tradehistory',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
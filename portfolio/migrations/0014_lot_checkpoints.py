@@ -0,0 +1,28 @@
+# Generated by Django 3.1.1 on 2026-10-18 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0013_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lotqueue',
+            name='checkpoint',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='lotqueue',
+            name='checkpoint_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lotqueue',
+            name='checkpoint_trade',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
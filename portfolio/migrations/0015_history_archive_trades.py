@@ -0,0 +1,52 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:40
+
+import json
+import os
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def index_trades(apps, schema_editor):
+
+    """
+    Indexing blocks of existing archives by trade id, archives whose file
+    is missing being left unindexed
+    """
+    HistoryArchive = apps.get_model('portfolio', 'HistoryArchive')
+    directory = getattr(settings, 'PORTFOLIO_HISTORY_ARCHIVE_DIR',
+        os.path.join(str(settings.BASE_DIR), 'archive'))
+    for archive in HistoryArchive.objects.using(
+            schema_editor.connection.alias).iterator():
+        path = os.path.join(directory, archive.path)
+        if not os.path.exists(path):
+            continue
+        trades = {}
+        with open(path, 'rb') as stream:
+            for number, (offset, length, _, _) in enumerate(archive.blocks):
+                stream.seek(offset)
+                for line in zlib.decompress(stream.read(length),
+                        zlib.MAX_WBITS | 16).decode('utf-8').splitlines():
+                    numbers = trades.setdefault(
+                        str(json.loads(line)['trade_reference_id']), [])
+                    if number not in numbers:
+                        numbers.append(number)
+        archive.trades = trades
+        archive.save(update_fields=['trades'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0014_lot_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historyarchive',
+            name='trades',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(index_trades, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,73 @@
-from django.db import models
+import datetime
+import hashlib
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import FilteredRelation
 from django.db.models.functions import Concat, Coalesce
+from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth.models import AbstractUser, Permission
 from django.core.validators import (MaxValueValidator, MinValueValidator)
 from django.core.exceptions import ValidationError
 
+from portfolio.lots import (CHECKPOINT_TAIL, METHOD_CHOICES, METHODS, Lots,
+    from_cents, replay_from, to_cents)
+from portfolio.caching import bump_version, cached_lookup
+from portfolio.instrumentation import instrumented
+from portfolio.routers import (current_portfolio, database_for, replicate,
+    routed, routed_databases)
+
 # Create your models here.
 
 """
-    Constant refering to current price of a security/ticker
+    Constant refering to current price of a security/ticker without quotes
         CURRENT_PRICE: Decimal
 """
 CURRENT_PRICE = 100
 
+"""
+    Constant refering to precision of computed prices
+        PRICE_PRECISION: Decimal
+"""
+PRICE_PRECISION = Decimal('0.01')
+
+
+def format_price(value):
+
+    """ 
+    Formatting a price/amount with two decimal places, without going
+    through float
+      
+    Parameters: 
+    value (Decimal): Price or amount, None being treated as 0
+      
+    Returns: 
+    str: Formatted value, e.g. 10.75
+    """
+    return '{:.2f}'.format(Decimal(value or 0).quantize(
+        PRICE_PRECISION, ROUND_HALF_UP))
+
+
+def cumulative_return(avg_buy_price, final_quantity,
+        current_price=CURRENT_PRICE):
+
+    """ 
+    Computing cumulative return of a holding
+      
+    Parameters: 
+    avg_buy_price (Decimal): Average buy price, None being treated as 0
+    final_quantity (int): Quantity held, None being treated as 0
+    current_price (Decimal): Current price of the ticker
+      
+    Returns: 
+    str: Formatted cumulative return
+    """
+    return format_price((Decimal(current_price) -
+        Decimal(avg_buy_price or 0)) * (final_quantity or 0))
+
 
 class CreateModifyModel(models.Model):
 
@@ -39,123 +94,332 @@ class SoftDeleteCreateModifyModel(CreateModifyModel):
     class Meta:
         abstract = True
 
+    def set_active(self, active):
+
+        """
+        Soft deleting (active False) or restoring (active True) the row
+        through save, so everything maintained on save follows
+        """
+        self.active = active
+        self.save()
+
+
+class VersionConflict(Exception):
+
+    """
+    Raised when a row changed since it was read, its save or update being
+    refused so the client retries over the current version
+
+    Attributes:
+        model (str): Verbose name of the model
+        pk (int): Primary key of the row
+        version (int): Current version of the row, None when it was deleted
+    """
+
+    def __init__(self, model, pk, version):
+        self.model = model
+        self.pk = pk
+        self.version = version
+        super().__init__('{model} {pk} changed since it was read, current '
+            'version is {version}'.format(model=model, pk=pk,
+                version=version))
+
+    @property
+    def message_dict(self):
+        return {'version': [str(self)]}
+
+
+class VersionedModel(SoftDeleteCreateModifyModel):
+
+    """
+    Abstract Base model for attaching model attribute(s) -
+        version
+    Saving an existing row compares & swaps its version, the UPDATE
+    matching the row only at the version it was read at & incrementing it,
+    so concurrent writers never lock rows they read & writers of other
+    rows never wait on each other
+    """
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+
+        """
+        Raises:
+        VersionConflict: When the row changed since it was read
+        """
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'version'}
+        self.version += 1
+        try:
+            super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version -= 1
+            raise
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+            forced_update):
+        if self._state.adding:
+            return super()._do_update(base_qs, using, pk_val, values,
+                update_fields, forced_update)
+        if super()._do_update(base_qs.filter(version=self.version - 1),
+                using, pk_val, values, update_fields, forced_update):
+            return True
+        version = base_qs.filter(pk=pk_val).values_list('version',
+            flat=True).first()
+        raise VersionConflict(self._meta.verbose_name, pk_val, version)
+
 
-class TickerManager(models.Manager):
+class ActiveManager(models.Manager):
+
+    """
+    ActiveManager class excluding soft deleted rows, queries being served
+    by partial indexes on active = true
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(active=True)
+
+
+class Portfolio(CreateModifyModel):
+
+    """ 
+    Portfolio model for client books, trades & positions being scoped to
+    a portfolio & stored in its database
+      
+    Attributes: 
+        id (int): Primary Key auto-increment & auto-generated
+        name (str): Name of the portfolio
+        owner (User): Owning user, None for shared books
+    """
+    name = models.CharField(max_length=200)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True,
+        blank=True, on_delete=models.SET_NULL, related_name='portfolios')
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        replicate(self)
+
+
+class TickerManager(ActiveManager):
 
     """
         ManagerMethod: 
             holdings
+            holding_rows
+            avg_buy_price_formulas
             returns
+            return_rows
+            choices
+            with_trade_count
+            with_positions
     """
-    def holdings(self, evaluated=True):
+    @instrumented('aggregation')
+    def holdings(self, evaluated=True, ticker_ids=None,
+            portfolio_id=None):
 
         """ 
-        Holdings method computing ticker details, final_quantity & 
-        avg_buy_price of their trades
+        Holdings method reading ticker details, final_quantity & 
+        avg_buy_price of their trades from materialized positions
       
         Parameters: 
         evaluated (bool): evaluated True sets avg_buy_price computed
         result of calculation string otherwise not
+        ticker_ids (iterable): Restricting holdings to these tickers
+        portfolio_id (int): Portfolio of the holdings, the current portfolio
+            by default
       
         Returns: 
         list: List of holdings having ticker details - id, name, symbol
-        avg_buy_price, final_quantity
-        """
-        queryset = Ticker.objects.all().prefetch_related('trade_set') \
-            .values('id', 'name', 'symbol', 'trade__price', 'trade__category') \
-            .order_by('trade__price') \
-            .annotate(final_quantity=Coalesce(models.Sum('trade__quantity'), 0))
-        holdings_data = []
-        holdings = {}
-        for qs in queryset:
-            try:
-                if qs.get('trade__category') == Trade.CATEGORY_BOUGHT:
-                    if holdings[qs.get('id')].get('avg_buy_price'):
-                        holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([ 
-                            holdings[qs.get('id')]['avg_buy_price'],
-                            '*'.join([str(qs.get('trade__price')),
-                            str(qs.get('final_quantity'))])]
-                        )
-                        holdings[qs.get('id')]['divider'] = ' + '.join([
-                            holdings[qs.get('id')]['divider'],
-                            str(qs.get('final_quantity'))]
-                        )
-                        holdings[qs.get('id')]['bought'] += qs.get('final_quantity')
-                    else:
-                        holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([
-                            '*'.join([str(qs.get('trade__price')),
-                            str(qs.get('final_quantity'))])]
-                        )
-                        holdings[qs.get('id')]['divider'] = str(qs.get('final_quantity'))
-                        holdings[qs.get('id')]['bought'] = qs.get('final_quantity')
-                if qs.get('trade__category') == Trade.CATEGORY_SOLD:
-                    try:
-                        holdings[qs.get('id')]['sold'] += qs.get('final_quantity')
-                    except:
-                        holdings[qs.get('id')]['sold'] = qs.get('final_quantity')
-                holdings[qs.get('id')]['id'] = qs.get('name')
-                holdings[qs.get('id')]['name'] = qs.get('name')
-                holdings[qs.get('id')]['symbol'] = qs.get('symbol')
-                holdings[qs.get('id')]['final_quantity'] += qs.get('final_quantity')
-            except:
-                holdings[qs.get('id')] = {}
-                holdings[qs.get('id')]['id'] = qs.get('name')
-                holdings[qs.get('id')]['name'] = qs.get('name')
-                holdings[qs.get('id')]['final_quantity'] = qs.get('final_quantity')
-                holdings[qs.get('id')]['avg_buy_price'] = 0
-                holdings[qs.get('id')]['divider'] = ''
-                if (qs.get('trade__price') or (qs.get('trade__price') == 0) and 
-                        qs.get('trade__category') == Trade.CATEGORY_BOUGHT):
-                    holdings[qs.get('id')]['avg_buy_price'] = ' + '.join([
-                        '*'.join([str(qs.get('trade__price')), 
-                        str(qs.get('final_quantity'))])]
-                    )
-                    holdings[qs.get('id')]['divider'] = str(qs.get('final_quantity'))
-                    holdings[qs.get('id')]['bought'] = qs.get('final_quantity')
-                if qs.get('trade__category') == Trade.CATEGORY_SOLD:
-                    holdings[qs.get('id')]['sold'] = qs.get('final_quantity')
-                holdings[qs.get('id')]['id'] = qs.get('name')
-                holdings[qs.get('id')]['name'] = qs.get('name')
-                holdings[qs.get('id')]['symbol'] = qs.get('symbol')
-        for k, v in holdings.items():
-            if v.get('divider'):
-                v['avg_buy_price'] = '/'.join([
-                    ''.join(['(', v['avg_buy_price'], ')']), 
-                    ''.join(['(', v['divider'], ')'])
-                ])
-            if evaluated:
-                v['avg_buy_price'] = '%.2f'%eval(str(v['avg_buy_price']))
-            if isinstance(v['avg_buy_price'], int):
-                v['avg_buy_price'] = '%.2f'%v['avg_buy_price']
-            v['final_quantity'] = (v.get('bought') or 0) - (v.get('sold') or 0)
-            holdings_data.append(v)
-        return holdings_data
-
-
-    def returns(self):
+        avg_buy_price, final_quantity. id is the ticker id in both modes,
+        un-evaluated holdings having set it to the ticker name before
+        """
+        formulas = {} if evaluated else \
+            self.avg_buy_price_formulas(portfolio_id)
+        return [{
+                'id': ticker_id,
+                'name': name,
+                'symbol': symbol,
+                'final_quantity': final_quantity or 0,
+                'avg_buy_price': formulas.get(ticker_id) or \
+                    format_price(avg_buy_price)
+            } for ticker_id, name, symbol, final_quantity, avg_buy_price in
+            self.holding_rows(ticker_ids, portfolio_id)]
+
+    def with_positions(self, portfolio_id=None):
+
+        """ 
+        Joining tickers with their position in a portfolio (the current
+        portfolio by default) as book, tickers without one being kept, read
+        from the database of the portfolio even when evaluated later (e.g.
+        streamed)
+      
+        Returns: 
+        QuerySet: Tickers ordered by id
+        """
+        if portfolio_id is None:
+            portfolio_id = current_portfolio()
+        book = FilteredRelation('position',
+            condition=models.Q(position__portfolio_id=portfolio_id))
+        return self.model.objects.using(database_for(portfolio_id)) \
+            .annotate(book=book).order_by('id')
+
+    def holding_rows(self, ticker_ids=None, portfolio_id=None):
 
         """ 
-        Returns method computing ticker details & cumulative return
+        Reading holdings of tickers from materialized positions in one query
+      
+        Parameters: 
+        ticker_ids (iterable): Restricting holdings to these tickers
+        portfolio_id (int): Portfolio of the holdings, the current portfolio
+            by default
       
         Returns: 
-        list: List of returns having ticker details - id, name, symbol
-        avg_buy_price, final_quantity, cumulative_return
+        QuerySet: Tuples of id, name, symbol, final_quantity, avg_buy_price
         """
-        holdings = self.model.objects.holdings()
+        queryset = self.with_positions(portfolio_id)
+        if ticker_ids is not None:
+            queryset = queryset.filter(id__in=ticker_ids)
+        return queryset.values_list('id', 'name', 'symbol',
+            'book__final_quantity', 'book__avg_buy_price')
+
+    def avg_buy_price_formulas(self, portfolio_id=None):
+
+        """ 
+        Building un-evaluated avg_buy_price calculation strings like
+        (10.00*5 + 12.00*3)/(5 + 3) from bought trades grouped by price
+      
+        Parameters: 
+        portfolio_id (int): Portfolio of the trades, the current portfolio
+            by default
+      
+        Returns: 
+        dict: Calculation string keyed by ticker id, for tickers having
+        bought trades
+        """
+        if portfolio_id is None:
+            portfolio_id = current_portfolio()
+        terms = {}
+        for ticker_id, price, quantity in Trade.objects \
+                .filter(portfolio_id=portfolio_id,
+                    category=Trade.CATEGORY_BOUGHT) \
+                .order_by('ticker_id', 'price').values('ticker_id', 'price') \
+                .annotate(quantity=models.Sum('quantity')) \
+                .values_list('ticker_id', 'price', 'quantity'):
+            costs, quantities = terms.setdefault(ticker_id, ([], []))
+            costs.append('*'.join([str(price), str(quantity)]))
+            quantities.append(str(quantity))
+        return {
+            ticker_id: '/'.join([
+                ''.join(['(', ' + '.join(costs), ')']),
+                ''.join(['(', ' + '.join(quantities), ')'])
+            ]) for ticker_id, (costs, quantities) in terms.items()
+        }
+
+    @instrumented('aggregation')
+    def returns(self, ticker_ids=None, method=None,
+            portfolio_id=None):
+
+        """ 
+        Returns method reading ticker details & cumulative return from
+        positions, after recomputing returns of positions marked dirty by
+        trade or price changes, split into realized & unrealized return by
+        lot matching
+      
+        Parameters: 
+        ticker_ids (iterable): Restricting returns to these tickers
+        method (int): Lot matching method, PORTFOLIO_LOT_METHOD setting
+            by default
+        portfolio_id (int): Portfolio of the returns, the current portfolio
+            by default
+      
+        Returns: 
+        list: List of returns having ticker details - name, symbol,
+        cumulative_return, realized_return, unrealized_return
+        """
+        if method is None:
+            method = METHODS[getattr(settings, 'PORTFOLIO_LOT_METHOD',
+                'fifo')]
+        rows = list(self.return_rows(ticker_ids, portfolio_id))
+        summaries = LotQueue.objects.summaries(method,
+            [row[0] for row in rows] if ticker_ids is not None else None,
+            portfolio_id)
         returns_data = []
-        for holding in holdings:
+        for ticker_id, name, symbol, position_return, current_price in rows:
+            open_quantity, open_cost, realized = summaries.get(ticker_id,
+                (0, 0, 0))
             returns_data.append({
-                    'name': holding.get('name'),
-                    'symbol': holding.get('symbol'),
-                    'cumulative_return': '%.2f'%((CURRENT_PRICE - \
-                        float(holding.get('avg_buy_price'))) * \
-                        float(holding.get('final_quantity')) \
-                        if holding.get('avg_buy_price') else 0)
+                    'name': name,
+                    'symbol': symbol,
+                    'cumulative_return': format_price(position_return),
+                    'realized_return': format_price(realized),
+                    'unrealized_return': format_price(open_quantity *
+                        Decimal(CURRENT_PRICE if current_price is None
+                            else current_price) - open_cost)
                 })
         return returns_data
 
 
-class Ticker(SoftDeleteCreateModifyModel):
+    def return_rows(self, ticker_ids=None, portfolio_id=None):
+
+        """ 
+        Recomputing returns of dirty positions & reading returns of tickers
+        in one query
+      
+        Parameters: 
+        ticker_ids (iterable): Restricting returns to these tickers
+        portfolio_id (int): Portfolio of the returns, the current portfolio
+            by default
+      
+        Returns: 
+        QuerySet: Tuples of id, name, symbol, cumulative_return,
+        current_price
+        """
+        Position.objects.refresh_returns()
+        queryset = self.with_positions(portfolio_id)
+        if ticker_ids is not None:
+            queryset = queryset.filter(id__in=ticker_ids)
+        return queryset.values_list('id', 'name', 'symbol',
+            'book__cumulative_return', 'book__current_price')
+
+    def choices(self):
+
+        """ 
+        Choices method reading tickers for select boxes from a cached
+        lookup table, invalidated whenever a ticker is saved
+      
+        Returns: 
+        list: List of tickers having id, name, symbol
+        """
+        return cached_lookup('tickers', lambda: list(self.model.objects \
+            .order_by('id').values('id', 'name', 'symbol')))
+
+    def with_trade_count(self, portfolio_id=None):
+
+        """ 
+        Annotating tickers with the number of their trades in a portfolio
+        (the current portfolio by default) through a correlated subquery,
+        counted for the fetched rows only
+      
+        Returns: 
+        QuerySet: Tickers having trade_count
+        """
+        if portfolio_id is None:
+            portfolio_id = current_portfolio()
+        trade_count = Trade.objects.filter(portfolio_id=portfolio_id,
+                ticker=models.OuterRef('pk')) \
+            .order_by().values('ticker') \
+            .annotate(count=models.Count('id')).values('count')
+        return self.model.objects.annotate(trade_count=Coalesce(
+            models.Subquery(trade_count,
+                output_field=models.IntegerField()), 0))
+
+
+class Ticker(VersionedModel):
 
     """ 
     Ticker model for Ticker (Security) table
@@ -164,6 +428,7 @@ class Ticker(SoftDeleteCreateModifyModel):
         id (int): Primary Key auto-increment & auto-generated
         name (int): Name of the ticker
         symbol (int): Symbol of the ticker
+        version (int): Incremented by every save of the ticker
     """
     name = models.CharField(max_length=200)
     symbol = models.CharField(max_length=100)
@@ -173,11 +438,28 @@ class Ticker(SoftDeleteCreateModifyModel):
             models.UniqueConstraint(
                 fields=['symbol'], name='unique symbol')
             ]
+        indexes = [
+            models.Index(fields=['created_at', 'id'],
+                condition=models.Q(active=True),
+                name='ticker_created_id_idx'),
+            models.Index(fields=['id'], condition=models.Q(active=True),
+                name='ticker_active_idx'),
+            models.Index(fields=['modified_at', 'id'],
+                condition=models.Q(active=False),
+                name='ticker_inactive_idx')
+            ]
 
     objects = TickerManager()
+    all_objects = models.Manager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        replicate(self)
+        bump_version()
+        bump_version('tickers')
 
 
-class TradeBase(SoftDeleteCreateModifyModel):
+class TradeBase(VersionedModel):
 
     """ 
     Abstract TradeBase model for Trade & TradeHistory model
@@ -188,6 +470,9 @@ class TradeBase(SoftDeleteCreateModifyModel):
         quantity (int): Trade Quantity of ticker
         ticker (Ticker): Ticker instance foreign key
         price (decimal): Field representing traded price
+        portfolio (Portfolio): Portfolio instance foreign key
+        version (int): Incremented by every save of a trade, recorded by
+            its TradeHistory versions
     """
     CATEGORY_BOUGHT = 1
     CATEGORY_SOLD = 2
@@ -200,6 +485,8 @@ class TradeBase(SoftDeleteCreateModifyModel):
         validators=[MaxValueValidator(9999999), MinValueValidator(1)])
     ticker = models.ForeignKey('portfolio.Ticker', on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=8, decimal_places=2)
+    portfolio = models.ForeignKey('portfolio.Portfolio',
+        on_delete=models.CASCADE, default=current_portfolio)
 
     class Meta:
         abstract = True
@@ -207,15 +494,102 @@ class TradeBase(SoftDeleteCreateModifyModel):
 
 class Trade(TradeBase):
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['portfolio', 'created_at', 'id'],
+                condition=models.Q(active=True),
+                name='trade_pf_created_id_idx'),
+            models.Index(fields=['portfolio', 'ticker', 'created_at', 'id'],
+                condition=models.Q(active=True),
+                name='trade_pf_tkr_created_id_idx'),
+            models.Index(fields=['portfolio', 'category', 'ticker', 'price'],
+                condition=models.Q(active=True),
+                name='trade_pf_cat_tkr_price_idx'),
+            models.Index(fields=['ticker', 'category'],
+                condition=models.Q(active=True),
+                name='trade_active_tkr_cat_idx'),
+            models.Index(fields=['modified_at', 'id'],
+                condition=models.Q(active=False),
+                name='trade_inactive_idx')
+            ]
+
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        TradeHistory.objects.create(
-            trade_reference=self,
-            category=self.category,
-            quantity=self.quantity,
-            ticker=self.ticker,
-            price=self.price
-        )
+
+        """
+        Saving trade, applying its change over the ticker's Position &
+        recording a TradeHistory version within one transaction of the
+        database of its portfolio
+
+        Raises:
+        VersionConflict: When the trade changed since it was read
+        """
+        with routed(self.portfolio_id), \
+                transaction.atomic(using=database_for(self.portfolio_id)):
+            previous = None
+            if self.pk:
+                previous = Trade.all_objects.select_for_update() \
+                    .filter(pk=self.pk) \
+                    .values('portfolio_id', 'ticker_id', 'category',
+                        'quantity', 'price', 'active') \
+                    .first()
+            super().save(*args, **kwargs)
+            current = {
+                'id': self.pk,
+                'created_at': self.created_at,
+                'portfolio_id': self.portfolio_id,
+                'ticker_id': self.ticker_id,
+                'category': self.category,
+                'quantity': self.quantity,
+                'price': self.price,
+                'active': self.active
+            }
+            # Soft deleted trades take no part in positions
+            Position.objects.apply_trade(
+                previous if previous and previous['active'] else None,
+                current if self.active else None)
+            LotQueue.objects.apply_trade(previous, current)
+            TradeHistory.objects.create(
+                trade_reference=self,
+                portfolio_id=self.portfolio_id,
+                category=self.category,
+                quantity=self.quantity,
+                ticker=self.ticker,
+                price=self.price,
+                active=self.active,
+                version=self.version
+            )
+            bump_version()
+
+    def set_active(self, active):
+
+        """
+        Soft deleting or restoring trade, validated against the running
+        balance of its ticker's Position, locked until the end of the
+        transaction when inside one
+
+        Raises:
+        ValidationError: When sold quantity would exceed bought quantity
+        """
+        if self.active != active:
+            positions = Position.objects.filter(
+                portfolio_id=self.portfolio_id, ticker_id=self.ticker_id)
+            if transaction.get_connection(
+                    database_for(self.portfolio_id)).in_atomic_block:
+                positions = positions.select_for_update()
+            available_qty = positions.values_list(
+                'final_quantity', flat=True).first() or 0
+            if (self.category == self.CATEGORY_BOUGHT) == active:
+                available_qty += self.quantity
+            else:
+                available_qty -= self.quantity
+            if available_qty < 0:
+                raise ValidationError({'Quantity': 'Sold quantity would '
+                    'exceed bought quantity by {quantity}'.format(
+                        quantity=-available_qty)})
+        super().set_active(active)
 
 
 class TradeHistory(TradeBase):
@@ -224,3 +598,1009 @@ class TradeHistory(TradeBase):
 
     class Meta:
         ordering = ['-pk']
+        indexes = [
+            models.Index(fields=['created_at', 'id'],
+                name='history_created_id_idx'),
+            models.Index(fields=['trade_reference', 'created_at', 'id'],
+                name='history_trade_created_id_idx'),
+            models.Index(fields=['trade_reference', '-id'],
+                name='history_trade_id_idx'),
+            models.Index(fields=['portfolio', 'created_at', 'id'],
+                name='history_pf_created_id_idx')
+            ]
+
+
+class PositionManager(models.Manager):
+
+    """
+        ManagerMethod:
+            apply_trade
+            add_delta
+            apply_deltas
+            mark_dirty
+            refresh_returns
+            totals
+            from_trades
+            rebuild
+            rebuild_database
+            verify
+            verify_database
+    """
+    def apply_trade(self, previous, current):
+
+        """
+        Applying difference between previous & current version of a trade
+        over the positions of their tickers, locking position rows in
+        ticker order
+
+        Parameters:
+        previous (dict): Trade values before save - portfolio_id, ticker_id,
+            category, quantity, price or None for a new trade
+        current (dict): Trade values after save or None for a removed trade
+        """
+        deltas = {}
+        for sign, trade in ((-1, previous), (1, current)):
+            if trade:
+                self.add_delta(deltas, trade, sign)
+        self.apply_deltas(deltas)
+
+    def add_delta(self, deltas, trade, sign=1):
+
+        """
+        Accumulating a trade's contribution to bought/sold quantity & buy
+        cost of its ticker in its portfolio
+
+        Parameters:
+        deltas (dict): Lists of bought, sold & cost keyed by portfolio id &
+            ticker id
+        trade (dict): Trade values - portfolio_id, ticker_id, category,
+            quantity, price
+        sign (int): 1 to add the trade, -1 to take it out
+        """
+        delta = deltas.setdefault((trade['portfolio_id'], trade['ticker_id']),
+            [0, 0, Decimal(0)])
+        quantity = sign * int(trade['quantity'])
+        if int(trade['category']) == Trade.CATEGORY_BOUGHT:
+            delta[0] += quantity
+            delta[2] += quantity * Decimal(str(trade['price']))
+        else:
+            delta[1] += quantity
+
+    def apply_deltas(self, deltas):
+
+        """
+        Applying accumulated deltas over positions, locking position rows
+        in portfolio & ticker order
+
+        Parameters:
+        deltas (dict): Lists of bought, sold & cost keyed by portfolio id &
+            ticker id
+        """
+        for portfolio_id, ticker_id in sorted(deltas):
+            bought, sold, cost = deltas[(portfolio_id, ticker_id)]
+            if not (bought or sold or cost):
+                continue
+            position, _ = self.select_for_update().get_or_create(
+                portfolio_id=portfolio_id, ticker_id=ticker_id)
+            position.bought_quantity += bought
+            position.sold_quantity += sold
+            position.total_buy_cost += cost
+            position.dirty = True
+            position.save()
+
+    def mark_dirty(self, ticker_ids):
+
+        """
+        Marking positions of tickers for returns recomputation, e.g. after
+        their price changed
+
+        Parameters:
+        ticker_ids (iterable): Ticker ids
+        """
+        self.filter(ticker_id__in=ticker_ids, dirty=False).update(dirty=True)
+
+    def refresh_returns(self):
+
+        """
+        Recomputing current_price & cumulative_return of dirty positions
+        only, rows locked by concurrent trade writes being left for the next
+        refresh
+
+        Returns:
+        int: Number of positions refreshed
+        """
+        from portfolio.prices import latest_prices
+        with transaction.atomic(using=self.db):
+            positions = list(self.select_for_update(skip_locked=True) \
+                .filter(dirty=True))
+            if not positions:
+                return 0
+            prices = latest_prices.get_many(
+                position.ticker_id for position in positions)
+            for position in positions:
+                position.current_price = prices.get(position.ticker_id)
+                position.cumulative_return = Decimal(cumulative_return(
+                    position.avg_buy_price, position.final_quantity,
+                    CURRENT_PRICE if position.current_price is None
+                    else position.current_price))
+                position.dirty = False
+            self.bulk_update(positions,
+                ['current_price', 'cumulative_return', 'dirty'],
+                batch_size=1000)
+        return len(positions)
+
+    def totals(self, trades):
+
+        """
+        Aggregating trades per portfolio & ticker in a single GROUP BY query
+
+        Parameters:
+        trades (QuerySet): Trade or TradeHistory queryset
+
+        Returns:
+        QuerySet: Values having portfolio_id, ticker_id, bought_quantity,
+        sold_quantity & total_buy_cost
+        """
+        bought = models.Q(category=Trade.CATEGORY_BOUGHT)
+        return trades.order_by().values('portfolio_id', 'ticker_id').annotate(
+            bought_quantity=Coalesce(
+                models.Sum('quantity', filter=bought), 0),
+            sold_quantity=Coalesce(models.Sum('quantity',
+                filter=models.Q(category=Trade.CATEGORY_SOLD)), 0),
+            total_buy_cost=Coalesce(models.Sum(
+                models.F('price') * models.F('quantity'), filter=bought,
+                output_field=Position._meta.get_field('total_buy_cost')),
+                models.Value(Decimal(0)),
+                output_field=Position._meta.get_field('total_buy_cost'))
+        )
+
+    def from_trades(self, trades):
+
+        """
+        Computing unsaved positions from exact Decimal per-ticker totals of
+        trades, without touching the Position table
+
+        Parameters:
+        trades (QuerySet): Trade or TradeHistory queryset
+
+        Returns:
+        list: List of computed Position instances
+        """
+        positions = [Position(**totals) for totals in self.totals(trades)]
+        for position in positions:
+            position.compute()
+        return positions
+
+    def rebuild(self):
+
+        """
+        Rebuilding every position of every portfolio database from its
+        Trade table
+
+        Returns:
+        int: Number of positions written
+        """
+        return sum(self.rebuild_database(alias)
+            for alias in routed_databases())
+
+    def rebuild_database(self, alias):
+
+        """
+        Rebuilding positions of a portfolio database from its Trade table
+
+        Returns:
+        int: Number of positions written
+        """
+        with transaction.atomic(using=alias):
+            self.using(alias).delete()
+            positions = self.from_trades(Trade.objects.using(alias).all())
+            self.using(alias).bulk_create(positions, batch_size=1000)
+            bump_version()
+        return len(positions)
+
+    def verify(self):
+
+        """
+        Verifying stored positions of every portfolio database against
+        totals from its Trade table & the latest TradeHistory version of
+        each trade
+
+        Returns:
+        list: List of mismatch descriptions, empty when consistent
+        """
+        mismatches = []
+        for alias in routed_databases():
+            mismatches.extend(self.verify_database(alias))
+        return mismatches
+
+    def verify_database(self, alias):
+
+        """
+        Verifying stored positions of a portfolio database
+
+        Returns:
+        list: List of mismatch descriptions, empty when consistent
+        """
+        fields = ('bought_quantity', 'sold_quantity', 'total_buy_cost')
+        stored = {(row['portfolio_id'], row['ticker_id']): row for row in
+            self.using(alias).values('portfolio_id', 'ticker_id', *fields)}
+        latest_versions = TradeHistory.objects.using(alias).order_by() \
+            .values('trade_reference') \
+            .annotate(last=models.Max('pk')).values('last')
+        sources = (
+            ('trade', self.totals(Trade.objects.using(alias).all())),
+            ('history', self.totals(
+                TradeHistory.objects.using(alias).filter(
+                    pk__in=latest_versions, active=True)))
+        )
+        empty = dict.fromkeys(fields, 0)
+        mismatches = []
+        for source, totals in sources:
+            expected = {(row['portfolio_id'], row['ticker_id']): row
+                for row in totals}
+            for key in sorted(set(stored) | set(expected)):
+                for field in fields:
+                    stored_value = stored.get(key, empty)[field]
+                    expected_value = expected.get(key, empty)[field]
+                    if stored_value != expected_value:
+                        mismatches.append(
+                            'portfolio {portfolio_id} ticker {ticker_id}: '
+                            '{field} is {stored} but {source} gives '
+                            '{expected}'.format(portfolio_id=key[0],
+                                ticker_id=key[1], field=field,
+                                stored=stored_value, source=source,
+                                expected=expected_value))
+        return mismatches
+
+
+class Position(CreateModifyModel):
+
+    """
+    Position model materializing aggregated trades of a ticker in a
+    portfolio, maintained incrementally on every trade write
+
+    Attributes:
+        portfolio (Portfolio): Portfolio instance foreign key
+        ticker (Ticker): Ticker instance foreign key
+        bought_quantity (int): Total quantity bought
+        sold_quantity (int): Total quantity sold
+        total_buy_cost (decimal): Sum of price * quantity of bought trades
+        final_quantity (int): Quantity held - bought minus sold
+        avg_buy_price (decimal): Average price of bought trades
+        current_price (decimal): Latest price used for cumulative_return,
+            None when falling back to CURRENT_PRICE
+        cumulative_return (decimal): Return of the holding at current_price
+        dirty (bool): Whether trades or price changed since cumulative_return
+            was computed
+    """
+    portfolio = models.ForeignKey('portfolio.Portfolio',
+        on_delete=models.CASCADE)
+    ticker = models.ForeignKey('portfolio.Ticker', on_delete=models.CASCADE)
+    bought_quantity = models.BigIntegerField(default=0)
+    sold_quantity = models.BigIntegerField(default=0)
+    total_buy_cost = models.DecimalField(max_digits=20, decimal_places=2,
+        default=0)
+    final_quantity = models.BigIntegerField(default=0)
+    avg_buy_price = models.DecimalField(max_digits=12, decimal_places=2,
+        default=0)
+    current_price = models.DecimalField(max_digits=8, decimal_places=2,
+        null=True)
+    cumulative_return = models.DecimalField(max_digits=20, decimal_places=2,
+        default=0)
+    dirty = models.BooleanField(default=True)
+
+    objects = PositionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'ticker'],
+                name='unique position ticker')
+            ]
+        indexes = [
+            models.Index(fields=['dirty'], condition=models.Q(dirty=True),
+                name='position_dirty_idx')
+            ]
+
+    def compute(self):
+
+        """
+        Computing derived final_quantity & avg_buy_price from the totals
+        """
+        self.final_quantity = self.bought_quantity - self.sold_quantity
+        self.avg_buy_price = Decimal(0)
+        if self.bought_quantity:
+            self.avg_buy_price = (Decimal(self.total_buy_cost) /
+                self.bought_quantity).quantize(PRICE_PRECISION, ROUND_HALF_UP)
+
+    def save(self, *args, **kwargs):
+        self.compute()
+        super().save(*args, **kwargs)
+
+
+class PriceManager(models.Manager):
+
+    """
+        ManagerMethod:
+            latest
+    """
+    def latest(self, ticker_ids, as_of=None):
+
+        """
+        Latest quoted prices of tickers in one query, always run on the
+        database of Price (default) whichever portfolio is being routed,
+        tickers being joined from that database too
+
+        Parameters:
+        ticker_ids (iterable): Ticker ids
+        as_of (datetime): Latest quotes at or before as_of, latest ever by
+            default
+
+        Returns:
+        dict: Latest price keyed by ticker id, for tickers having quotes
+        """
+        latest = self.filter(ticker=models.OuterRef('pk'))
+        if as_of is not None:
+            latest = latest.filter(quoted_at__lte=as_of)
+        latest = latest.order_by('-quoted_at', '-id').values('price')[:1]
+        return dict((ticker_id, price) for ticker_id, price in
+            Ticker.objects.db_manager(self.db).filter(id__in=ticker_ids)
+            .order_by().annotate(latest_price=models.Subquery(latest))
+            .values_list('id', 'latest_price') if price is not None)
+
+
+class Price(CreateModifyModel):
+
+    """ 
+    Price model for quotes of a ticker ingested from a price source
+      
+    Attributes: 
+        ticker (Ticker): Ticker instance foreign key
+        price (decimal): Quoted price
+        quoted_at (datetime): Time of the quote
+    """
+    ticker = models.ForeignKey('portfolio.Ticker', on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    quoted_at = models.DateTimeField(default=timezone.now)
+    objects = PriceManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ticker', '-quoted_at', '-id'],
+                name='price_ticker_quoted_idx')
+            ]
+
+
+class PositionSnapshotManager(models.Manager):
+
+    """
+        ManagerMethod:
+            checkpoint
+            state
+    """
+    def checkpoint(self, as_of=None):
+
+        """
+        Finding the latest checkpoint, or the latest one taken at or before
+        as_of
+
+        Parameters:
+        as_of (datetime): Point in time or None for the latest checkpoint
+
+        Returns:
+        tuple: history_id & taken_at of the checkpoint, (0, None) when
+        there is none
+        """
+        queryset = self.order_by('-taken_at', '-history_id')
+        if as_of is not None:
+            queryset = queryset.filter(taken_at__lte=as_of)
+        return queryset.values_list('history_id', 'taken_at').first() or \
+            (0, None)
+
+    def state(self, history_id):
+
+        """
+        Loading per-ticker totals of a checkpoint
+
+        Parameters:
+        history_id (int): Checkpoint, 0 meaning the empty book
+
+        Returns:
+        dict: Lists of bought, sold & cost keyed by portfolio id & ticker id
+        """
+        return dict(((portfolio_id, ticker_id), [bought, sold, cost]) for
+            portfolio_id, ticker_id, bought, sold, cost in self.filter(
+                history_id=history_id).values_list('portfolio_id',
+                'ticker_id', 'bought_quantity', 'sold_quantity',
+                'total_buy_cost'))
+
+
+class PositionSnapshot(CreateModifyModel):
+
+    """
+    PositionSnapshot model checkpointing per-ticker totals of every
+    TradeHistory version up to history_id, point-in-time queries replaying
+    versions after the nearest checkpoint only
+
+    Attributes:
+        history_id (int): Last TradeHistory id included in the checkpoint
+        taken_at (datetime): created_at of that TradeHistory row
+        portfolio (Portfolio): Portfolio instance foreign key
+        ticker (Ticker): Ticker instance foreign key
+        bought_quantity (int): Total quantity bought
+        sold_quantity (int): Total quantity sold
+        total_buy_cost (decimal): Sum of price * quantity of bought trades
+    """
+    history_id = models.BigIntegerField()
+    taken_at = models.DateTimeField()
+    portfolio = models.ForeignKey('portfolio.Portfolio',
+        on_delete=models.CASCADE)
+    ticker = models.ForeignKey('portfolio.Ticker', on_delete=models.CASCADE)
+    bought_quantity = models.BigIntegerField(default=0)
+    sold_quantity = models.BigIntegerField(default=0)
+    total_buy_cost = models.DecimalField(max_digits=20, decimal_places=2,
+        default=0)
+
+    objects = PositionSnapshotManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['history_id', 'portfolio', 'ticker'],
+                name='unique snapshot ticker')
+            ]
+        indexes = [
+            models.Index(fields=['taken_at', 'history_id'],
+                name='snapshot_taken_history_idx')
+            ]
+
+
+class LotQueueManager(models.Manager):
+
+    """
+        ManagerMethod:
+            apply_trades
+            apply_trade
+            rebuild
+            rebuild_database
+            summaries
+    """
+    def apply_trades(self, trades):
+
+        """
+        Matching lots of new trades incrementally for every method, trades
+        being the latest of their tickers
+
+        Parameters:
+        trades (list): Trade values - portfolio_id, ticker_id, category,
+            quantity, price, in trade order
+        """
+        portfolio_ids = set(trade['portfolio_id'] for trade in trades)
+        ticker_ids = set(trade['ticker_id'] for trade in trades)
+        queues = dict(((queue.portfolio_id, queue.ticker_id, queue.method),
+                queue) for queue in self.select_for_update().filter(
+            portfolio_id__in=portfolio_ids, ticker_id__in=ticker_ids))
+        books = dict((key, queue.load()) for key, queue in queues.items())
+        for trade in trades:
+            for method, _ in METHOD_CHOICES:
+                key = (trade['portfolio_id'], trade['ticker_id'], method)
+                if key not in books:
+                    books[key] = Lots(method)
+                books[key].apply(int(trade['category']),
+                    int(trade['quantity']), to_cents(trade['price']))
+        created = []
+        for (portfolio_id, ticker_id, method), book in books.items():
+            queue = queues.get((portfolio_id, ticker_id, method))
+            if queue is None:
+                queue = LotQueue(portfolio_id=portfolio_id,
+                    ticker_id=ticker_id, method=method)
+                created.append(queue)
+            queue.dump(book)
+        self.bulk_create(created, batch_size=1000)
+        self.bulk_update([queue for queue in queues.values()],
+            ['lots', 'open_quantity', 'open_cost', 'realized'],
+            batch_size=1000)
+
+    def apply_trade(self, previous, current):
+
+        """
+        Matching lots of a saved trade, incrementally for a new trade,
+        replaying trades of its tickers from their checkpoint before the
+        trade when an existing trade changed as matching depends on the
+        order of trades. With the PORTFOLIO_DEFER_RECOMPUTE setting,
+        replays are queued as recompute_ticker jobs once the transaction
+        commits, edits of a ticker collapsing into one job
+
+        Parameters:
+        previous (dict): Trade values before save or None for a new trade
+        current (dict): Trade values after save or None for a removed trade,
+            inactive values being soft deleted, having id & created_at
+        """
+        if previous is None and current is not None:
+            if current.get('active', True):
+                self.apply_trades([current])
+            return
+        ticker_ids = sorted(set(trade['ticker_id']
+            for trade in (previous, current) if trade))
+        portfolio_id = current['portfolio_id']
+        if getattr(settings, 'PORTFOLIO_DEFER_RECOMPUTE', False):
+            transaction.on_commit(lambda: [Job.objects.enqueue(
+                    'recompute_ticker', portfolio_id=portfolio_id,
+                    ticker_id=ticker_id) for ticker_id in ticker_ids],
+                using=self.db)
+            return
+        self.replay(ticker_ids, portfolio_id,
+            (current['created_at'], current['id']))
+
+    def replay(self, ticker_ids, portfolio_id, position):
+
+        """
+        Replaying trades of tickers from the checkpoint of their lot queues
+        when it precedes position, rebuilding the others
+
+        Parameters:
+        ticker_ids (iterable): Tickers to replay
+        portfolio_id (int): Portfolio of the tickers
+        position (tuple): created_at & id of the earliest trade changed
+
+        Returns:
+        int: Number of lot queues written
+        """
+        queues = {}
+        for queue in self.select_for_update().filter(
+                portfolio_id=portfolio_id, ticker_id__in=ticker_ids):
+            queues.setdefault(queue.ticker_id, {})[queue.method] = queue
+        resumable = {}
+        for ticker_id in ticker_ids:
+            methods = queues.get(ticker_id, {})
+            checkpoints = set((queue.checkpoint_at, queue.checkpoint_trade)
+                for queue in methods.values())
+            if len(methods) == len(METHOD_CHOICES) and \
+                    len(checkpoints) == 1:
+                checkpoint = checkpoints.pop()
+                if checkpoint[0] is not None and checkpoint < position:
+                    resumable[ticker_id] = checkpoint
+        written = 0
+        rebuilt = set(ticker_ids) - set(resumable)
+        if rebuilt:
+            written += self.rebuild(rebuilt, portfolio_id)
+        if not resumable:
+            return written
+        after = models.Q()
+        for ticker_id, (at, trade_id) in resumable.items():
+            after |= models.Q(ticker_id=ticker_id) & (
+                models.Q(created_at__gt=at) |
+                models.Q(created_at=at, id__gt=trade_id))
+        rows = [(ticker_id, category, quantity, to_cents(price),
+                (created_at, trade_id))
+            for ticker_id, category, quantity, price, created_at, trade_id
+            in Trade.objects.filter(after, portfolio_id=portfolio_id) \
+                .order_by('created_at', 'id').values_list('ticker_id',
+                    'category', 'quantity', 'price', 'created_at', 'id')]
+        tail = getattr(settings, 'PORTFOLIO_LOT_CHECKPOINT_TAIL',
+            CHECKPOINT_TAIL)
+        updated = []
+        for method, _ in METHOD_CHOICES:
+            books, checkpoints = replay_from(rows, method, dict(
+                (ticker_id, Lots.unpack(method, queues[ticker_id][method] \
+                    .checkpoint)) for ticker_id in resumable), tail)
+            for ticker_id, book in books.items():
+                queue = queues[ticker_id][method]
+                queue.dump(book, checkpoints.get(ticker_id))
+                updated.append(queue)
+        self.bulk_update(updated, ['lots', 'open_quantity', 'open_cost',
+            'realized', 'checkpoint', 'checkpoint_at', 'checkpoint_trade'],
+            batch_size=1000)
+        bump_version('returns')
+        return written + len(updated)
+
+    def rebuild(self, ticker_ids=None, portfolio_id=None):
+
+        """
+        Replaying trades in order to rebuild lot queues of tickers,
+        checkpointing them PORTFOLIO_LOT_CHECKPOINT_TAIL trades before
+        their last trade
+
+        Parameters:
+        ticker_ids (iterable): Tickers to rebuild, all by default
+        portfolio_id (int): Portfolio to rebuild, all portfolios of every
+            portfolio database by default
+
+        Returns:
+        int: Number of lot queues written
+        """
+        if portfolio_id is None:
+            return sum(self.rebuild_database(alias, ticker_ids)
+                for alias in routed_databases())
+        return self.rebuild_database(database_for(portfolio_id), ticker_ids,
+            portfolio_id)
+
+    def rebuild_database(self, alias, ticker_ids=None, portfolio_id=None):
+
+        """
+        Rebuilding lot queues of a portfolio database
+
+        Returns:
+        int: Number of lot queues written
+        """
+        trades = Trade.objects.using(alias).order_by('created_at', 'id')
+        queues = self.using(alias)
+        if ticker_ids is not None:
+            trades = trades.filter(ticker_id__in=ticker_ids)
+            queues = queues.filter(ticker_id__in=ticker_ids)
+        if portfolio_id is not None:
+            trades = trades.filter(portfolio_id=portfolio_id)
+            queues = queues.filter(portfolio_id=portfolio_id)
+        rows = [((book_id, ticker_id), category, quantity, to_cents(price),
+                (created_at, trade_id))
+            for book_id, ticker_id, category, quantity, price, created_at,
+                trade_id in trades.values_list('portfolio_id', 'ticker_id',
+                    'category', 'quantity', 'price', 'created_at', 'id') \
+                .iterator(chunk_size=5000)]
+        tail = getattr(settings, 'PORTFOLIO_LOT_CHECKPOINT_TAIL',
+            CHECKPOINT_TAIL)
+        created = []
+        for method, _ in METHOD_CHOICES:
+            books, checkpoints = replay_from(rows, method, tail=tail)
+            for (book_id, ticker_id), book in books.items():
+                queue = LotQueue(portfolio_id=book_id, ticker_id=ticker_id,
+                    method=method)
+                queue.dump(book, checkpoints.get((book_id, ticker_id)))
+                created.append(queue)
+        with transaction.atomic(using=alias):
+            queues.delete()
+            self.using(alias).bulk_create(created, batch_size=1000)
+            bump_version('returns')
+        return len(created)
+
+    def summaries(self, method, ticker_ids=None,
+            portfolio_id=None):
+
+        """
+        Reading open quantity, open cost & realized P&L of tickers in a
+        portfolio
+
+        Parameters:
+        method (int): FIFO, LIFO or AVERAGE
+        ticker_ids (iterable): Restricting summaries to these tickers
+        portfolio_id (int): Portfolio of the lot queues, the current
+            portfolio by default
+
+        Returns:
+        dict: Tuples of open_quantity, open_cost, realized keyed by
+        ticker id
+        """
+        if portfolio_id is None:
+            portfolio_id = current_portfolio()
+        queryset = self.filter(portfolio_id=portfolio_id, method=method)
+        if ticker_ids is not None:
+            queryset = queryset.filter(ticker_id__in=ticker_ids)
+        return dict((ticker_id, values) for ticker_id, *values in
+            queryset.values_list('ticker_id', 'open_quantity', 'open_cost',
+                'realized'))
+
+
+class LotQueue(CreateModifyModel):
+
+    """
+    LotQueue model keeping open lots of a ticker in a portfolio for a lot
+    matching method packed in one binary column, not one row per lot
+
+    Attributes:
+        portfolio (Portfolio): Portfolio instance foreign key
+        ticker (Ticker): Ticker instance foreign key
+        method (int): FIFO, LIFO or AVERAGE
+        lots (bytes): Open lots, int64 quantities followed by int64 prices
+            in cents
+        open_quantity (int): Total open quantity
+        open_cost (decimal): Total cost of open quantity
+        realized (decimal): Realized P&L of sells
+        checkpoint (bytes): Packed matching state after the trade at
+            checkpoint_at & checkpoint_trade, edits of later trades
+            replaying from it
+        checkpoint_at (datetime): created_at of that trade, None without a
+            checkpoint
+        checkpoint_trade (int): Id of that trade
+    """
+    portfolio = models.ForeignKey('portfolio.Portfolio',
+        on_delete=models.CASCADE)
+    ticker = models.ForeignKey('portfolio.Ticker', on_delete=models.CASCADE)
+    method = models.IntegerField(choices=METHOD_CHOICES)
+    lots = models.BinaryField(default=b'')
+    open_quantity = models.BigIntegerField(default=0)
+    open_cost = models.DecimalField(max_digits=20, decimal_places=2,
+        default=0)
+    realized = models.DecimalField(max_digits=20, decimal_places=2,
+        default=0)
+    checkpoint = models.BinaryField(default=b'')
+    checkpoint_at = models.DateTimeField(null=True, blank=True)
+    checkpoint_trade = models.BigIntegerField(null=True, blank=True)
+
+    objects = LotQueueManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'ticker', 'method'],
+                name='unique lot queue method')
+            ]
+
+    def load(self):
+
+        """
+        Returns:
+        Lots: Lot matching state of the queue
+        """
+        return Lots(self.method, bytes(self.lots), self.open_quantity,
+            to_cents(self.open_cost), to_cents(self.realized))
+
+    def dump(self, book, checkpoint=None):
+
+        """
+        Storing lot matching state in the queue
+
+        Parameters:
+        book (Lots): Lot matching state
+        checkpoint (tuple): Packed state & position (created_at & id) of
+            a new checkpoint, the current one being kept by default
+        """
+        self.lots = book.to_bytes()
+        self.open_quantity = book.open_quantity
+        self.open_cost = from_cents(book.open_cost)
+        self.realized = from_cents(book.realized)
+        if checkpoint is not None:
+            self.checkpoint, (self.checkpoint_at, self.checkpoint_trade) = \
+                checkpoint
+
+
+class HistoryArchiveManager(models.Manager):
+
+    """
+        ManagerMethod:
+            horizon
+    """
+    def horizon(self):
+
+        """
+        Returns:
+        int: Checkpoint (history id) archival relied on, versions needed
+        by replays from older checkpoints having possibly been archived,
+        0 when nothing was archived
+        """
+        return self.aggregate(horizon=Coalesce(
+            models.Max('checkpoint_id'), 0))['horizon']
+
+
+class HistoryArchive(CreateModifyModel):
+
+    """
+    HistoryArchive model indexing a gzipped JSONL file of archived
+    TradeHistory versions, written in independently compressed blocks so
+    a reader can decompress the blocks it needs only
+
+    Attributes:
+        path (str): File name within PORTFOLIO_HISTORY_ARCHIVE_DIR
+        month (date): First day of the month of the archived versions
+        first_id (int): Smallest archived TradeHistory id
+        last_id (int): Greatest archived TradeHistory id
+        rows (int): Number of archived versions
+        checkpoint_id (int): Checkpoint every archived version is
+            superseded at
+        blocks (list): Blocks as [offset, length, first_id, last_id]
+        trades (dict): Numbers of the blocks holding versions of a trade,
+            keyed by trade id
+    """
+    path = models.CharField(max_length=255, unique=True)
+    month = models.DateField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    rows = models.IntegerField()
+    checkpoint_id = models.BigIntegerField()
+    blocks = models.JSONField(default=list)
+    trades = models.JSONField(default=dict)
+
+    objects = HistoryArchiveManager()
+
+    class Meta:
+        ordering = ['-last_id']
+
+
+class JobManager(models.Manager):
+
+    """
+        ManagerMethod:
+            enqueue
+            claim
+            requeue_stale
+            prune
+    """
+    def enqueue(self, kind, run_after=None, **arguments):
+
+        """
+        Queueing a job unless an identical one (same kind & arguments) is
+        pending already, bursts of identical jobs collapsing into one
+
+        Parameters:
+        kind (str): Kind of job, a handler of portfolio.jobs
+        run_after (datetime): Earliest start, now by default
+        arguments (dict): JSON serializable keyword arguments of the handler
+
+        Returns:
+        tuple: Pending Job & whether it was created
+        """
+        key = '{kind}:{digest}'.format(kind=kind, digest=hashlib.sha1(
+            json.dumps(arguments, sort_keys=True, default=str) \
+                .encode('utf-8')).hexdigest())
+        try:
+            with transaction.atomic(using=self.db):
+                return self.create(kind=kind, key=key, arguments=arguments,
+                    run_after=run_after or timezone.now()), True
+        except IntegrityError:
+            job = self.filter(key=key, status=Job.STATUS_PENDING).first()
+            if job is None:
+                raise
+            return job, False
+
+    def claim(self, worker, kinds=None):
+
+        """
+        Claiming the oldest due pending job, skipping jobs locked by other
+        workers & jobs of a key already running, the claim comparing &
+        swapping its status so a job only ever runs once at a time
+
+        Parameters:
+        worker (str): Name of the claiming worker
+        kinds (iterable): Restricting jobs to these kinds
+
+        Returns:
+        Job: Claimed job, None when none is due
+        """
+        with transaction.atomic(using=self.db):
+            jobs = self.select_for_update(skip_locked=True).filter(
+                    status=Job.STATUS_PENDING, run_after__lte=timezone.now()) \
+                .exclude(key__in=self.filter(status=Job.STATUS_RUNNING) \
+                    .values('key')) \
+                .order_by('run_after', 'id')
+            if kinds:
+                jobs = jobs.filter(kind__in=kinds)
+            job = jobs.first()
+            if job is None:
+                return None
+            claimed = self.filter(pk=job.pk, status=Job.STATUS_PENDING) \
+                .update(status=Job.STATUS_RUNNING, worker=worker,
+                    started_at=timezone.now(),
+                    attempts=models.F('attempts') + 1,
+                    modified_at=timezone.now())
+        if not claimed:
+            return None
+        job.refresh_from_db()
+        return job
+
+    def requeue_stale(self, timeout):
+
+        """
+        Putting back jobs running for longer than timeout, their worker
+        being presumed dead, or failing them when an identical job is
+        pending already
+
+        Parameters:
+        timeout (int): Seconds a job may run
+
+        Returns:
+        int: Number of jobs requeued or failed
+        """
+        stale = list(self.filter(status=Job.STATUS_RUNNING,
+            started_at__lt=timezone.now() -
+                datetime.timedelta(seconds=timeout)))
+        for job in stale:
+            job.retry('Worker {worker} timed out'.format(worker=job.worker))
+        return len(stale)
+
+    def prune(self, days):
+
+        """
+        Deleting jobs done or failed for longer than days
+
+        Returns:
+        int: Number of jobs deleted
+        """
+        deleted, _ = self.filter(status__in=(Job.STATUS_DONE,
+                Job.STATUS_FAILED),
+            finished_at__lt=timezone.now() - datetime.timedelta(days=days)) \
+            .delete()
+        return deleted
+
+
+class Job(CreateModifyModel):
+
+    """
+    Job model queueing background work (recomputations, rebuilds, imports,
+    archival) for run_workers, stored in the default database so every
+    worker shares one queue
+
+    Attributes:
+        kind (str): Kind of job, a handler of portfolio.jobs
+        key (str): Kind & digest of arguments, unique among pending jobs
+        arguments (dict): Keyword arguments of the handler
+        status (int): Pending, running, done or failed
+        attempts (int): Number of times the job was claimed
+        run_after (datetime): Earliest start, pushed back by retries
+        started_at (datetime): Start of the latest attempt
+        finished_at (datetime): End of the job once done or failed
+        worker (str): Worker of the latest attempt
+        result (dict): Result of the handler
+        error (str): Error of the latest failed attempt
+    """
+    STATUS_PENDING = 1
+    STATUS_RUNNING = 2
+    STATUS_DONE = 3
+    STATUS_FAILED = 4
+    STATUS_CHOICES = (
+            (STATUS_PENDING, 'pending'),
+            (STATUS_RUNNING, 'running'),
+            (STATUS_DONE, 'done'),
+            (STATUS_FAILED, 'failed')
+        )
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict)
+    status = models.IntegerField(choices=STATUS_CHOICES,
+        default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        # Statuses being pending (1), running (2), done (3) & failed (4)
+        constraints = [
+            models.UniqueConstraint(fields=['key'],
+                condition=models.Q(status=1), name='unique pending job')
+            ]
+        indexes = [
+            models.Index(fields=['run_after', 'id'],
+                condition=models.Q(status=1), name='job_pending_idx'),
+            models.Index(fields=['key'], condition=models.Q(status=2),
+                name='job_running_idx'),
+            models.Index(fields=['finished_at'],
+                condition=models.Q(status__in=(3, 4)),
+                name='job_finished_idx')
+            ]
+
+    def finish(self, result=None):
+
+        """
+        Marking the running job done with the result of its handler
+        """
+        Job.objects.filter(pk=self.pk, status=self.STATUS_RUNNING).update(
+            status=self.STATUS_DONE, result=result, error='',
+            finished_at=timezone.now(), modified_at=timezone.now())
+
+    def retry(self, error):
+
+        """
+        Putting the running job back with an exponential delay until
+        PORTFOLIO_JOB_ATTEMPTS attempts failed, failing it then or when an
+        identical job is pending already (which will do the work)
+
+        Parameters:
+        error (str): Error of the attempt
+        """
+        running = Job.objects.filter(pk=self.pk, status=self.STATUS_RUNNING)
+        if self.attempts < getattr(settings, 'PORTFOLIO_JOB_ATTEMPTS', 3):
+            try:
+                with transaction.atomic(using=Job.objects.db):
+                    running.update(status=self.STATUS_PENDING, error=error,
+                        run_after=timezone.now() + datetime.timedelta(
+                            seconds=getattr(settings,
+                                'PORTFOLIO_JOB_RETRY_DELAY', 10) *
+                            2 ** (self.attempts - 1)),
+                        modified_at=timezone.now())
+                return
+            except IntegrityError:
+                pass
+        running.update(status=self.STATUS_FAILED, error=error,
+            finished_at=timezone.now(), modified_at=timezone.now())
@@ -0,0 +1,159 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from portfolio.instrumentation import render
+
+
+class KeysetPage:
+
+    """
+    KeysetPage class holding a page of rows & cursors of its neighbours
+
+    Attributes:
+        object_list (list): Rows of the page
+        has_next (bool): Whether a next page exists
+        has_previous (bool): Whether a previous page exists
+        next_link (str): URL of the next page or None
+        previous_link (str): URL of the previous page or None
+    """
+
+    def __init__(self, object_list, has_next, has_previous, next_link,
+            previous_link):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_link = next_link
+        self.previous_link = previous_link
+
+
+class KeysetPaginator:
+
+    """
+    KeysetPaginator class paginating a queryset by cursor over
+    (created_at, id), so every page is one indexed range read whatever its
+    position
+
+    Attributes:
+        request (Request): Request having cursor & page_size parameters
+        descending (bool): descending True lists newest rows first
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 500
+
+    def __init__(self, request, descending=False):
+        self.request = request
+        self.descending = descending
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get(
+                self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, row, reverse):
+        if isinstance(row, dict):
+            position = [row['created_at'].isoformat(), row['id'],
+                int(reverse)]
+        else:
+            position = [row.created_at.isoformat(), row.pk, int(reverse)]
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(),
+            self.cursor_query_param, cursor)
+
+    def decode_cursor(self):
+        cursor = self.request.GET.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            created_at, pk, reverse = json.loads(
+                base64.urlsafe_b64decode(cursor.encode('ascii')))
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(cursor)
+            return created_at, int(pk), bool(reverse)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound('Invalid cursor')
+
+    def paginate(self, queryset):
+
+        """
+        Fetching the page addressed by the request's cursor
+
+        Parameters:
+        queryset (QuerySet): Unordered queryset to paginate, values()
+            querysets having id & created_at
+
+        Returns:
+        KeysetPage: Page of model instances or of values() dicts
+        """
+        page_size = self.get_page_size()
+        cursor = self.decode_cursor()
+        reverse = bool(cursor and cursor[2])
+        ascending = self.descending == reverse
+        if cursor:
+            created_at, pk = cursor[:2]
+            if ascending:
+                queryset = queryset.filter(Q(created_at__gt=created_at) |
+                    Q(created_at=created_at, pk__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) |
+                    Q(created_at=created_at, pk__lt=pk))
+        ordering = ('created_at', 'id') if ascending else \
+            ('-created_at', '-id')
+        rows = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+        previous_link = None
+        if has_previous:
+            previous_link = self.encode_cursor(rows[0], True) if rows else \
+                remove_query_param(self.request.build_absolute_uri(),
+                    self.cursor_query_param)
+        return KeysetPage(rows, has_next, has_previous,
+            self.encode_cursor(rows[-1], False) if has_next and rows else None,
+            previous_link)
+
+
+def render_page(request, page, data, template_name, context):
+
+    """
+    Rendering a page as JSON when requested with ?format=json or an
+    application/json Accept header, otherwise as the HTML template
+
+    Parameters:
+    request (Request): Current request
+    page (KeysetPage): Page being rendered
+    data (list): Serialized rows of the page
+    template_name (str): HTML template
+    context (dict): Template context, data included
+
+    Returns:
+    Response/HttpResponse: JSON or rendered HTML
+    """
+    if request.GET.get('format') == 'json' or \
+            'application/json' in request.META.get('HTTP_ACCEPT', ''):
+        return Response({
+            'next': page.next_link,
+            'previous': page.previous_link,
+            'results': data
+        })
+    context.update({
+        'page_obj': page,
+        'is_paginated': page.has_next or page.has_previous
+    })
+    return render(request, template_name, context)
@@ -0,0 +1,248 @@
+import abc
+import csv
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from portfolio.models import PRICE_PRECISION, Price, Ticker
+from portfolio.signals import prices_changed
+
+"""
+    Constants for price ingestion
+        DEFAULT_BATCH_SIZE: Quotes ingested per batch
+        PRICE_KEY: Shared cache key of the latest price of a ticker
+        VERSION_KEY: Shared cache key bumped whenever a latest price changes
+"""
+DEFAULT_BATCH_SIZE = 500
+PRICE_KEY = 'portfolio:price:{ticker_id}'
+VERSION_KEY = 'portfolio:price:version'
+
+Quote = namedtuple('Quote', ('symbol', 'price', 'quoted_at'))
+
+
+class PriceSource(abc.ABC):
+
+    """
+    Base PriceSource class for pluggable quote feeds, subclasses
+    implementing quotes()
+    """
+
+    @abc.abstractmethod
+    def quotes(self):
+
+        """
+        Returns:
+        iterator: Quote tuples in arrival order
+        """
+
+    def batches(self, batch_size=DEFAULT_BATCH_SIZE):
+
+        """
+        Returns:
+        generator: Lists of at most batch_size quotes
+        """
+        batch = []
+        for quote in self.quotes():
+            batch.append(quote)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class CSVPriceSource(PriceSource):
+
+    """
+    CSVPriceSource class replaying quotes from a CSV file having symbol,
+    price & optional quoted_at (ISO 8601) columns, for testing
+
+    Attributes:
+        path (str): CSV file path
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def quotes(self):
+        with open(self.path, newline='', encoding='utf-8') as stream:
+            for row in csv.DictReader(stream):
+                yield Quote(row['symbol'],
+                    Decimal(row['price']).quantize(PRICE_PRECISION),
+                    parse_datetime(row.get('quoted_at') or '') or
+                    timezone.now())
+
+
+def price_cache():
+    return caches['prices']
+
+
+def get_price_source(*args, **kwargs):
+
+    """
+    Instantiating the price source class configured with
+    PORTFOLIO_PRICE_SOURCE setting (dotted path)
+
+    Returns:
+    PriceSource: Price source
+    """
+    return import_string(getattr(settings, 'PORTFOLIO_PRICE_SOURCE',
+        'portfolio.prices.CSVPriceSource'))(*args, **kwargs)
+
+
+class LatestPriceCache:
+
+    """
+    LatestPriceCache class keeping latest prices keyed by ticker id in an
+    in-process dict in front of the shared prices cache, the in-process
+    copy being dropped whenever the shared version changes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.prices = {}
+
+    def get_many(self, ticker_ids):
+
+        """
+        Fetching latest prices of tickers, normally in a single shared
+        cache round trip, loading misses from Price in one query
+
+        Parameters:
+        ticker_ids (iterable): Ticker ids
+
+        Returns:
+        dict: Latest price keyed by ticker id, for tickers having quotes
+        """
+        ticker_ids = set(ticker_ids)
+        with self.lock:
+            local = dict(self.prices)
+        keys = dict((PRICE_KEY.format(ticker_id=ticker_id), ticker_id)
+            for ticker_id in ticker_ids - set(local))
+        shared = price_cache().get_many([VERSION_KEY] + list(keys))
+        version = shared.pop(VERSION_KEY, None)
+        if version != self.version:
+            local = {}
+            keys = dict((PRICE_KEY.format(ticker_id=ticker_id), ticker_id)
+                for ticker_id in ticker_ids)
+            shared.update(price_cache().get_many([key for key in keys
+                if key not in shared]))
+        prices = dict((key, value) for key, value in local.items()
+            if key in ticker_ids)
+        prices.update((keys[key], value) for key, value in shared.items())
+        missing = ticker_ids - set(prices)
+        if missing:
+            loaded = self.load(missing)
+            price_cache().set_many(dict((PRICE_KEY.format(
+                ticker_id=ticker_id), price) for ticker_id, price in
+                loaded.items()), None)
+            prices.update(loaded)
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.prices = {}
+            self.prices.update(prices)
+        return prices
+
+    def load(self, ticker_ids):
+
+        """
+        Loading latest prices from the Price table in one query
+
+        Returns:
+        dict: Latest price keyed by ticker id, for tickers having quotes
+        """
+        return Price.objects.latest(ticker_ids)
+
+    def set_many(self, prices):
+
+        """
+        Storing new latest prices in the shared & in-process cache & bumping
+        the shared version so other processes drop their in-process copy
+
+        Parameters:
+        prices (dict): Latest price keyed by ticker id
+        """
+        price_cache().set_many(dict((PRICE_KEY.format(ticker_id=ticker_id),
+            price) for ticker_id, price in prices.items()), None)
+        try:
+            version = price_cache().incr(VERSION_KEY)
+        except ValueError:
+            version = 1
+            price_cache().set(VERSION_KEY, version, None)
+        with self.lock:
+            self.version = version
+            self.prices.update(prices)
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            self.prices = {}
+
+
+latest_prices = LatestPriceCache()
+
+
+def ingest(source, batch_size=DEFAULT_BATCH_SIZE):
+
+    """
+    Ingesting quotes of a price source batch by batch, storing every quote
+    & updating latest prices of tickers whose price changed only, quotes
+    older than the latest stored quote of their ticker (late batches)
+    leaving the latest price as is
+
+    Parameters:
+    source (PriceSource): Price source
+    batch_size (int): Quotes per batch
+
+    Returns:
+    dict: Ingestion summary - quotes, changed (set of ticker ids) &
+    unknown (set of symbols)
+    """
+    summary = {'quotes': 0, 'changed': set(), 'unknown': set()}
+    ticker_by_symbol = {}
+    for batch in source.batches(batch_size):
+        symbols = set(quote.symbol for quote in batch) - set(ticker_by_symbol)
+        if symbols:
+            ticker_by_symbol.update(Ticker.objects.filter(
+                symbol__in=symbols).values_list('symbol', 'id'))
+        quotes = []
+        for quote in batch:
+            if quote.symbol in ticker_by_symbol:
+                quotes.append(quote)
+            else:
+                summary['unknown'].add(quote.symbol)
+        latest = {}
+        for quote in sorted(quotes, key=lambda quote: quote.quoted_at):
+            latest[ticker_by_symbol[quote.symbol]] = quote
+        stored = dict(Price.objects.filter(ticker_id__in=latest)
+            .order_by().values('ticker_id')
+            .annotate(quoted_at=Max('quoted_at'))
+            .values_list('ticker_id', 'quoted_at'))
+        latest = dict((ticker_id, quote.price) for ticker_id, quote in
+            latest.items() if stored.get(ticker_id) is None or
+            quote.quoted_at > stored[ticker_id])
+        current = latest_prices.get_many(latest)
+        changed = dict((ticker_id, price) for ticker_id, price in
+            latest.items() if current.get(ticker_id) != price)
+        with transaction.atomic():
+            Price.objects.bulk_create([Price(
+                    ticker_id=ticker_by_symbol[quote.symbol],
+                    price=quote.price,
+                    quoted_at=quote.quoted_at
+                ) for quote in quotes])
+        if changed:
+            latest_prices.set_many(changed)
+            prices_changed.send(sender=Price, ticker_ids=set(changed))
+        summary['quotes'] += len(quotes)
+        summary['changed'].update(changed)
+    return summary
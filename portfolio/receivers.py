@@ -0,0 +1,13 @@
+from django.dispatch import receiver
+
+from portfolio.caching import bump_version
+from portfolio.models import Position
+from portfolio.routers import portfolio_databases
+from portfolio.signals import prices_changed
+
+
+@receiver(prices_changed)
+def mark_repriced_positions(sender, ticker_ids, **kwargs):
+    for alias in portfolio_databases():
+        Position.objects.db_manager(alias).mark_dirty(ticker_ids)
+    bump_version('returns')
@@ -0,0 +1,184 @@
+import contextlib
+import contextvars
+import functools
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+"""
+    Portfolio routing - trades, their history & everything derived from
+    them live in the database of their portfolio, large portfolios being
+    placed on their own alias by the PORTFOLIO_SHARDS setting. Reference
+    rows (tickers & portfolios) are written to the default database &
+    replicated to every portfolio database, so foreign keys hold there
+
+    Constants
+        DEFAULT_PORTFOLIO: Portfolio of requests & rows not naming one
+        SHARDED: Models stored in the database of their portfolio
+        REPLICATED: Models replicated to every portfolio database
+"""
+DEFAULT_PORTFOLIO = 1
+SHARDED = ('trade', 'tradehistory', 'position', 'lotqueue',
+    'positionsnapshot', 'historyarchive')
+REPLICATED = ('ticker', 'portfolio')
+
+current = contextvars.ContextVar('portfolio', default=None)
+
+
+def database_for(portfolio_id):
+
+    """
+    Returns:
+    str: Database alias of a portfolio, default unless sharded out
+    """
+    return getattr(settings, 'PORTFOLIO_SHARDS', {}).get(
+        int(portfolio_id), DEFAULT_DB_ALIAS)
+
+
+def portfolio_databases():
+
+    """
+    Returns:
+    list: Database aliases holding portfolios, default first
+    """
+    aliases = [DEFAULT_DB_ALIAS]
+    for alias in getattr(settings, 'PORTFOLIO_SHARDS', {}).values():
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def routed_databases():
+
+    """
+    Routing to every portfolio database in turn through a portfolio placed
+    there, e.g. for maintenance of portfolio data database by database
+
+    Returns:
+    generator: Database aliases, each being routed to while yielded
+    """
+    shards = getattr(settings, 'PORTFOLIO_SHARDS', {})
+    portfolio_ids = {}
+    for portfolio_id, alias in sorted(shards.items()):
+        portfolio_ids.setdefault(alias, portfolio_id)
+    portfolio_ids.setdefault(DEFAULT_DB_ALIAS, DEFAULT_PORTFOLIO
+        if DEFAULT_PORTFOLIO not in shards else max(shards) + 1)
+    for alias in portfolio_databases():
+        with routed(portfolio_ids[alias]):
+            yield alias
+
+
+def current_portfolio():
+
+    """
+    Returns:
+    int: Portfolio being routed, DEFAULT_PORTFOLIO outside routed()
+    """
+    portfolio_id = current.get()
+    return DEFAULT_PORTFOLIO if portfolio_id is None else portfolio_id
+
+
+def current_database():
+
+    """
+    Returns:
+    str: Database alias of the portfolio being routed
+    """
+    return database_for(current_portfolio())
+
+
+@contextlib.contextmanager
+def routed(portfolio_id):
+
+    """
+    Context manager routing queries of portfolio data to the database of
+    a portfolio, which becomes the default portfolio of new trades &
+    aggregations
+
+    Parameters:
+    portfolio_id (int): Portfolio id
+
+    Returns:
+    str: Database alias of the portfolio
+    """
+    token = current.set(int(portfolio_id))
+    try:
+        yield database_for(portfolio_id)
+    finally:
+        current.reset(token)
+
+
+def atomic(function=None):
+
+    """
+    transaction.atomic over the database being routed, resolved when
+    entered rather than when decorating
+
+    Parameters:
+    function (function): Function to decorate, None for a context manager
+
+    Returns:
+    Atomic/function: Context manager or decorated function
+    """
+    if function is None:
+        return transaction.atomic(using=current_database())
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with transaction.atomic(using=current_database()):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def replicate(instance):
+
+    """
+    Copying a reference row saved to the default database to every other
+    portfolio database
+
+    Parameters:
+    instance (Model): Saved Ticker or Portfolio
+    """
+    model = type(instance)
+    values = dict((field.attname, getattr(instance, field.attname))
+        for field in instance._meta.concrete_fields if not field.primary_key)
+    for alias in portfolio_databases():
+        if alias != instance._state.db:
+            # Copies are written without save(), which would replicate them
+            # back & check their version
+            manager = model._base_manager.using(alias)
+            if not manager.filter(pk=instance.pk).update(**values):
+                manager.bulk_create([model(pk=instance.pk, **values)])
+
+
+class PortfolioRouter:
+
+    """
+    Database router sending portfolio data to the database of the
+    portfolio of the instance, or of the portfolio being routed, reference
+    rows being read there & written to the default database
+    """
+
+    def route(self, model, hints):
+        if model._meta.app_label != 'portfolio':
+            return None
+        if model._meta.model_name in SHARDED:
+            instance = hints.get('instance')
+            if getattr(instance, 'portfolio_id', None) is not None:
+                return database_for(instance.portfolio_id)
+            return current_database()
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'portfolio' and \
+                model._meta.model_name in REPLICATED:
+            return current_database()
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if any(obj._meta.model_name in REPLICATED for obj in (obj1, obj2)):
+            return True
+        return None
@@ -1,9 +1,59 @@
+import abc
+import functools
+
 from rest_framework import serializers
+from django.db import transaction
 from django.db.models import Sum, Count
-from portfolio.models import Ticker, Trade
+from portfolio.instrumentation import instrumented, timed
+from portfolio.models import (Position, Ticker, Trade, TradeHistory,
+    VersionConflict)
+from portfolio.routers import current_portfolio
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    """ 
+    TimedListSerializer class timing serialization of many instances as
+    the serialization phase of the current request
+    """
+
+    def to_representation(self, data):
+        with timed('serialization'):
+            return super(TimedListSerializer, self).to_representation(data)
+
+
+class VersionedSerializer(serializers.ModelSerializer):
+
+    """ 
+    VersionedSerializer class for versioned models, an update given the
+    version its client read being refused once the row moved past it &
+    the save comparing & swapping the version the instance was read at
+    """
+
+    def expect_version(self, instance, validated_data):
+
+        """
+        Taking the version read by the client out of validated data
+
+        Raises:
+        VersionConflict: When the instance is past that version
+        """
+        version = validated_data.pop('version', None)
+        if version is not None and version != instance.version:
+            raise VersionConflict(instance._meta.verbose_name, instance.pk,
+                instance.version)
+
+    def create(self, validated_data):
+        validated_data.pop('version', None)
+        return super(VersionedSerializer, self).create(validated_data)
+
+    def update(self, instance, validated_data):
+        self.expect_version(instance, validated_data)
+        return super(VersionedSerializer, self).update(instance,
+            validated_data)
 
 
-class TickerSerializer(serializers.ModelSerializer):
+class TickerSerializer(VersionedSerializer):
 
     """ 
     TickerSerializer class to serializing Ticker model & calculating
@@ -17,10 +67,11 @@ class TickerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ticker
-        fields = ('id', 'name', 'symbol', 'number_of_trades')
+        fields = ('id', 'name', 'symbol', 'number_of_trades', 'version')
+        list_serializer_class = TimedListSerializer
 
 
-class TradeSerializer(serializers.ModelSerializer):
+class TradeSerializer(VersionedSerializer):
 
     """ 
     TradeSerializer class to serializing TradeModel & related fields
@@ -37,28 +88,78 @@ class TradeSerializer(serializers.ModelSerializer):
         model = Trade
         fields = (
             'id', 'category', 'ticker_id', 'quantity',
-            'price', 'ticker_name', 'ticker_symbol', 'category_name'
+            'price', 'ticker_name', 'ticker_symbol', 'category_name',
+            'version'
         )
+        list_serializer_class = TimedListSerializer
 
+    @instrumented('validation')
     def validate(self, data):
+
+        """
+        Validating a new or edited trade against running balances of its
+        tickers in the trade's portfolio (the current portfolio for a new
+        trade), read from their Position rows which are locked until the
+        end of the transaction when validating inside one. An edit takes
+        the previous version out before adding the new one, fields missing
+        from a partial update keeping the trade's values
+        """
         data = super(TradeSerializer, self).validate(data)
-        trades = Trade.objects.filter(
-            ticker__id=data['ticker_id'])
-        bought_qty = trades.filter(category=Trade.CATEGORY_BOUGHT).aggregate(
-            bought_qty=Sum('quantity')).get('bought_qty') or 0
-        sold_qty = trades.filter(category=Trade.CATEGORY_SOLD).aggregate(
-            sold_qty=Sum('quantity')).get('sold_qty') or 0
-        available_qty = bought_qty - sold_qty
-        if data['category'] == Trade.CATEGORY_SOLD:
-            if available_qty == 0:
+        instance = self.instance
+        edited = instance is not None and instance.pk and instance.active
+        trade = dict((field, data[field] if field in data else
+                getattr(instance, field))
+            for field in ('ticker_id', 'category', 'quantity'))
+        ticker_ids = {trade['ticker_id']}
+        if edited:
+            ticker_ids.add(instance.ticker_id)
+        positions = Position.objects.filter(ticker_id__in=ticker_ids,
+                portfolio_id=instance.portfolio_id if instance is not None
+                    else current_portfolio()) \
+            .order_by('ticker_id')
+        if transaction.get_connection(positions.db).in_atomic_block:
+            positions = positions.select_for_update()
+        balances = dict.fromkeys(ticker_ids, 0)
+        balances.update(positions.values_list('ticker_id', 'final_quantity'))
+        if edited:
+            balances[instance.ticker_id] -= instance.quantity \
+                if instance.category == Trade.CATEGORY_BOUGHT \
+                else -instance.quantity
+        available_qty = balances[trade['ticker_id']]
+        if trade['category'] == Trade.CATEGORY_SOLD:
+            if available_qty <= 0:
                 raise serializers.ValidationError({
                     'Quantity': 'No quantity available to sell'})
-            if data['quantity'] > available_qty:
+            if trade['quantity'] > available_qty:
                 raise serializers.ValidationError({
                     'Quantity': 'Available quantity to sell {available_qty}' \
                     .format(available_qty=available_qty)})
+        else:
+            balances[trade['ticker_id']] += trade['quantity']
+        # Lowering or moving a buy must leave earlier sells covered
+        for ticker_id, balance in sorted(balances.items()):
+            if balance < 0:
+                raise serializers.ValidationError({
+                    'Quantity': 'Sold quantity would exceed bought quantity '
+                    'by {quantity}'.format(quantity=-balance)})
         return data
 
+    def update(self, instance, validated_data):
+
+        """
+        Updating changed fields of a trade, its save applying the
+        difference between versions to its tickers' Positions & writing
+        one TradeHistory version within one transaction, an unchanged trade
+        being left untouched
+        """
+        self.expect_version(instance, validated_data)
+        changed = dict((field, value) for field, value in
+            validated_data.items() if getattr(instance, field) != value)
+        if not changed:
+            return instance
+        with transaction.atomic(using=instance._state.db):
+            return super(TradeSerializer, self).update(instance, changed)
+
     def get_ticker_name(self, instance):
         return instance.ticker.name
 
@@ -69,6 +170,38 @@ class TradeSerializer(serializers.ModelSerializer):
         return Trade.CATEGORY_CHOICES[instance.category-1][1]
 
 
+class TradeHistorySerializer(TradeSerializer):
+
+    """ 
+    TradeHistorySerializer class to serializing TradeHistory model,
+    a version of a trade
+    """
+    trade_id = serializers.ReadOnlyField(source='trade_reference_id')
+    created_at = serializers.ReadOnlyField()
+
+    class Meta:
+        model = TradeHistory
+        fields = (
+            'id', 'trade_id', 'category', 'ticker_id', 'quantity', 'price',
+            'ticker_name', 'ticker_symbol', 'category_name', 'created_at'
+        )
+        list_serializer_class = TimedListSerializer
+
+
+class TradeImportSerializer(TradeSerializer):
+
+    """ 
+    TradeImportSerializer class validating fields of imported trade rows,
+    oversell being checked in memory by the importer for the whole batch
+    """
+
+    class Meta(TradeSerializer.Meta):
+        read_only_fields = ('version',)
+
+    def validate(self, data):
+        return serializers.ModelSerializer.validate(self, data)
+
+
 class HoldingSerializer(serializers.ModelSerializer):
 
     """ 
@@ -85,6 +218,7 @@ class HoldingSerializer(serializers.ModelSerializer):
             'id', 'name', 'symbol', 
             'final_quantity', 'avg_buy_price'
         )
+        list_serializer_class = TimedListSerializer
 
     def get_avg_buy_price(self, instance):
         return instance.get('avg_buy_price')
@@ -101,14 +235,169 @@ class ReturnSerializer(serializers.ModelSerializer):
     """
     id = serializers.ReadOnlyField()
     cumulative_return = serializers.SerializerMethodField(read_only=True)
+    realized_return = serializers.SerializerMethodField(read_only=True)
+    unrealized_return = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Ticker
         fields = (
             'id', 'name', 'symbol', 
-            'cumulative_return'
+            'cumulative_return', 'realized_return', 'unrealized_return'
         )
+        list_serializer_class = TimedListSerializer
 
     def get_cumulative_return(self, instance):
         return instance.get('cumulative_return')
 
+    def get_realized_return(self, instance):
+        return instance.get('realized_return')
+
+    def get_unrealized_return(self, instance):
+        return instance.get('unrealized_return')
+
+
+@functools.lru_cache(maxsize=None)
+def representation(serializer_class, field_name):
+
+    """
+    Returns:
+    function: to_representation of a field of a serializer, e.g. to format
+    prices exactly like it
+    """
+    return serializer_class().fields[field_name].to_representation
+
+
+class FastListSerializer(abc.ABC):
+
+    """ 
+    FastListSerializer class, a read-only fast path of list endpoints
+    serializing rows of values() dicts (or of plain dicts) into dicts
+    matching the output of its model serializer, without per-field calls
+
+    Attributes: 
+        lookups (tuple): values() lookups the rows must have
+    """
+    lookups = ()
+
+    def __init__(self, instance, many=True):
+        self.instance = instance
+
+    @property
+    def data(self):
+        with timed('serialization'):
+            return self.serialize(self.instance)
+
+    @abc.abstractmethod
+    def serialize(self, rows):
+
+        """
+        Returns:
+        list: Serialized dicts of rows
+        """
+
+
+class FastTradeSerializer(FastListSerializer):
+
+    """ 
+    FastTradeSerializer class matching TradeSerializer over values() of
+    trades having ticker__name & ticker__symbol
+    """
+    lookups = ('id', 'category', 'quantity', 'price', 'ticker__name',
+        'ticker__symbol', 'version', 'created_at')
+
+    def serialize(self, rows):
+        price = representation(TradeSerializer, 'price')
+        categories = dict(Trade.CATEGORY_CHOICES)
+        return [{
+                'id': row['id'],
+                'category': row['category'],
+                'quantity': row['quantity'],
+                'price': price(row['price']),
+                'ticker_name': row['ticker__name'],
+                'ticker_symbol': row['ticker__symbol'],
+                'category_name': categories[row['category']],
+                'version': row['version']
+            } for row in rows]
+
+
+class FastTradeHistorySerializer(FastListSerializer):
+
+    """ 
+    FastTradeHistorySerializer class matching TradeHistorySerializer over
+    values() of trade versions
+    """
+    lookups = ('id', 'trade_reference_id', 'category', 'quantity', 'price',
+        'ticker__name', 'ticker__symbol', 'created_at')
+
+    def serialize(self, rows):
+        price = representation(TradeHistorySerializer, 'price')
+        categories = dict(TradeHistory.CATEGORY_CHOICES)
+        return [{
+                'id': row['id'],
+                'trade_id': row['trade_reference_id'],
+                'category': row['category'],
+                'quantity': row['quantity'],
+                'price': price(row['price']),
+                'ticker_name': row['ticker__name'],
+                'ticker_symbol': row['ticker__symbol'],
+                'category_name': categories[row['category']],
+                'created_at': row['created_at']
+            } for row in rows]
+
+
+class FastTickerSerializer(FastListSerializer):
+
+    """ 
+    FastTickerSerializer class matching TickerSerializer over values() of
+    tickers annotated with trade_count
+    """
+    lookups = ('id', 'name', 'symbol', 'trade_count', 'version',
+        'created_at')
+
+    def serialize(self, rows):
+        return [{
+                'id': row['id'],
+                'name': row['name'],
+                'symbol': row['symbol'],
+                'number_of_trades': row['trade_count'],
+                'version': row['version']
+            } for row in rows]
+
+
+class FastHoldingSerializer(FastListSerializer):
+
+    """ 
+    FastHoldingSerializer class matching HoldingSerializer over holdings
+    dicts
+    """
+
+    def serialize(self, rows):
+        return [{
+                'id': row['id'],
+                'name': row['name'],
+                'symbol': row['symbol'],
+                'final_quantity': row.get('final_quantity'),
+                'avg_buy_price': row.get('avg_buy_price')
+            } for row in rows]
+
+
+class FastReturnSerializer(FastListSerializer):
+
+    """ 
+    FastReturnSerializer class matching ReturnSerializer over returns
+    dicts, id being left out like ReturnSerializer does when rows have none
+    """
+
+    def serialize(self, rows):
+        data = []
+        for row in rows:
+            item = {'id': row['id']} if 'id' in row else {}
+            item.update({
+                'name': row['name'],
+                'symbol': row['symbol'],
+                'cumulative_return': row.get('cumulative_return'),
+                'realized_return': row.get('realized_return'),
+                'unrealized_return': row.get('unrealized_return')
+            })
+            data.append(item)
+        return data
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+"""
+    Signals of the portfolio
+        prices_changed: Sent with ticker_ids (set) whose latest price changed
+"""
+prices_changed = Signal()
@@ -0,0 +1,270 @@
+import datetime
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from portfolio.instrumentation import instrumented
+from portfolio.models import (CURRENT_PRICE, HistoryArchive, Position,
+    PositionSnapshot, Price, Ticker, TradeHistory, cumulative_return,
+    format_price)
+from portfolio.routers import current_portfolio, routed_databases
+
+"""
+    Constants for position snapshots, overridden by settings
+        SNAPSHOT_EVERY: TradeHistory rows between two checkpoints
+        SNAPSHOT_RETENTION_DAYS: Days checkpoints are kept, the latest one
+            being always kept
+        SNAPSHOT_LAG: Seconds a TradeHistory row must have aged before being
+            checkpointed, so rows of transactions still in flight are never
+            skipped
+"""
+SNAPSHOT_EVERY = 10000
+SNAPSHOT_RETENTION_DAYS = 90
+SNAPSHOT_LAG = 60
+
+
+def parse_as_of(value):
+
+    """
+    Parsing an as_of query parameter, a date meaning the end of that day
+
+    Parameters:
+    value (str): ISO 8601 date or datetime
+
+    Returns:
+    datetime: Aware point in time
+
+    Raises:
+    ValueError: When value is neither a date nor a datetime
+    """
+    as_of = parse_datetime(value)
+    if as_of is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('as_of must be an ISO 8601 date or datetime')
+        as_of = datetime.datetime.combine(day, datetime.time.max)
+    if timezone.is_naive(as_of):
+        as_of = timezone.make_aware(as_of)
+    return as_of
+
+
+def replay(state, after_id, until=None):
+
+    """
+    Replaying TradeHistory versions after a checkpoint over its per-ticker
+    totals, each version replacing the previous version of its trade
+
+    Parameters:
+    state (dict): Lists of bought, sold & cost keyed by portfolio id &
+        ticker id, updated in place
+    after_id (int): Checkpoint, versions with a greater id being replayed
+    until (datetime): Replaying versions created at or before until only
+
+    Returns:
+    tuple: Id & created_at of the last version replayed, (after_id, None)
+    when none was
+    """
+    fields = ('id', 'trade_reference_id', 'portfolio_id', 'ticker_id',
+        'category', 'quantity', 'price', 'active', 'created_at')
+    versions = TradeHistory.objects.filter(pk__gt=after_id)
+    if until is not None:
+        versions = versions.filter(created_at__lte=until)
+    versions = list(versions.order_by('pk').values(*fields))
+    if not versions:
+        return after_id, None
+    last_before = TradeHistory.objects.filter(pk__lte=after_id,
+            trade_reference__in=TradeHistory.objects.filter(
+                pk__in=[version['id'] for version in versions]) \
+                .values('trade_reference')) \
+        .order_by().values('trade_reference') \
+        .annotate(last=models.Max('pk')).values('last')
+    previous = dict((version['trade_reference_id'], version) for version in
+        TradeHistory.objects.filter(pk__in=last_before).values(*fields))
+    for version in versions:
+        prior = previous.get(version['trade_reference_id'])
+        if prior and prior['active']:
+            Position.objects.add_delta(state, prior, -1)
+        if version['active']:
+            Position.objects.add_delta(state, version)
+        previous[version['trade_reference_id']] = version
+    return versions[-1]['id'], versions[-1]['created_at']
+
+
+def state_as_of(as_of):
+
+    """
+    Reconstructing per-ticker totals at a point in time from the nearest
+    checkpoint & the versions created after it
+
+    Parameters:
+    as_of (datetime): Point in time
+
+    Returns:
+    dict: Lists of bought, sold & cost keyed by portfolio id & ticker id
+
+    Raises:
+    ValueError: When versions needed were archived
+    """
+    history_id, _ = PositionSnapshot.objects.checkpoint(as_of)
+    if history_id < HistoryArchive.objects.horizon():
+        raise ValueError('as_of precedes archived trade history')
+    state = PositionSnapshot.objects.state(history_id)
+    replay(state, history_id, as_of)
+    return state
+
+
+@instrumented('aggregation')
+def positions_as_of(as_of, portfolio_id=None):
+
+    """
+    Computing unsaved positions of every ticker of a portfolio (the current
+    portfolio by default) at a point in time
+
+    Returns:
+    list: List of tuples of ticker id, name, symbol & computed Position
+    """
+    if portfolio_id is None:
+        portfolio_id = current_portfolio()
+    state = state_as_of(as_of)
+    rows = []
+    for ticker_id, name, symbol in Ticker.objects.order_by('id') \
+            .values_list('id', 'name', 'symbol'):
+        bought, sold, cost = state.get((portfolio_id, ticker_id), (0, 0, 0))
+        position = Position(portfolio_id=portfolio_id, ticker_id=ticker_id,
+            bought_quantity=bought, sold_quantity=sold, total_buy_cost=cost)
+        position.compute()
+        rows.append((ticker_id, name, symbol, position))
+    return rows
+
+
+def holdings_as_of(as_of, portfolio_id=None):
+
+    """
+    Holdings at a point in time, avg_buy_price being always evaluated
+
+    Returns:
+    list: List of holdings having ticker details - id, name, symbol
+    avg_buy_price, final_quantity
+    """
+    return [{
+            'id': ticker_id,
+            'name': name,
+            'symbol': symbol,
+            'final_quantity': position.final_quantity,
+            'avg_buy_price': format_price(position.avg_buy_price)
+        } for ticker_id, name, symbol, position in
+        positions_as_of(as_of, portfolio_id)]
+
+
+def returns_as_of(as_of, portfolio_id=None):
+
+    """
+    Cumulative returns at a point in time, priced with the latest quote
+    at or before as_of, CURRENT_PRICE otherwise
+
+    Returns:
+    list: List of returns having ticker details - name, symbol,
+    cumulative_return
+    """
+    rows = positions_as_of(as_of, portfolio_id)
+    prices = Price.objects.latest([row[0] for row in rows], as_of)
+    return [{
+            'name': name,
+            'symbol': symbol,
+            'cumulative_return': cumulative_return(position.avg_buy_price,
+                position.final_quantity, CURRENT_PRICE
+                if prices.get(ticker_id) is None else prices[ticker_id])
+        } for ticker_id, name, symbol, position in rows]
+
+
+def take_snapshot(force=False, every=None, lag=None):
+
+    """
+    Checkpointing per-ticker totals of every portfolio database once enough
+    TradeHistory rows were written there since its latest checkpoint
+
+    Parameters:
+    force (bool): force True checkpoints whatever the number of new rows
+    every (int): TradeHistory rows between checkpoints, PORTFOLIO_
+        SNAPSHOT_EVERY setting by default
+    lag (int): Seconds rows must have aged, PORTFOLIO_SNAPSHOT_LAG setting
+        by default
+
+    Returns:
+    dict: history_id of the new checkpoints keyed by database alias,
+    databases not checkpointed being left out
+    """
+    checkpoints = {}
+    for alias in routed_databases():
+        history_id = snapshot_database(alias, force, every, lag)
+        if history_id is not None:
+            checkpoints[alias] = history_id
+    return checkpoints
+
+
+def snapshot_database(alias, force=False, every=None, lag=None):
+
+    """
+    Checkpointing per-ticker totals of a portfolio database, replaying the
+    TradeHistory rows written since its latest checkpoint only
+
+    Returns:
+    int: history_id of the new checkpoint or None when none was taken
+    """
+    if every is None:
+        every = getattr(settings, 'PORTFOLIO_SNAPSHOT_EVERY', SNAPSHOT_EVERY)
+    if lag is None:
+        lag = getattr(settings, 'PORTFOLIO_SNAPSHOT_LAG', SNAPSHOT_LAG)
+    until = timezone.now() - datetime.timedelta(seconds=lag)
+    snapshots = PositionSnapshot.objects.db_manager(alias)
+    with transaction.atomic(using=alias):
+        history_id, _ = snapshots.checkpoint()
+        pending = TradeHistory.objects.using(alias).filter(
+            pk__gt=history_id, created_at__lte=until).count()
+        if not pending or (pending < every and not force):
+            return None
+        state = snapshots.state(history_id)
+        history_id, taken_at = replay(state, history_id, until)
+        snapshots.bulk_create([PositionSnapshot(
+                history_id=history_id,
+                taken_at=taken_at,
+                portfolio_id=portfolio_id,
+                ticker_id=ticker_id,
+                bought_quantity=bought,
+                sold_quantity=sold,
+                total_buy_cost=cost
+            ) for (portfolio_id, ticker_id), (bought, sold, cost) in
+            state.items()],
+            batch_size=1000)
+    return history_id
+
+
+def prune_snapshots(retention_days=None):
+
+    """
+    Deleting checkpoints older than the retention from every portfolio
+    database, keeping the latest one & the one archived trade history
+    relies on
+
+    Parameters:
+    retention_days (int): PORTFOLIO_SNAPSHOT_RETENTION_DAYS setting by
+        default
+
+    Returns:
+    int: Number of snapshot rows deleted
+    """
+    if retention_days is None:
+        retention_days = getattr(settings,
+            'PORTFOLIO_SNAPSHOT_RETENTION_DAYS', SNAPSHOT_RETENTION_DAYS)
+    deleted = 0
+    for alias in routed_databases():
+        snapshots = PositionSnapshot.objects.db_manager(alias)
+        history_id, _ = snapshots.checkpoint()
+        deleted += snapshots.filter(taken_at__lt=timezone.now() -
+                datetime.timedelta(days=retention_days)) \
+            .exclude(history_id__in=(history_id,
+                HistoryArchive.objects.db_manager(alias).horizon())) \
+            .delete()[0]
+    return deleted
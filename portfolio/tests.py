@@ -1,3 +1,1227 @@
-from django.test import TestCase
+import io
+import json
+import random
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from fractions import Fraction
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Max, OuterRef, Q, Subquery, Sum
+from django.test import (AsyncClient, TestCase, TransactionTestCase,
+    override_settings)
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from portfolio.analytics import average_costs, report
+from portfolio.benchmarks import bench_suite, scaling_exponents
+from portfolio.imports import TradeImporter
+from portfolio.instrumentation import metrics
+from portfolio.jobs import work
+from portfolio.lots import AVERAGE, FIFO, LIFO, METHOD_CHOICES, Lots
+from portfolio.middleware import QueryBudgetExceeded, query_budget
+from portfolio.models import (Job, LotQueue, Portfolio, Position, Price,
+    Ticker, Trade, TradeHistory, VersionConflict)
+from portfolio.prices import PriceSource, Quote, ingest, latest_prices
+from portfolio.history import ArchiveReader, archive, purge_inactive
+from portfolio.routers import DEFAULT_PORTFOLIO, routed
+from portfolio.serializers import (FastHoldingSerializer,
+    FastReturnSerializer, FastTickerSerializer, FastTradeHistorySerializer,
+    FastTradeSerializer, HoldingSerializer, ReturnSerializer,
+    TickerSerializer, TradeHistorySerializer, TradeSerializer)
+from portfolio.snapshots import (holdings_as_of, prune_snapshots,
+    returns_as_of, take_snapshot)
+
+# Second portfolio database of ShardTests, a copy of default
+SHARD = 'shard'
+SHARDED_PORTFOLIO = 2
+settings.DATABASES.setdefault(SHARD, dict(settings.DATABASES['default'],
+    TEST={} if 'sqlite' in settings.DATABASES['default']['ENGINE'] else
+    {'NAME': 'test_{name}_{alias}'.format(alias=SHARD,
+        name=settings.DATABASES['default']['NAME'])}))
+
+
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    latest_prices.clear()
+
+
+class PortfolioTestCase(TestCase):
+
+    """
+    Base test case with a small book of tickers & trades, caches being
+    cleared before every test
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ticker = Ticker.objects.create(name='alpha', symbol='ALP')
+        cls.other_ticker = Ticker.objects.create(name='beta', symbol='BET')
+        Ticker.objects.create(name='gamma', symbol='GAM')
+        for ticker, category, quantity, price in (
+                (cls.ticker, Trade.CATEGORY_BOUGHT, 10, '10.00'),
+                (cls.ticker, Trade.CATEGORY_BOUGHT, 5, '12.00'),
+                (cls.ticker, Trade.CATEGORY_SOLD, 3, '15.00'),
+                (cls.other_ticker, Trade.CATEGORY_BOUGHT, 7, '8.00')):
+            Trade(ticker=ticker, category=category, quantity=quantity,
+                price=Decimal(price)).save()
+        cls.trade = Trade.objects.filter(ticker=cls.ticker).first()
+
+    def setUp(self):
+        clear_caches()
+
+
+class PositionTests(PortfolioTestCase):
+
+    """
+    Tests asserting materialized positions follow every trade write & match
+    a rebuild from trades
+    """
+
+    def positions(self):
+        return dict((ticker_id, (final_quantity, avg_buy_price))
+            for ticker_id, final_quantity, avg_buy_price in
+            Position.objects.values_list('ticker_id', 'final_quantity',
+                'avg_buy_price'))
+
+    def test_trade_writes(self):
+        self.assertEqual(self.positions()[self.ticker.id],
+            (12, Decimal('10.67')))
+        trade = Trade.objects.get(pk=self.trade.pk)
+        trade.ticker = self.other_ticker
+        trade.save()
+        positions = self.positions()
+        self.assertEqual(positions[self.ticker.id], (2, Decimal('12.00')))
+        self.assertEqual(positions[self.other_ticker.id],
+            (17, Decimal('9.18')))
+        trade.set_active(False)
+        self.assertEqual(self.positions()[self.other_ticker.id],
+            (7, Decimal('8.00')))
+        self.assertEqual(Position.objects.verify(), [])
+        Position.objects.rebuild()
+        self.assertEqual(self.positions(), positions | {
+            self.other_ticker.id: (7, Decimal('8.00'))})
+
+
+class DirtyReturnsTests(PortfolioTestCase):
+
+    """
+    Tests asserting only positions marked dirty by trade or price changes
+    have their returns recomputed
+    """
+
+    def dirty(self):
+        return set(Position.objects.filter(dirty=True)
+            .values_list('ticker_id', flat=True))
+
+    def cumulative_returns(self):
+        return dict((row['symbol'], row['cumulative_return'])
+            for row in Ticker.objects.returns())
+
+    def test_refresh_returns(self):
+        self.assertTrue(self.dirty())
+        Position.objects.refresh_returns()
+        self.assertEqual(self.dirty(), set())
+        self.assertEqual(Position.objects.refresh_returns(), 0)
+        Trade(ticker=self.other_ticker, category=Trade.CATEGORY_BOUGHT,
+            quantity=7, price=Decimal('8.00')).save()
+        self.assertEqual(self.dirty(), {self.other_ticker.id})
+        self.assertEqual(Position.objects.refresh_returns(), 1)
+        self.assertEqual(Position.objects.get(ticker=self.other_ticker)
+            .cumulative_return, Decimal('1288.00'))
+
+    def test_price_change(self):
+        self.assertEqual(self.cumulative_returns()['ALP'], '1071.96')
+        Price.objects.create(ticker=self.ticker, price=Decimal('20.00'),
+            quoted_at=timezone.now())
+        clear_caches()
+        self.assertEqual(self.cumulative_returns()['ALP'], '1071.96')
+        Position.objects.mark_dirty([self.ticker.id])
+        self.assertEqual(self.dirty(), {self.ticker.id})
+        self.assertEqual(self.cumulative_returns(), {'ALP': '111.96',
+            'BET': '644.00', 'GAM': '0.00'})
+        self.assertEqual(self.dirty(), set())
+
+
+class SellValidationTests(PortfolioTestCase):
+
+    """
+    Tests asserting sells are validated against the position balance, an
+    edit taking its previous version out first
+    """
+
+    def errors(self, instance=None, **data):
+        serializer = TradeSerializer(instance, data=dict({
+            'ticker_id': self.ticker.id, 'category': Trade.CATEGORY_SOLD,
+            'quantity': 1, 'price': '15.00'}, **data), partial=instance
+            is not None)
+        serializer.is_valid()
+        return serializer.errors
+
+    def test_sells(self):
+        self.assertEqual(self.errors(quantity=12), {})
+        self.assertIn('Available quantity to sell 12',
+            str(self.errors(quantity=13)))
+        self.assertIn('No quantity available to sell',
+            str(self.errors(ticker_id=Ticker.objects.get(symbol='GAM').id)))
+        sell = Trade.objects.get(ticker=self.ticker,
+            category=Trade.CATEGORY_SOLD)
+        self.assertEqual(self.errors(sell, quantity=15,
+            version=sell.version), {})
+        self.assertIn('Available quantity to sell 15',
+            str(self.errors(sell, quantity=16, version=sell.version)))
+
+
+class KeysetPaginationTests(PortfolioTestCase):
+
+    """
+    Tests asserting cursors walk pages forward & back without skipping rows
+    sharing created_at, invalid cursors being rejected
+    """
+
+    def test_ties(self):
+        Trade.objects.update(created_at=timezone.now())
+        ids = list(Trade.objects.order_by('id').values_list('id', flat=True))
+        url, pages = '/portfolio/trade/?format=json&page_size=3', []
+        while url:
+            body = self.client.get(url).json()
+            pages.append([row['id'] for row in body['results']])
+            url = body['next']
+        self.assertEqual(pages, [ids[:3], ids[3:]])
+        body = self.client.get(body['previous']).json()
+        self.assertEqual([row['id'] for row in body['results']], ids[:3])
+        self.assertIsNone(body['previous'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('abc', 'WzEsMl0='):
+            response = self.client.get(
+                '/portfolio/trade/?format=json&cursor=' + cursor)
+            self.assertEqual(response.status_code, 404)
+
+    def test_invalid_filter(self):
+        for url in ('/portfolio/trade/?ticker=abc',
+                '/portfolio/trade-history/?trade=x'):
+            self.assertEqual(self.client.get(url).status_code, 400)
+        response = self.client.get('/portfolio/trade/?format=json&ticker='
+            + str(self.other_ticker.id))
+        self.assertEqual([row['id'] for row in response.json()['results']],
+            list(Trade.objects.filter(ticker=self.other_ticker).values_list(
+                'id', flat=True)))
+
+
+class ExportTests(PortfolioTestCase):
+
+    """
+    Tests asserting exports stream every row as CSV or JSONL, filtered like
+    their list
+    """
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_trades(self):
+        lines = self.export('/portfolio/trade/export/').splitlines()
+        self.assertEqual(lines[0], 'id,ticker_id,ticker_symbol,category,'
+            'quantity,price,created_at')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[1].split(',')[:6], [str(self.trade.id),
+            str(self.ticker.id), 'ALP', str(Trade.CATEGORY_BOUGHT), '10',
+            '10.00'])
+        rows = [json.loads(line) for line in self.export(
+            '/portfolio/trade/export/?export_format=jsonl&ticker={pk}'
+            .format(pk=self.other_ticker.id)).splitlines()]
+        self.assertEqual([(row['ticker_symbol'], row['quantity'],
+            row['price']) for row in rows], [('BET', 7, '8.00')])
+
+    def test_holdings_and_returns(self):
+        holdings = dict((row['symbol'], row) for row in map(json.loads,
+            self.export('/portfolio/holding/export/?export_format=jsonl')
+            .splitlines()))
+        self.assertEqual((holdings['ALP']['final_quantity'],
+            holdings['ALP']['avg_buy_price']), (12, '10.67'))
+        self.assertEqual(holdings['GAM']['final_quantity'], 0)
+        lines = self.export('/portfolio/return/export/').splitlines()
+        self.assertEqual(lines[0], 'id,name,symbol,cumulative_return')
+        self.assertEqual(len(lines), 4)
+
+
+class AsOfTests(PortfolioTestCase):
+
+    """
+    Tests asserting as_of replays give the same positions with or without
+    checkpoints & ignore versions & prices after as_of
+    """
+
+    def holdings(self, as_of):
+        return dict((row['symbol'], (row['final_quantity'],
+            row['avg_buy_price'])) for row in holdings_as_of(as_of))
+
+    def test_replay(self):
+        before = timezone.now()
+        past = self.holdings(before)
+        self.assertEqual(past['ALP'], (12, '10.67'))
+        self.assertTrue(take_snapshot(force=True, lag=0))
+        self.assertEqual(take_snapshot(force=True, lag=0), {})
+        self.assertEqual(self.holdings(before), past)
+        trade = Trade.objects.get(pk=self.trade.pk)
+        trade.quantity = 20
+        trade.save()
+        Price.objects.create(ticker=self.ticker, price=Decimal('20.00'),
+            quoted_at=timezone.now())
+        now = timezone.now()
+        current = self.holdings(now)
+        self.assertEqual(current['ALP'], (22, '10.40'))
+        self.assertTrue(take_snapshot(force=True, lag=0))
+        self.assertEqual(self.holdings(now), current)
+        self.assertEqual(self.holdings(before), past)
+        self.assertEqual(self.holdings(self.trade.created_at -
+            timedelta(seconds=1))['ALP'], (0, '0.00'))
+        self.assertEqual([row['cumulative_return'] for row in
+            returns_as_of(before) if row['symbol'] == 'ALP'], ['1071.96'])
+        self.assertEqual([row['cumulative_return'] for row in
+            returns_as_of(now) if row['symbol'] == 'ALP'], ['211.20'])
+
+
+class BenchmarkSuiteTests(PortfolioTestCase):
+
+    """
+    Tests asserting the benchmark suite flags scenarios scaling above the
+    superlinear exponent, failing when strict
+    """
+
+    def test_scaling_exponents(self):
+        exponents = scaling_exponents([
+            {'scenario': 'list', 'trades': 100, 'seconds': 0.5},
+            {'scenario': 'list', 'trades': 200, 'seconds': 1.0},
+            {'scenario': 'quadratic', 'trades': 100, 'seconds': 0.5},
+            {'scenario': 'quadratic', 'trades': 200, 'seconds': 2.0},
+            {'scenario': 'untimed', 'trades': 100, 'seconds': 0.0},
+            {'scenario': 'untimed', 'trades': 200, 'seconds': 1.0}])
+        self.assertEqual([(exponent['scenario'], exponent['exponent'])
+            for exponent in exponents], [('list', 1.0), ('quadratic', 2.0)])
+
+    def test_superlinear(self):
+        suite = bench_suite([10, 20], tickers=2, repeat=1,
+            superlinear=float('inf'))
+        self.assertEqual(len(suite['exponents']),
+            len(set(result['scenario'] for result in suite['results'])))
+        self.assertEqual(suite['superlinear'], [])
+        call_command('benchmark_suite', sizes=[10, 20], tickers=2, repeat=1,
+            superlinear=float('inf'), strict=True, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('benchmark_suite', sizes=[10, 20], tickers=2,
+                repeat=1, superlinear=float('-inf'), strict=True,
+                stdout=io.StringIO())
+        self.assertFalse(Ticker.objects.filter(
+            symbol__startswith='BENCH').exists())
+
+    def test_only(self):
+        stdout = io.StringIO()
+        call_command('benchmark_suite', only='lots', sizes=[10], tickers=2,
+            repeat=1, stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()),
+            len(METHOD_CHOICES))
+        with self.assertRaises(CommandError):
+            call_command('benchmark_suite', only='lots', sizes=[10],
+                strict=True, stdout=io.StringIO())
+
+
+class QueryPlanTests(PortfolioTestCase):
+
+    """
+    Tests asserting hot queries are served by indexes, failing on
+    sequential scans of the EXPLAIN output
+    """
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables are otherwise always scanned sequentially
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset, allowed=()):
+        plan = self.explain(queryset)
+        for line in plan:
+            match = re.search(r'Seq Scan on (\w+)', line) or \
+                re.match(r'SCAN (?:TABLE )?(\w+)$', line.strip())
+            if match and match.group(1) not in allowed:
+                self.fail('Sequential scan of {table}:\n{plan}'.format(
+                    table=match.group(1), plan='\n'.join(plan)))
+
+    def test_trade_list_page(self):
+        now = timezone.now()
+        trades = Trade.objects.filter(portfolio_id=DEFAULT_PORTFOLIO)
+        self.assertIndexed(trades.order_by('created_at', 'id')[:51])
+        self.assertIndexed(trades.filter(Q(created_at__gt=now) |
+            Q(created_at=now, pk__gt=1)).order_by('created_at', 'id')[:51])
+
+    def test_trade_list_by_ticker(self):
+        self.assertIndexed(Trade.objects.filter(portfolio_id=DEFAULT_PORTFOLIO,
+            ticker_id=self.ticker.id).order_by('created_at', 'id')[:51])
+
+    def test_trade_history_by_trade(self):
+        self.assertIndexed(TradeHistory.objects \
+            .filter(trade_reference_id=self.trade.id) \
+            .order_by('-created_at', '-id')[:51])
+
+    def test_latest_trade_versions(self):
+        self.assertIndexed(TradeHistory.objects.order_by() \
+            .values('trade_reference').annotate(last=Max('pk')) \
+            .values('last'))
+
+    def test_sell_validation_balance(self):
+        self.assertIndexed(Position.objects.filter(
+            portfolio_id=DEFAULT_PORTFOLIO, ticker_id=self.ticker.id) \
+            .values_list('final_quantity', flat=True))
+
+    def test_dirty_positions(self):
+        self.assertIndexed(Position.objects.filter(dirty=True))
+
+    def test_avg_buy_price_formulas(self):
+        self.assertIndexed(Trade.objects \
+            .filter(portfolio_id=DEFAULT_PORTFOLIO,
+                category=Trade.CATEGORY_BOUGHT) \
+            .order_by('ticker_id', 'price').values('ticker_id', 'price') \
+            .annotate(quantity=Sum('quantity')))
+
+    def test_holdings(self):
+        self.assertIndexed(Ticker.objects.holding_rows(),
+            allowed=('portfolio_ticker',))
+
+    def test_latest_prices(self):
+        latest = Price.objects.filter(ticker=OuterRef('pk')) \
+            .order_by('-quoted_at', '-id').values('price')[:1]
+        self.assertIndexed(Ticker.objects.filter(id__in=[self.ticker.id]) \
+            .order_by().annotate(latest_price=Subquery(latest)))
+
+
+class QueryCountTests(PortfolioTestCase):
+
+    """
+    Tests asserting the number of queries of every endpoint
+    """
+
+    def assertQueries(self, budgets):
+        for url, budget in budgets:
+            with self.subTest(url=url):
+                clear_caches()
+                Position.objects.update(dirty=True)
+                with self.assertNumQueries(budget):
+                    response = self.client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, 200)
+
+    def test_ticker_endpoints(self):
+        self.assertQueries((
+            ('/portfolio/ticker/', 1),
+            ('/portfolio/ticker/{pk}/'.format(pk=self.ticker.id), 1),
+            ('/portfolio/ticker/add_new/', 0),
+        ))
+
+    def test_trade_endpoints(self):
+        self.assertQueries((
+            ('/portfolio/trade/', 1),
+            ('/portfolio/trade/?ticker={pk}'.format(pk=self.ticker.id), 1),
+            ('/portfolio/trade/{pk}/'.format(pk=self.trade.id), 2),
+            ('/portfolio/trade/add_new/', 1),
+            ('/portfolio/trade/export/', 1),
+        ))
+
+    def test_trade_history_endpoints(self):
+        self.assertQueries((
+            ('/portfolio/trade-history/', 1),
+            ('/portfolio/trade-history/?trade={pk}'.format(
+                pk=self.trade.id), 1),
+            ('/portfolio/trade-history/export/', 1),
+        ))
+
+    def test_holding_endpoints(self):
+        self.assertQueries((
+            ('/portfolio/holding/', 1),
+            ('/portfolio/holding/?evaluated=0', 2),
+            ('/portfolio/holding/export/', 1),
+        ))
+
+    def test_return_endpoints(self):
+        self.assertQueries((
+            ('/portfolio/return/', 7),
+            ('/portfolio/return/export/', 6),
+        ))
+
+    def test_cached_holdings(self):
+        self.client.get('/portfolio/holding/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/portfolio/holding/',
+                HTTP_IF_NONE_MATCH=self.client.get(
+                    '/portfolio/holding/')['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/portfolio/holding/?evaluated=abc')
+            .status_code, 400)
+
+
+@override_settings(PORTFOLIO_QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(PortfolioTestCase):
+
+    """
+    Tests asserting endpoints stay within their query budget as the number
+    of tickers & trades grows
+    """
+
+    def test_budgets_independent_of_rows(self):
+        for index in range(20):
+            ticker = Ticker.objects.create(name='ticker {index}'.format(
+                index=index), symbol='T{index}'.format(index=index))
+            for quantity in (5, 3):
+                Trade(ticker=ticker, category=Trade.CATEGORY_BOUGHT,
+                    quantity=quantity, price=Decimal('10.00')).save()
+        for url in ('/portfolio/ticker/', '/portfolio/trade/',
+                '/portfolio/trade/{pk}/'.format(pk=self.trade.id),
+                '/portfolio/trade/add_new/', '/portfolio/trade-history/',
+                '/portfolio/holding/?evaluated=0', '/portfolio/return/'):
+            with self.subTest(url=url):
+                clear_caches()
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(int(response['X-Query-Count']), 7)
+
+    def test_budget_exceeded(self):
+        @query_budget(0)
+        def view(viewset, request):
+            return list(Ticker.objects.all())
+        with self.assertRaises(QueryBudgetExceeded):
+            view(self, None)
+
+    def test_ticker_trade_count(self):
+        response = self.client.get('/portfolio/ticker/?format=json')
+        counts = dict((row['id'], row['number_of_trades'])
+            for row in response.json()['results'])
+        self.assertEqual(counts[self.ticker.id], 3)
+        self.assertEqual(counts[self.other_ticker.id], 1)
+
+
+class HoldingTests(PortfolioTestCase):
+
+    """
+    Tests asserting evaluated & un-evaluated holdings are keyed by ticker id
+    """
+
+    def test_holdings(self):
+        evaluated, formulas = (dict((row['id'], row)
+                for row in Ticker.objects.holdings(evaluated=evaluated))
+            for evaluated in (True, False))
+        self.assertEqual(set(evaluated), set(formulas))
+        self.assertEqual(evaluated[self.ticker.id]['name'], 'alpha')
+        self.assertEqual(formulas[self.ticker.id]['name'], 'alpha')
+        self.assertEqual(evaluated[self.ticker.id]['avg_buy_price'], '10.67')
+        self.assertEqual(formulas[self.ticker.id]['avg_buy_price'],
+            '(10.00*10 + 12.00*5)/(10 + 5)')
+        self.assertEqual(formulas[self.ticker.id]['final_quantity'], 12)
+
+
+class SoftDeleteTests(PortfolioTestCase):
+
+    """
+    Tests asserting soft deleted rows leave default managers & positions
+    & come back on restore
+    """
+
+    def holding(self):
+        return dict((row['id'], row['final_quantity'])
+            for row in Ticker.objects.holdings())
+
+    def test_trade_delete_and_restore(self):
+        self.assertEqual(self.holding()[self.ticker.id], 12)
+        url = '/portfolio/trade/{pk}/{{action}}/'.format(pk=self.trade.id)
+        self.assertEqual(self.client.post(
+            url.format(action='delete_record')).status_code, 200)
+        self.assertFalse(Trade.objects.filter(pk=self.trade.id).exists())
+        self.assertEqual(self.holding()[self.ticker.id], 2)
+        self.assertEqual(Position.objects.verify(), [])
+        self.assertEqual(self.client.post(
+            url.format(action='restore_record')).status_code, 200)
+        self.assertEqual(self.holding()[self.ticker.id], 12)
+        self.assertEqual(Position.objects.verify(), [])
+
+    def test_delete_leaving_negative_quantity(self):
+        bought = Trade.objects.filter(ticker=self.ticker,
+            quantity=5).first()
+        self.client.post('/portfolio/trade/{pk}/delete_record/'.format(
+            pk=self.trade.id))
+        response = self.client.post(
+            '/portfolio/trade/{pk}/delete_record/'.format(pk=bought.id))
+        self.assertEqual(response.status_code, 400)
+
+    def test_ticker_delete(self):
+        self.client.post('/portfolio/ticker/{pk}/delete_record/'.format(
+            pk=self.other_ticker.id))
+        self.assertNotIn(self.other_ticker.id, self.holding())
+        self.assertTrue(Ticker.all_objects.filter(
+            pk=self.other_ticker.id).exists())
+
+
+class ImportTests(PortfolioTestCase):
+
+    """
+    Tests asserting imports write valid rows only, report invalid ones &
+    keep lot queues in line with positions
+    """
+
+    def test_import_rows(self):
+        trades = Trade.objects.count()
+        result = TradeImporter(chunk_size=1).run([
+            {'ticker_id': self.ticker.id, 'category': 1, 'quantity': 4,
+                'price': '9.00'},
+            {'ticker_symbol': 'NOPE', 'category': 1, 'quantity': 1,
+                'price': '1.00'},
+            {'ticker_id': self.other_ticker.id, 'category': 2,
+                'quantity': 70, 'price': '9.00'},
+            {'ticker_id': self.ticker.id, 'category': 2, 'quantity': 'x',
+                'price': '9.00'},
+            {'ticker_id': self.ticker.id, 'category': 2, 'quantity': 6,
+                'price': '9.00'}])
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual([error['row'] for error in result['errors']],
+            [2, 3, 4])
+        self.assertEqual(Trade.objects.count(), trades + 2)
+        self.assertEqual(Position.objects.verify(), [])
+        self.assertEqual(LotQueue.objects.get(ticker=self.ticker,
+                method=FIFO).open_quantity,
+            Position.objects.get(ticker=self.ticker).final_quantity)
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            TradeImporter(chunk_size=0)
+        response = self.client.post('/portfolio/trade/bulk/?chunk_size=-1',
+            json.dumps([{'ticker_id': self.ticker.id, 'category': 1,
+                'quantity': 1, 'price': '1.00'}]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AnalyticsTests(PortfolioTestCase):
+
+    """
+    Tests asserting analytics agree with positions & AVERAGE lot queues,
+    later buys leaving realized P&L untouched
+    """
+
+    def figures(self):
+        return dict((row['id'], row) for row in report()['tickers'])
+
+    def test_report_matches_lot_queues(self):
+        realized = self.figures()[self.ticker.id]['realized']
+        Trade(ticker=self.ticker, category=Trade.CATEGORY_BOUGHT,
+            quantity=4, price=Decimal('20.00')).save()
+        figures = self.figures()
+        self.assertEqual(figures[self.ticker.id]['realized'], realized)
+        for ticker_id, row in figures.items():
+            queue = LotQueue.objects.get(ticker_id=ticker_id,
+                method=AVERAGE)
+            self.assertEqual(row['final_quantity'], Position.objects.get(
+                ticker_id=ticker_id).final_quantity)
+            self.assertEqual(Decimal(str(row['realized'])), queue.realized)
+            self.assertEqual(Decimal(str(row['unrealized'])),
+                queue.open_quantity * 100 - queue.open_cost)
+
+    def test_average_costs(self):
+        # Exact AVERAGE matching of a long run never closing a position
+        generator = random.Random(0)
+        rows = []
+        books = {}
+        expected = []
+        for _ in range(5000):
+            ticker_id = generator.randint(1, 3)
+            held, cost = books.get(ticker_id, (0, Fraction(0)))
+            quantity = generator.randint(1, 100)
+            price = Fraction(generator.randint(100, 50000), 100)
+            if held > quantity and generator.random() < 0.45:
+                category = Trade.CATEGORY_SOLD
+                sold = cost * quantity / held
+                realized = quantity * price - sold
+                held, cost = held - quantity, cost - sold
+            else:
+                category = Trade.CATEGORY_BOUGHT
+                realized = 0
+                held, cost = held + quantity, cost + quantity * price
+            books[ticker_id] = held, cost
+            rows.append((ticker_id, category, quantity, float(price)))
+            expected.append((float(realized), float(cost)))
+        columns = list(zip(*rows))
+        realized, open_cost = average_costs({
+            'ticker_id': np.array(columns[0]),
+            'category': np.array(columns[1]),
+            'quantity': np.array(columns[2], dtype=float),
+            'price': np.array(columns[3])})
+        self.assertTrue(np.allclose(np.column_stack((realized, open_cost)),
+            expected, rtol=0, atol=1e-4))
+
+    def test_window_bounds(self):
+        self.assertEqual(self.client.get('/portfolio/analytics/',
+            {'start': '1900-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get('/portfolio/analytics/',
+            {'start': '2030-01-02', 'end': '2030-01-01'}).status_code, 400)
+
+
+class LotMatchingTests(PortfolioTestCase):
+
+    """
+    Tests asserting lot matching math of every method & edits replaying
+    lot queues from their checkpoint like a full rebuild
+    """
+
+    def test_methods(self):
+        # Buys of 10 at 1.00 & 5 at 1.20, then a sell of 12 at 1.50
+        for method, cost, lots in ((FIFO, 1240, [3]), (LIFO, 1300, [3]),
+                (AVERAGE, 1280, [])):
+            book = Lots(method)
+            book.apply(1, 10, 100)
+            book.apply(1, 5, 120)
+            self.assertEqual(book.apply(2, 12, 150), 1800 - cost)
+            self.assertEqual((book.open_quantity, book.open_cost),
+                (3, 1600 - cost))
+            self.assertEqual(list(book.quantities[book.head:]), lots)
+            packed = Lots.unpack(method, book.pack())
+            self.assertEqual((packed.open_quantity, packed.open_cost,
+                    packed.realized, packed.to_bytes()),
+                (book.open_quantity, book.open_cost, book.realized,
+                    book.to_bytes()))
+
+    def queues(self):
+        return sorted(LotQueue.objects.filter(ticker=self.ticker) \
+            .values_list('method', 'lots', 'open_quantity', 'open_cost',
+                'realized'))
+
+    @override_settings(PORTFOLIO_LOT_CHECKPOINT_TAIL=1)
+    def test_edit_replays_from_checkpoint(self):
+        LotQueue.objects.rebuild()
+        self.assertTrue(LotQueue.objects.filter(ticker=self.ticker,
+            checkpoint_at__isnull=False).exists())
+        sold = Trade.objects.get(ticker=self.ticker,
+            category=Trade.CATEGORY_SOLD)
+        sold.quantity = 4
+        sold.save()
+        replayed = self.queues()
+        LotQueue.objects.rebuild()
+        self.assertEqual(replayed, self.queues())
+        self.trade.quantity = 9
+        self.trade.save()
+        replayed = self.queues()
+        LotQueue.objects.rebuild()
+        self.assertEqual(replayed, self.queues())
+
+
+class PriceIngestTests(PortfolioTestCase):
+
+    """
+    Tests asserting ingestion updates latest prices of tickers having newer
+    quotes only & marks their positions for returns recomputation
+    """
+
+    class Source(PriceSource):
+
+        def __init__(self, quotes):
+            self.rows = quotes
+
+        def quotes(self):
+            return iter(self.rows)
+
+    def ingest(self, *quotes):
+        return ingest(self.Source([Quote(symbol, Decimal(price), quoted_at)
+            for symbol, price, quoted_at in quotes]), batch_size=2)
+
+    def test_ingest(self):
+        now = timezone.now()
+        Position.objects.refresh_returns()
+        summary = self.ingest(('ALP', '20.00', now),
+            ('BET', '9.00', now), ('XXX', '1.00', now))
+        self.assertEqual(summary, {'quotes': 2, 'unknown': {'XXX'},
+            'changed': {self.ticker.id, self.other_ticker.id}})
+        self.assertEqual(set(Position.objects.filter(dirty=True)
+            .values_list('ticker_id', flat=True)),
+            {self.ticker.id, self.other_ticker.id})
+        self.assertEqual(Position.objects.refresh_returns(), 2)
+        position = Position.objects.get(ticker=self.ticker)
+        self.assertEqual(position.current_price, Decimal('20.00'))
+        self.assertFalse(position.dirty)
+        summary = self.ingest(('ALP', '20.00', now + timedelta(days=1)),
+            ('BET', '10.00', now + timedelta(days=1)))
+        self.assertEqual(summary['changed'], {self.other_ticker.id})
+        self.assertEqual(list(Position.objects.filter(dirty=True)
+            .values_list('ticker_id', flat=True)), [self.other_ticker.id])
+
+    def test_older_batch_keeps_latest_price(self):
+        now = timezone.now()
+        self.ingest(('ALP', '20.00', now))
+        summary = self.ingest(('ALP', '18.00', now - timedelta(days=1)))
+        self.assertEqual(summary['quotes'], 1)
+        self.assertEqual(summary['changed'], set())
+        clear_caches()
+        self.assertEqual(latest_prices.get_many([self.ticker.id]),
+            {self.ticker.id: Decimal('20.00')})
+
+
+class PortfolioScopeTests(PortfolioTestCase):
+
+    """
+    Tests asserting trades & positions of a portfolio stay out of others,
+    portfolios of other users being out of reach
+    """
+
+    def test_positions_per_portfolio(self):
+        portfolio = Portfolio.objects.create(name='second')
+        with routed(portfolio.id):
+            Trade(ticker=self.ticker, category=Trade.CATEGORY_BOUGHT,
+                quantity=4, price=Decimal('20.00')).save()
+            holdings = dict((row['id'], row['final_quantity'])
+                for row in Ticker.objects.holdings())
+        self.assertEqual(holdings[self.ticker.id], 4)
+        self.assertEqual(holdings[self.other_ticker.id], 0)
+        default = dict((row['id'], row['final_quantity'])
+            for row in Ticker.objects.holdings())
+        self.assertEqual(default[self.ticker.id], 12)
+        self.assertEqual(Position.objects.verify(), [])
+        response = self.client.get('/portfolio/trade/?portfolio=abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_access(self):
+        users = get_user_model().objects
+        owner = users.create(username='owner')
+        portfolio = Portfolio.objects.create(name='owned', owner=owner)
+        shared = Portfolio.objects.create(name='shared')
+        url = '/portfolio/trade/?format=json&portfolio={pk}'
+        self.assertEqual(self.client.get(url.format(pk=99)).status_code, 404)
+        self.assertEqual(self.client.get(url.format(pk=shared.id))
+            .status_code, 200)
+        for user, status_code in ((None, 403),
+                (users.create(username='other'), 403), (owner, 200),
+                (users.create(username='admin', is_staff=True), 200)):
+            if user is not None:
+                self.client.force_login(user)
+            self.assertEqual(self.client.get(url.format(pk=portfolio.id))
+                .status_code, status_code)
+
+
+@override_settings(PORTFOLIO_SNAPSHOT_LAG=0)
+class HistoryArchiveTests(PortfolioTestCase):
+
+    """
+    Tests asserting superseded & purged trade versions move into block
+    archives which are read back newest first
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(PORTFOLIO_HISTORY_ARCHIVE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_archive(self):
+        trade = Trade.objects.get(pk=self.trade.pk)
+        for quantity in (11, 12, 13):
+            trade.quantity = quantity
+            trade.save()
+        archives = archive(days=0, block_size=2)
+        self.assertEqual([(history_archive.rows, len(history_archive.blocks))
+            for history_archive in archives], [(3, 2)])
+        self.assertEqual(archives[0].trades, {str(trade.id): [0, 1]})
+        self.assertEqual(TradeHistory.objects.filter(
+            trade_reference=trade).count(), 1)
+        reader = ArchiveReader()
+        versions, has_next = reader.page(trade.id, page_size=2)
+        self.assertEqual([version['quantity'] for version in versions],
+            [12, 11])
+        self.assertTrue(has_next)
+        versions, has_next = reader.page(trade.id, versions[-1]['id'])
+        self.assertEqual([version['quantity'] for version in versions], [10])
+        self.assertFalse(has_next)
+        self.assertEqual(reader.page(self.other_ticker.id), ([], False))
+
+    def test_page_opens_overlapping_archives(self):
+        trade = Trade.objects.get(pk=self.trade.pk)
+        for quantity in (11, 12, 13, 14, 15, 16):
+            trade.quantity = quantity
+            trade.save()
+            if quantity in (13, 16):
+                archive(days=0)
+        # The archive list & the newest archive's blocks, older ones staying
+        # closed as the page fills first
+        with self.assertNumQueries(2):
+            versions, has_next = ArchiveReader().page(page_size=2)
+        self.assertEqual([version['quantity'] for version in versions],
+            [15, 14])
+        self.assertTrue(has_next)
+        versions, has_next = ArchiveReader().page(
+            before_id=versions[-1]['id'])
+        self.assertEqual([version['quantity'] for version in versions],
+            [13, 12, 11, 10])
+        self.assertFalse(has_next)
+
+    def test_purge(self):
+        trade = Trade.objects.get(ticker=self.other_ticker)
+        trade.set_active(False)
+        self.assertEqual(purge_inactive(days=0), (1, 0))
+        self.assertFalse(Trade.all_objects.filter(pk=trade.pk).exists())
+        self.assertFalse(TradeHistory.objects.filter(
+            trade_reference_id=trade.pk).exists())
+        versions, has_next = ArchiveReader().page(trade.id)
+        self.assertEqual([version['active'] for version in versions],
+            [False, True])
+
+
+@override_settings(PORTFOLIO_SHARDS={SHARDED_PORTFOLIO: SHARD},
+    PORTFOLIO_SNAPSHOT_LAG=0)
+class ShardTests(PortfolioTestCase):
+
+    """
+    Tests asserting a portfolio placed on a second database is priced from
+    the default one, has its own history archived & is maintained with the
+    default one
+    """
+    databases = {'default', SHARD}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Portfolio.objects.create(id=SHARDED_PORTFOLIO, name='sharded')
+
+    def test_prices(self):
+        now = timezone.now()
+        Price.objects.create(ticker=self.ticker, price=Decimal('20.00'),
+            quoted_at=now - timedelta(days=1))
+        with routed(SHARDED_PORTFOLIO) as alias:
+            self.assertEqual(alias, SHARD)
+            Trade(ticker=self.ticker, category=Trade.CATEGORY_BOUGHT,
+                quantity=4, price=Decimal('10.00')).save()
+            self.assertEqual(Trade.objects.count(), 1)
+            self.assertEqual(latest_prices.get_many([self.ticker.id]),
+                {self.ticker.id: Decimal('20.00')})
+            returns = returns_as_of(timezone.now(), SHARDED_PORTFOLIO)
+        self.assertEqual([row['cumulative_return'] for row in returns
+            if row['symbol'] == 'ALP'], ['40.00'])
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(PORTFOLIO_HISTORY_ARCHIVE_DIR=directory):
+            with routed(SHARDED_PORTFOLIO):
+                trade = Trade(ticker=self.ticker,
+                    category=Trade.CATEGORY_BOUGHT, quantity=4,
+                    price=Decimal('10.00'))
+                trade.save()
+                for quantity in (5, 6):
+                    trade.quantity = quantity
+                    trade.save()
+            archives = archive(days=0)
+            self.assertEqual([history_archive._state.db
+                for history_archive in archives], [SHARD])
+            self.assertTrue(archives[0].path.startswith(
+                'trade_history_shard_'))
+            with routed(SHARDED_PORTFOLIO):
+                self.assertEqual(TradeHistory.objects.count(), 1)
+                versions, has_next = ArchiveReader().page(trade.id)
+            self.assertEqual([version['quantity'] for version in versions],
+                [5, 4])
+            self.assertEqual(TradeHistory.objects.filter(
+                trade_reference=self.trade).count(), 1)
+
+    def test_maintenance(self):
+        with routed(SHARDED_PORTFOLIO):
+            trade = Trade(ticker=self.ticker, category=Trade.CATEGORY_BOUGHT,
+                quantity=4, price=Decimal('10.00'))
+            trade.save()
+            Trade(ticker=self.other_ticker, category=Trade.CATEGORY_BOUGHT,
+                quantity=2, price=Decimal('8.00')).save()
+        Position.objects.using(SHARD).update(bought_quantity=0)
+        LotQueue.objects.using(SHARD).all().delete()
+        self.assertEqual(len(Position.objects.verify()), 4)
+        self.assertEqual(Position.objects.rebuild(), 4)
+        self.assertEqual(Position.objects.verify(), [])
+        LotQueue.objects.rebuild()
+        self.assertEqual(LotQueue.objects.using(SHARD).count(),
+            2 * len(METHOD_CHOICES))
+        self.assertEqual(set(take_snapshot(force=True)), {'default', SHARD})
+        with routed(SHARDED_PORTFOLIO):
+            trade.set_active(False)
+        self.assertEqual(set(take_snapshot(force=True)), {SHARD})
+        self.assertEqual(prune_snapshots(retention_days=0), 2)
+        unused = Ticker.objects.create(name='delta', symbol='DLT')
+        unused.set_active(False)
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(PORTFOLIO_HISTORY_ARCHIVE_DIR=directory):
+            self.assertEqual(purge_inactive(days=0), (1, 1))
+        self.assertFalse(Trade.all_objects.using(SHARD).filter(
+            pk=trade.pk).exists())
+        for alias in ('default', SHARD):
+            self.assertFalse(Ticker.all_objects.using(alias).filter(
+                pk=unused.pk).exists())
+
+
+class AsyncApiTests(TransactionTestCase):
+
+    """
+    Tests asserting the async API serves pages through the async middleware
+    chain & answers invalid parameters with 400. Rows are committed, db_call
+    reading them from worker threads having their own connections
+    """
+    serialized_rollback = True
+
+    def setUp(self):
+        clear_caches()
+        self.ticker = Ticker.objects.create(name='alpha', symbol='ALP')
+        other_ticker = Ticker.objects.create(name='beta', symbol='BET')
+        for ticker, quantity in ((self.ticker, 10), (self.ticker, 5),
+                (other_ticker, 7)):
+            Trade(ticker=ticker, category=Trade.CATEGORY_BOUGHT,
+                quantity=quantity, price=Decimal('10.00')).save()
+        self.trade = Trade.objects.filter(ticker=self.ticker).first()
+        self.async_client = AsyncClient()
+
+    async def get(self, path):
+        response = await self.async_client.get(path)
+        return response.status_code, json.loads(response.content)
+
+    async def test_pages(self):
+        code, body = await self.get('/portfolio/api/trades/?ticker={pk}'
+            '&page_size=1'.format(pk=self.ticker.id))
+        self.assertEqual(code, 200)
+        self.assertEqual(len(body['results']), 1)
+        self.assertIsNotNone(body['next'])
+        code, body = await self.get('/portfolio/api/trade-history/'
+            '?trade={pk}'.format(pk=self.trade.id))
+        self.assertEqual([row['quantity'] for row in body['results']], [10])
+        code, body = await self.get('/portfolio/api/dashboard/')
+        self.assertEqual(code, 200)
+        self.assertEqual(dict((row['symbol'], row['final_quantity'])
+            for row in body['holdings']), {'ALP': 15, 'BET': 7})
+        self.assertEqual(len(body['returns']), 2)
+
+    async def test_invalid_parameters(self):
+        for path in ('/portfolio/api/holdings/?evaluated=yes',
+                '/portfolio/api/trades/?ticker=abc',
+                '/portfolio/api/trade-history/?trade=abc',
+                '/portfolio/api/returns/?as_of=yesterday',
+                '/portfolio/api/tickers/?portfolio=abc'):
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 400, path)
+        response = await self.async_client.get(
+            '/portfolio/api/tickers/?portfolio=99')
+        self.assertEqual(response.status_code, 404)
+
+
+class InstrumentationTests(PortfolioTestCase):
+
+    """
+    Tests asserting requests & their phases reach the staff-only metrics
+    """
+
+    def test_metrics(self):
+        metrics.clear()
+        self.client.get('/portfolio/trade/?format=json')
+        self.assertEqual(self.client.get('/portfolio/metrics/').status_code,
+            403)
+        self.client.force_login(get_user_model().objects.create(
+            username='admin', is_staff=True))
+        body = self.client.get('/portfolio/metrics/').content.decode()
+        self.assertIn('portfolio_request_seconds_count{endpoint="trade-list"}'
+            ' 1', body)
+        self.assertIn('portfolio_request_queries_total{endpoint="trade-list"}'
+            ' 1', body)
+        self.assertIn('endpoint="trade-list",phase="serialization"', body)
+
+
+class FastSerializerTests(PortfolioTestCase):
+
+    """
+    Tests asserting fast list serializers render byte for byte like the
+    serializers they replace
+    """
+
+    def assertSameJSON(self, expected, fast):
+        self.assertEqual(JSONRenderer().render(fast.data),
+            JSONRenderer().render(expected.data))
+
+    def test_trades(self):
+        trades = Trade.objects.order_by('id')
+        self.assertSameJSON(TradeSerializer(trades.select_related('ticker'),
+                many=True),
+            FastTradeSerializer(trades.values(*FastTradeSerializer.lookups)))
+        versions = TradeHistory.objects.order_by('id')
+        self.assertSameJSON(TradeHistorySerializer(versions, many=True),
+            FastTradeHistorySerializer(versions.values(
+                *FastTradeHistorySerializer.lookups)))
+
+    def test_tickers(self):
+        tickers = Ticker.objects.with_trade_count().order_by('id')
+        self.assertSameJSON(TickerSerializer(tickers, many=True),
+            FastTickerSerializer(tickers.values(
+                *FastTickerSerializer.lookups)))
+
+    def test_holdings_and_returns(self):
+        for evaluated in (True, False):
+            holdings = Ticker.objects.holdings(evaluated=evaluated)
+            self.assertSameJSON(HoldingSerializer(holdings, many=True),
+                FastHoldingSerializer(holdings))
+        for returns in (Ticker.objects.returns(),
+                returns_as_of(timezone.now())):
+            self.assertSameJSON(ReturnSerializer(returns, many=True),
+                FastReturnSerializer(returns))
+
+
+class FragmentCacheTests(PortfolioTestCase):
+
+    """
+    Tests asserting cached table rows follow changes of their row
+    """
+
+    def test_trade_rows(self):
+        self.assertContains(self.client.get('/portfolio/trade/'),
+            '<td>10.00</td>')
+        self.trade.price = Decimal('11.50')
+        self.trade.save()
+        self.ticker.name = 'alpha prime'
+        self.ticker.save()
+        response = self.client.get('/portfolio/trade/')
+        self.assertContains(response, '<td>11.50</td>')
+        self.assertContains(response, '<td>Alpha Prime</td>', count=3)
+
+    def test_ticker_rows_closed(self):
+        self.assertContains(self.client.get('/portfolio/ticker/'),
+            '<i class="fa fa-external-link"></i></a></td>', count=6)
+
+
+class TradeEditTests(PortfolioTestCase):
+
+    """
+    Tests asserting trade edits adjust positions by their difference &
+    write one version
+    """
+
+    def patch(self, trade, **data):
+        return self.client.patch('/portfolio/trade/{pk}/'.format(
+            pk=trade.pk), json.dumps(data), content_type='application/json')
+
+    def test_partial_update(self):
+        versions = TradeHistory.objects.count()
+        self.assertEqual(self.patch(self.trade, quantity=12,
+            price='11.00').status_code, 200)
+        position = Position.objects.get(ticker=self.ticker)
+        self.assertEqual(position.final_quantity, 14)
+        self.assertEqual(position.total_buy_cost, Decimal('192.00'))
+        self.assertEqual(TradeHistory.objects.count(), versions + 1)
+        self.assertEqual(Position.objects.verify(), [])
+        self.assertEqual(self.patch(self.trade, quantity=12).status_code, 200)
+        self.assertEqual(TradeHistory.objects.count(), versions + 1)
+
+    def test_lowering_buy_below_sells(self):
+        response = self.patch(Trade.objects.get(ticker=self.ticker,
+            quantity=5), category=Trade.CATEGORY_BOUGHT, quantity=1)
+        self.assertEqual(response.status_code, 200)
+        response = self.patch(self.trade, ticker_id=self.other_ticker.id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Position.objects.get(
+            ticker=self.ticker).final_quantity, 8)
+
+
+class VersionConflictTests(PortfolioTestCase):
+
+    """
+    Tests asserting saves of stale trades & tickers are refused, edits
+    given a stale version getting a 409
+    """
+
+    def test_stale_save(self):
+        first = Trade.objects.get(pk=self.trade.pk)
+        stale = Trade.objects.get(pk=self.trade.pk)
+        first.quantity = 11
+        first.save()
+        versions = TradeHistory.objects.count()
+        stale.quantity = 20
+        with self.assertRaises(VersionConflict):
+            stale.save()
+        self.assertEqual(stale.version, 0)
+        self.assertEqual(TradeHistory.objects.count(), versions)
+        self.assertEqual(Trade.objects.get(pk=self.trade.pk).version, 1)
+        self.assertEqual(Position.objects.verify(), [])
+        ticker = Ticker.objects.get(pk=self.ticker.pk)
+        Ticker.objects.get(pk=self.ticker.pk).save()
+        with self.assertRaises(VersionConflict):
+            ticker.save()
+
+    def test_stale_version_rejected(self):
+        url = '/portfolio/trade/{pk}/'.format(pk=self.trade.pk)
+        self.assertEqual(self.client.patch(url, json.dumps({'quantity': 11,
+            'version': 0}), content_type='application/json').status_code,
+            200)
+        response = self.client.patch(url, json.dumps({'quantity': 12,
+            'version': 0}), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['X-Version'], '1')
+        self.assertEqual(Trade.objects.get(pk=self.trade.pk).quantity, 11)
+
+    def test_invalid_ticker_edit(self):
+        response = self.client.post('/portfolio/ticker/{pk}/update_record/'
+            .format(pk=self.ticker.pk), {'name': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Ticker.objects.get(pk=self.ticker.pk).name,
+            self.ticker.name)
+
+
+class JobQueueTests(PortfolioTestCase):
+
+    """
+    Tests asserting identical pending jobs collapse into one, jobs of a
+    key run one at a time & failed jobs are retried
+    """
+
+    def test_deduplication(self):
+        job, created = Job.objects.enqueue('recompute_ticker',
+            portfolio_id=DEFAULT_PORTFOLIO, ticker_id=self.ticker.pk)
+        self.assertTrue(created)
+        self.assertEqual(Job.objects.enqueue('recompute_ticker',
+            ticker_id=self.ticker.pk, portfolio_id=DEFAULT_PORTFOLIO),
+            (job, False))
+        self.assertEqual(Job.objects.claim('test'), job)
+        pending, created = Job.objects.enqueue('recompute_ticker',
+            portfolio_id=DEFAULT_PORTFOLIO, ticker_id=self.ticker.pk)
+        self.assertTrue(created)
+        self.assertIsNone(Job.objects.claim('test'))
+
+    def test_work(self):
+        LotQueue.objects.all().delete()
+        job, _ = Job.objects.enqueue('recompute_ticker',
+            portfolio_id=DEFAULT_PORTFOLIO, ticker_id=self.ticker.pk)
+        self.assertEqual(work('test', once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertTrue(LotQueue.objects.filter(ticker=self.ticker).exists())
+
+    @override_settings(PORTFOLIO_JOB_ATTEMPTS=2)
+    def test_retry(self):
+        job, _ = Job.objects.enqueue('missing')
+        with self.assertLogs('portfolio.jobs', 'ERROR'):
+            self.assertEqual(work('test', once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_PENDING, 1))
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('portfolio.jobs', 'ERROR'):
+            work('test', once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertIn('Unknown job kind', job.error)
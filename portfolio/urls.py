@@ -1,11 +1,27 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from portfolio import api
 from portfolio.views import (TickerViewSet, TradeViewSet, 
-	HoldingViewSet, ReturnViewSet)
+	HoldingViewSet, ReturnViewSet, TradeHistoryViewSet, AnalyticsViewSet,
+	MetricsViewSet, JobViewSet)
 
 router = DefaultRouter()
 router.register(r'ticker', TickerViewSet, basename='ticker')
 router.register(r'trade', TradeViewSet, basename='trade')
 router.register(r'holding', HoldingViewSet, basename='holding')
 router.register(r'return', ReturnViewSet, basename='return')
-urlpatterns = router.urls
\ No newline at end of file
+router.register(r'trade-history', TradeHistoryViewSet,
+	basename='trade-history')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'metrics', MetricsViewSet, basename='metrics')
+router.register(r'job', JobViewSet, basename='job')
+urlpatterns = [
+	path('api/trades/', api.trades, name='api-trades'),
+	path('api/tickers/', api.tickers, name='api-tickers'),
+	path('api/holdings/', api.holdings, name='api-holdings'),
+	path('api/returns/', api.returns, name='api-returns'),
+	path('api/trade-history/', api.trade_history,
+		name='api-trade-history'),
+	path('api/dashboard/', api.dashboard, name='api-dashboard'),
+] + router.urls
@@ -1,19 +1,62 @@
-from django.shortcuts import render, get_object_or_404
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.db.models import Prefetch, Sum, Count
 from django.db.models.functions import Coalesce
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.request import Request
-
-
-from portfolio.models import Ticker, Trade
+from rest_framework.utils.urls import replace_query_param
+
+
+from portfolio.analytics import report
+from portfolio.api import get_int
+from portfolio.caching import cached_response
+from portfolio.exports import (EXPORT_CHUNK_SIZE, export_response,
+    filter_created)
+from portfolio.fragments import cached_table
+from portfolio.history import ArchiveReader
+from portfolio.imports import (DEFAULT_CHUNK_SIZE, TradeImporter,
+    guess_format, read_rows)
+from portfolio.instrumentation import metrics, render
+from portfolio.lots import METHODS
+from portfolio.middleware import query_budget
+from portfolio.jobs import save_upload
+from portfolio.models import (Job, Ticker, Trade, TradeHistory,
+    VersionConflict, format_price)
+from portfolio.pagination import KeysetPaginator, render_page
+from portfolio.routers import atomic, current_database
+from portfolio.snapshots import holdings_as_of, parse_as_of, returns_as_of
 from portfolio.serializers import (TradeSerializer, TickerSerializer, 
-    HoldingSerializer, ReturnSerializer)
+    HoldingSerializer, ReturnSerializer, TradeHistorySerializer,
+    FastHoldingSerializer, FastReturnSerializer, FastTickerSerializer,
+    FastTradeHistorySerializer, FastTradeSerializer)
 # Create your views here.
 
 
+def conflict(request, error):
+
+    """ 
+    Rendering a version conflict, the client retrying its edit over the
+    current version of the row
+      
+    Returns: 
+    html: 
+        rendered HTML with error template & 409 status
+    """
+    response = render(request, 'error.html',
+        { 'errors' : error.message_dict }, status=status.HTTP_409_CONFLICT)
+    if error.version is not None:
+        response['X-Version'] = str(error.version)
+    return response
+
+
 class TradeViewSet(viewsets.ViewSet):
     
     """ 
@@ -22,35 +65,49 @@ class TradeViewSet(viewsets.ViewSet):
       
     Attributes: 
         serializer_class (TradeSerializer): TradeSerializer
+        fast_serializer_class (FastTradeSerializer): Serializer of lists
         model (Trade): Trade model
     """
     serializer_class = TradeSerializer
+    fast_serializer_class = FastTradeSerializer
     model = Trade
 
     def get_queryset(self):
-        return self.model.objects.select_related('ticker')
+        return self.model.objects.filter(
+            portfolio_id=self.request.portfolio_id).select_related('ticker')
 
+    @query_budget(1)
     def list(self, request):
 
         """ 
-        Generating trades & related data
+        Generating a page of trades & related data
       
         Returns: 
-        html: 
+        html/json: 
             rendered HTML with trade-list & tickers/categories for select box
         """
-        if request.GET.get('ticker'):
-            data = self.serializer_class(
-                self.get_queryset().filter(
-                    ticker__id=request.GET.get('ticker')), many=True).data
-        else:
-            data = self.serializer_class(self.get_queryset(), many=True).data
-        return render(request, 'trade_list.html', { 
+        try:
+            ticker_id = get_int(request, 'ticker')
+        except ValueError as error:
+            return render(request, 'error.html', { 'errors': str(error) },
+                status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset()
+        if ticker_id is not None:
+            queryset = queryset.filter(ticker__id=ticker_id)
+        page = KeysetPaginator(request).paginate(queryset.values(
+            *self.fast_serializer_class.lookups, 'modified_at',
+            'ticker__modified_at'))
+        data = self.fast_serializer_class(page.object_list, many=True).data
+        return render_page(request, page, data, 'trade_list.html', { 
                 'trade_list': data, 
-                'tickers': Ticker.objects.all(), 
+                'trade_rows': cached_table('rows/trade_row.html', 'trade',
+                    data, ((row['id'], row['modified_at'],
+                        row['ticker__modified_at'])
+                        for row in page.object_list)),
                 'trades_by_category': dict(self.model.CATEGORY_CHOICES)
             })
 
+    @query_budget(2)
     def retrieve(self, request, pk=None):
 
         """ 
@@ -63,14 +120,16 @@ class TradeViewSet(viewsets.ViewSet):
         trade = get_object_or_404(self.get_queryset(), pk=pk)
         return render(request, 'trade_add_or_update.html', { 
                 'trade': trade, 
-                'tickers': Ticker.objects.all(), 
+                'tickers': Ticker.objects.choices(), 
                 'trades_by_category': dict(self.model.CATEGORY_CHOICES)
             })
 
+    @atomic
     def create(self, request):
 
         """ 
-        Saving trade & related data
+        Saving trade & related data, the ticker's position staying locked
+        from validation until save
       
         Returns: 
         html: 
@@ -84,38 +143,162 @@ class TradeViewSet(viewsets.ViewSet):
         return render(request, 'error.html', 
             { 'errors' : serializer.errors }, status=status.HTTP_400_BAD_REQUEST)
 
+    @atomic
     def partial_update(self, request, pk=None):
-        serializer = self.serializer_class(
+
+        """ 
+        Updating fields of trade given, others keeping their values, the
+        trade being read without a lock & its save refused with 409 when
+        it changed meanwhile or since the version given
+      
+        Returns: 
+        html: 
+            rendered HTML with success/error template
+        """
+        _instance = get_object_or_404(self.get_queryset(), pk=pk)
+        serializer = self.serializer_class(_instance,
             data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.update(pk, serializer.validated_data)
+            try:
+                serializer.update(_instance, serializer.validated_data)
+            except VersionConflict as error:
+                return conflict(request, error)
             return render(request, 'success.html', {})
         return render(request, 'error.html', 
             { 'errors' : serializer.errors }, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
+    @atomic
     def update_record(self, request, pk=None):
 
         """ 
-        Updateing trade
+        Updateing trade, refused with 409 when it changed meanwhile or
+        since the version given
       
         Returns: 
         html: 
             rendered HTML with success/error template
         """
         _instance = get_object_or_404(self.get_queryset(), pk=pk)
-        serializer = self.serializer_class(
+        serializer = self.serializer_class(_instance,
             data=request.data)
         if serializer.is_valid():
-            serializer.update(_instance, serializer.validated_data)
+            try:
+                serializer.update(_instance, serializer.validated_data)
+            except VersionConflict as error:
+                return conflict(request, error)
             return render(request, 'success.html', {})
         return render(request, 'error.html', 
             { 'errors' : serializer.errors }, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['post'])
+    @atomic
+    def delete_record(self, request, pk=None):
+
+        """ 
+        Soft deleting trade, taking it out of its ticker's position
+      
+        Returns: 
+        html: 
+            rendered HTML with success/error template
+        """
+        return self.set_active(request, self.model.objects.filter(
+            portfolio_id=request.portfolio_id), pk, False)
+
+    @action(detail=True, methods=['post'])
+    @atomic
+    def restore_record(self, request, pk=None):
+
+        """ 
+        Restoring a soft deleted trade into its ticker's position
+      
+        Returns: 
+        html: 
+            rendered HTML with success/error template
+        """
+        return self.set_active(request, self.model.all_objects.filter(
+            portfolio_id=request.portfolio_id, active=False), pk, True)
+
+    def set_active(self, request, queryset, pk, active):
+        trade = get_object_or_404(queryset.select_for_update(), pk=pk)
+        try:
+            trade.set_active(active)
+        except ValidationError as error:
+            return render(request, 'error.html',
+                { 'errors' : error.message_dict },
+                status=status.HTTP_400_BAD_REQUEST)
+        return render(request, 'success.html', {})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+
+        """ 
+        Importing a batch of trades from a JSON array body or an uploaded
+        CSV/JSONL/JSON file, an uploaded file being queued for run_workers
+        with defer=1
+      
+        Returns: 
+        json: 
+            import summary with per-row errors & rows/sec, the queued job
+            with 202 status when deferred
+        """
+        upload = request.FILES.get('file')
+        try:
+            chunk_size = int(request.GET.get('chunk_size',
+                DEFAULT_CHUNK_SIZE))
+            if chunk_size < 1:
+                raise ValueError('chunk_size must be a positive integer')
+            strict = bool(int(request.GET.get('strict', 0)))
+            if upload and int(request.GET.get('defer', 0)):
+                file_format = guess_format(upload.name,
+                    request.data.get('file_format'))
+                job, _ = Job.objects.enqueue('import_trades',
+                    path=save_upload(upload, file_format),
+                    file_format=file_format,
+                    portfolio_id=request.portfolio_id, strict=strict,
+                    chunk_size=chunk_size, remove=True)
+                return Response(JobViewSet.serialize(job),
+                    status=status.HTTP_202_ACCEPTED)
+            if upload:
+                rows = read_rows(upload.file, guess_format(
+                    upload.name, request.data.get('file_format')))
+            elif isinstance(request.data, list):
+                rows = request.data
+            else:
+                raise ValueError('Expected a JSON array of trades or a file')
+            result = TradeImporter(chunk_size=chunk_size,
+                strict=strict).run(rows)
+        except ValueError as error:
+            return Response({'errors': str(error)},
+                status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED
+            if result['imported'] else status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['get'])
+    def export(self, request):
+
+        """ 
+        Streaming trades filtered by ticker & created_at date range
+      
+        Returns: 
+        csv/jsonl: 
+            streaming response of trades
+        """
+        header = ('id', 'ticker_id', 'ticker_symbol', 'category',
+            'quantity', 'price', 'created_at')
+        rows = filter_created(self.model.objects.using(current_database()) \
+                .filter(portfolio_id=request.portfolio_id).order_by('pk'),
+                request) \
+            .values_list('id', 'ticker_id', 'ticker__symbol', 'category',
+                'quantity', 'price', 'created_at') \
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        return export_response(request, 'trades', header, rows)
+
+    @action(detail=False, methods=['get'])
+    @query_budget(1)
     def add_new(self, request):
         return render(request, 'trade_add_or_update.html', {
-            'tickers': Ticker.objects.all(), 
+            'tickers': Ticker.objects.choices(), 
             'trades_by_category': dict(self.model.CATEGORY_CHOICES)
         })
 
@@ -126,11 +309,11 @@ class TickerViewSet(viewsets.ViewSet):
         A viewset to list, retreive, create & partial update ticker
     """
     serializer_class = TickerSerializer
+    fast_serializer_class = FastTickerSerializer
     model = Ticker
 
     def get_queryset(self):
-        return self.model.objects.prefetch_related('trade_set') \
-            .annotate(trade_count=Count('trade__id'))
+        return self.model.objects.with_trade_count()
 
     def create(self, request):
 
@@ -149,19 +332,27 @@ class TickerViewSet(viewsets.ViewSet):
         return render(request, 'error.html', { 'errors' : serializer.errors },
             status=status.HTTP_400_BAD_REQUEST)
 
+    @query_budget(1)
     def list(self, request):
 
         """ 
-        Generating tickers & related data
+        Generating a page of tickers & related data
       
         Returns: 
-        html: 
+        html/json: 
             rendered HTML with ticker-list
         """
-        context = { 'ticker_list': self.serializer_class(
-            self.get_queryset(), many=True).data }
-        return render(request, 'ticker_list.html', context)
+        page = KeysetPaginator(request).paginate(self.get_queryset() \
+            .values(*self.fast_serializer_class.lookups, 'modified_at'))
+        data = self.fast_serializer_class(page.object_list, many=True).data
+        return render_page(request, page, data, 'ticker_list.html', {
+                'ticker_list': data,
+                'ticker_rows': cached_table('rows/ticker_row.html', 'ticker',
+                    data, ((row['id'], row['modified_at'], row['trade_count'])
+                        for row in page.object_list))
+            })
 
+    @query_budget(1)
     def retrieve(self, request, pk=None):
 
         """ 
@@ -176,24 +367,64 @@ class TickerViewSet(viewsets.ViewSet):
             {'ticker': self.serializer_class(ticker).data })
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def update_record(self, request, pk=None):
 
         """ 
-        Updateing ticker
+        Updateing ticker, refused with 409 when it changed meanwhile or
+        since the version given
       
         Returns: 
         html: 
             rendered HTML with success/error template
         """
         _instance = get_object_or_404(self.get_queryset(), pk=pk)
-        serializer = self.serializer_class(
+        serializer = self.serializer_class(_instance,
             data=request.data)
         if serializer.is_valid():
-            serializer.update(_instance, serializer.validated_data)
+            try:
+                serializer.update(_instance, serializer.validated_data)
+            except VersionConflict as error:
+                return conflict(request, error)
             return render(request, 'success.html', {}, 
                 status=status.HTTP_201_CREATED)
         return render(request, 'error.html', 
-            { 'errors' : serializer.errors }, status=status.HTTP_200_ACCEPTED)
+            { 'errors' : serializer.errors }, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def delete_record(self, request, pk=None):
+
+        """ 
+        Soft deleting ticker, leaving holdings & returns
+      
+        Returns: 
+        html: 
+            rendered HTML with success template
+        """
+        try:
+            get_object_or_404(self.model.objects, pk=pk).set_active(False)
+        except VersionConflict as error:
+            return conflict(request, error)
+        return render(request, 'success.html', {})
+
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def restore_record(self, request, pk=None):
+
+        """ 
+        Restoring a soft deleted ticker
+      
+        Returns: 
+        html: 
+            rendered HTML with success template
+        """
+        try:
+            get_object_or_404(self.model.all_objects.filter(active=False),
+                pk=pk).set_active(True)
+        except VersionConflict as error:
+            return conflict(request, error)
+        return render(request, 'success.html', {})
 
     @action(detail=False, methods=['get'])
     def add_new(self, request):        
@@ -208,21 +439,73 @@ class HoldingViewSet(viewsets.ViewSet):
     Working for FinalQuantity & Avg. Buy Price specifically
     Attributes: 
         serializer_class (HoldingSerializer): HoldingSerializer
+        fast_serializer_class (FastHoldingSerializer): Serializer of lists
     """
     serializer_class = HoldingSerializer
+    fast_serializer_class = FastHoldingSerializer
     
     def get_queryset(self, evaluated):
         return Ticker.objects.holdings(evaluated=evaluated)
 
+    @query_budget(6)
     def list(self, request):
-        evaluated = bool(int(request.GET.get('evaluated', 1)))
+
+        """ 
+        Generating holdings, or holdings at a point in time with ?as_of=
+        (always evaluated), ?evaluated= being parsed before any cache key
+        is built from it
+      
+        Returns: 
+        html: 
+            rendered HTML with holding-list
+        """
+        try:
+            evaluated = bool(get_int(request, 'evaluated', 1))
+        except ValueError as error:
+            return render(request, 'error.html', { 'errors': str(error) },
+                status=status.HTTP_400_BAD_REQUEST)
+        return self.render_list(request, evaluated)
+
+    @cached_response('holdings', vary_on=('portfolio', 'evaluated', 'as_of'))
+    def render_list(self, request, evaluated):
+        as_of = request.GET.get('as_of')
+        if as_of:
+            try:
+                holdings = holdings_as_of(parse_as_of(as_of))
+            except ValueError as error:
+                return render(request, 'error.html', { 'errors': str(error) },
+                    status=status.HTTP_400_BAD_REQUEST)
+        else:
+            holdings = self.get_queryset(evaluated)
+        data = self.fast_serializer_class(holdings, many=True).data
+        # Holdings are computed, their values being their version
         context = {
-            'holding_list': self.serializer_class(
-                self.get_queryset(evaluated), many=True).data, 
-            'evaluated': evaluated
+            'holding_list': data,
+            'holding_rows': cached_table('rows/holding_row.html', 'holding',
+                data, (tuple(row.values()) for row in data)),
+            'evaluated': evaluated,
+            'as_of': as_of
         }
         return render(request, 'holding_list.html', context)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+
+        """ 
+        Streaming holdings read from materialized positions
+      
+        Returns: 
+        csv/jsonl: 
+            streaming response of holdings
+        """
+        header = ('id', 'name', 'symbol', 'final_quantity', 'avg_buy_price')
+        rows = ((ticker_id, name, symbol, final_quantity or 0,
+                format_price(avg_buy_price))
+            for ticker_id, name, symbol, final_quantity, avg_buy_price in
+            Ticker.objects.holding_rows().iterator(
+                chunk_size=EXPORT_CHUNK_SIZE))
+        return export_response(request, 'holdings', header, rows)
+
 
 class ReturnViewSet(viewsets.ViewSet):
 
@@ -233,13 +516,267 @@ class ReturnViewSet(viewsets.ViewSet):
       
     Attributes: 
         serializer_class (HoldingSerializer): HoldingSerializer
+        fast_serializer_class (FastReturnSerializer): Serializer of lists
     """
     serializer_class = ReturnSerializer
+    fast_serializer_class = FastReturnSerializer
 
-    def get_queryset(self):
-        return Ticker.objects.returns()
+    def get_queryset(self, method=None):
+        return Ticker.objects.returns(method=method)
 
+    @query_budget(7)
+    @cached_response('returns', vary_on=('portfolio', 'as_of', 'method'))
     def list(self, request):
-        context = { 'return_list': self.serializer_class(
-            self.get_queryset(), many=True).data }
+
+        """ 
+        Generating returns split into realized & unrealized by ?method=
+        (fifo, lifo or average), or returns at a point in time with ?as_of=
+      
+        Returns: 
+        html: 
+            rendered HTML with return-list
+        """
+        as_of = request.GET.get('as_of')
+        if as_of:
+            try:
+                returns = returns_as_of(parse_as_of(as_of))
+            except ValueError as error:
+                return render(request, 'error.html', { 'errors': str(error) },
+                    status=status.HTTP_400_BAD_REQUEST)
+        elif request.GET.get('method') not in (None, *METHODS):
+            return render(request, 'error.html',
+                { 'errors': 'method must be one of fifo, lifo, average' },
+                status=status.HTTP_400_BAD_REQUEST)
+        else:
+            returns = self.get_queryset(
+                METHODS.get(request.GET.get('method')))
+        data = self.fast_serializer_class(returns, many=True).data
+        context = { 
+            'return_list': data,
+            'return_rows': cached_table('rows/return_row.html', 'return',
+                data, (tuple(row.values()) for row in data)),
+            'as_of': as_of
+        }
         return render(request, 'return_list.html', context)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+
+        """ 
+        Streaming returns read from materialized positions
+      
+        Returns: 
+        csv/jsonl: 
+            streaming response of returns
+        """
+        header = ('id', 'name', 'symbol', 'cumulative_return')
+        rows = ((ticker_id, name, symbol, format_price(position_return))
+            for ticker_id, name, symbol, position_return, _ in
+            Ticker.objects.return_rows().iterator(
+                chunk_size=EXPORT_CHUNK_SIZE))
+        return export_response(request, 'returns', header, rows)
+
+
+class TradeHistoryViewSet(viewsets.ViewSet):
+
+    """ 
+    TradeHistoryViewSet class to implement HTTP request methods
+    over TradeHistory model
+      
+    Attributes: 
+        serializer_class (TradeHistorySerializer): TradeHistorySerializer
+        fast_serializer_class (FastTradeHistorySerializer): Serializer of
+            lists
+        model (TradeHistory): TradeHistory model
+    """
+    serializer_class = TradeHistorySerializer
+    fast_serializer_class = FastTradeHistorySerializer
+    model = TradeHistory
+
+    def get_queryset(self):
+        return self.model.objects.filter(
+            portfolio_id=self.request.portfolio_id).select_related('ticker')
+
+    @query_budget(1)
+    def list(self, request):
+
+        """ 
+        Generating a page of trade versions, newest first
+      
+        Returns: 
+        html/json: 
+            rendered HTML with trade-history-list
+        """
+        try:
+            trade_id = get_int(request, 'trade')
+        except ValueError as error:
+            return render(request, 'error.html', { 'errors': str(error) },
+                status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset()
+        if trade_id is not None:
+            queryset = queryset.filter(trade_reference__id=trade_id)
+        page = KeysetPaginator(request, descending=True).paginate(
+            queryset.values(*self.fast_serializer_class.lookups,
+                'ticker__modified_at'))
+        data = self.fast_serializer_class(page.object_list, many=True).data
+        # Versions never change, their ticker may
+        return render_page(request, page, data, 'trade_history_list.html', {
+                'trade_history_list': data,
+                'trade_history_rows': cached_table(
+                    'rows/trade_history_row.html', 'version', data,
+                    ((row['id'], row['ticker__modified_at'])
+                        for row in page.object_list))
+            })
+
+    @action(detail=False, methods=['get'])
+    def archived(self, request):
+
+        """ 
+        Generating a page of archived trade versions newest first, filtered
+        by ?trade=, read from archive files through a memory map
+      
+        Returns: 
+        json: 
+            next & results
+        """
+        paginator = KeysetPaginator(request)
+        try:
+            trade_id = int(request.GET['trade']) \
+                if request.GET.get('trade') else None
+            before_id = int(request.GET['cursor']) \
+                if request.GET.get('cursor') else None
+        except ValueError as error:
+            return Response({'errors': str(error)},
+                status=status.HTTP_400_BAD_REQUEST)
+        versions, has_next = ArchiveReader().page(trade_id, before_id,
+            paginator.get_page_size(), request.portfolio_id)
+        tickers = dict((ticker['id'], ticker)
+            for ticker in Ticker.objects.choices())
+        categories = dict(self.model.CATEGORY_CHOICES)
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(),
+                'cursor', versions[-1]['id']) if has_next else None,
+            'results': [{
+                    'id': version['id'],
+                    'trade_id': version['trade_reference_id'],
+                    'category': version['category'],
+                    'ticker_id': version['ticker_id'],
+                    'quantity': version['quantity'],
+                    'price': version['price'],
+                    'ticker_name': tickers.get(version['ticker_id'],
+                        {}).get('name'),
+                    'ticker_symbol': tickers.get(version['ticker_id'],
+                        {}).get('symbol'),
+                    'category_name': categories.get(version['category']),
+                    'created_at': version['created_at']
+                } for version in versions]
+        })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+
+        """ 
+        Streaming trade versions filtered by ticker & created_at date range
+      
+        Returns: 
+        csv/jsonl: 
+            streaming response of trade history
+        """
+        header = ('id', 'trade_reference_id', 'ticker_id', 'ticker_symbol',
+            'category', 'quantity', 'price', 'created_at')
+        rows = filter_created(self.model.objects.using(current_database()) \
+                .filter(portfolio_id=request.portfolio_id).order_by('pk'),
+                request) \
+            .values_list('id', 'trade_reference_id', 'ticker_id',
+                'ticker__symbol', 'category', 'quantity', 'price',
+                'created_at') \
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        return export_response(request, 'trade_history', header, rows)
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+
+    """ 
+    AnalyticsViewSet class to implement HTTP request methods
+    over vectorized analytics of Trade/Price models data
+    Working for daily P&L, realized/unrealized return & time-weighted
+    return series
+    """
+
+    @query_budget(3)
+    def list(self, request):
+
+        """ 
+        Generating daily series of the book from ?start= to ?end= (ISO
+        dates, spanning at most PORTFOLIO_ANALYTICS_MAX_DAYS days),
+        restricted to ?ticker= ids (comma separated)
+      
+        Returns: 
+        json: 
+            dates, book series & latest figures of every ticker
+        """
+        try:
+            start, end = (datetime.date.fromisoformat(request.GET[param])
+                if request.GET.get(param) else None
+                for param in ('start', 'end'))
+            ticker_ids = [int(ticker_id) for ticker_id in
+                request.GET['ticker'].split(',')] \
+                if request.GET.get('ticker') else None
+            data = report(start, end, ticker_ids)
+        except ValueError as error:
+            return Response({'errors': str(error)},
+                status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+
+class MetricsViewSet(viewsets.ViewSet):
+
+    """ 
+    MetricsViewSet class exposing request instrumentation to staff users
+    (session or basic authentication, e.g. for a Prometheus scraper)
+    """
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+
+        """ 
+        Generating per-endpoint request timings, phase timings & query
+        counts
+      
+        Returns: 
+        text: 
+            metrics in the Prometheus text format
+        """
+        return HttpResponse(metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class JobViewSet(viewsets.ViewSet):
+
+    """ 
+    JobViewSet class exposing the state of queued background jobs, e.g.
+    of deferred imports
+    """
+
+    @staticmethod
+    def serialize(job):
+        return {
+            'id': job.pk,
+            'kind': job.kind,
+            'status': dict(Job.STATUS_CHOICES)[job.status],
+            'attempts': job.attempts,
+            'result': job.result,
+            'error': job.error
+        }
+
+    def retrieve(self, request, pk=None):
+
+        """ 
+        Generating the state of a job
+      
+        Returns: 
+        json: 
+            job kind, status, attempts, result & error
+        """
+        return Response(self.serialize(get_object_or_404(Job.objects,
+            pk=pk)))
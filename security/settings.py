@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 import dj_database_url
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,7 +25,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ['SECRET_KEY']
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = bool(int(os.environ.get('DEBUG', 1)))
 
 ALLOWED_HOSTS = ['security-portfolio.herokuapp.com']
 
@@ -43,23 +44,35 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'portfolio.instrumentation.instrumentation_middleware',
+    'portfolio.middleware.query_budget_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Checking ?portfolio= against request.user, so after authentication
+    'portfolio.middleware.portfolio_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'security.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [str(BASE_DIR) + '/portfolio/',],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are compiled once per process unless DEBUG is set
+            'loaders': TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -80,6 +93,123 @@ DATABASES = {}
 
 DATABASES['default'] = dj_database_url.config(conn_max_age=600)
 
+# Portfolio routing - PORTFOLIO_DATABASE_URLS adds database aliases, e.g.
+# {"books_2": "postgres://..."}, & PORTFOLIO_SHARDS places portfolios on
+# them, e.g. {"7": "books_2"}, other portfolios staying on default
+for alias, url in json.loads(
+        os.environ.get('PORTFOLIO_DATABASE_URLS', '{}')).items():
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+PORTFOLIO_SHARDS = dict((int(portfolio_id), alias) for portfolio_id, alias
+    in json.loads(os.environ.get('PORTFOLIO_SHARDS', '{}')).items())
+DATABASE_ROUTERS = ['portfolio.routers.PortfolioRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# locmem by default, e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# with CACHE_LOCATION=/var/tmp/security or a Redis backend such as
+# django_redis.cache.RedisCache with CACHE_LOCATION=redis://127.0.0.1:6379/1
+# A backend shared between processes is needed when running several workers.
+# Cached responses & lookups (default), rendered fragments & latest prices
+# get their own alias so one never evicts the others - locmem & filebased
+# aliases get their own LOCATION & cull past <ALIAS>_CACHE_MAX_ENTRIES
+# entries, aliases of a shared backend being kept apart by KEY_PREFIX
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND',
+    'django.core.cache.backends.locmem.LocMemCache')
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION', 'security')
+CACHES = {}
+for alias, max_entries in (('default', 5000), ('fragments', 50000),
+        ('prices', 20000)):
+    CACHES[alias] = {'BACKEND': CACHE_BACKEND, 'LOCATION': CACHE_LOCATION}
+    if CACHE_BACKEND.rsplit('.', 2)[-2] in ('locmem', 'filebased'):
+        if alias != 'default':
+            CACHES[alias]['LOCATION'] = '{location}-{alias}'.format(
+                location=CACHE_LOCATION, alias=alias)
+        CACHES[alias]['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get(
+            '{alias}_CACHE_MAX_ENTRIES'.format(alias=alias.upper()),
+            max_entries))}
+    elif alias != 'default':
+        CACHES[alias]['KEY_PREFIX'] = alias
+
+PORTFOLIO_RESPONSE_CACHE_TIMEOUT = int(
+    os.environ.get('PORTFOLIO_RESPONSE_CACHE_TIMEOUT', 3600))
+
+# Rendered table rows of list pages, keyed on row versions
+PORTFOLIO_FRAGMENT_CACHE_TIMEOUT = int(
+    os.environ.get('PORTFOLIO_FRAGMENT_CACHE_TIMEOUT', 86400))
+
+# Position checkpoints for ?as_of= queries - taken by snapshot_positions
+# every PORTFOLIO_SNAPSHOT_EVERY history rows, kept for
+# PORTFOLIO_SNAPSHOT_RETENTION_DAYS days
+PORTFOLIO_SNAPSHOT_EVERY = int(
+    os.environ.get('PORTFOLIO_SNAPSHOT_EVERY', 10000))
+PORTFOLIO_SNAPSHOT_RETENTION_DAYS = int(
+    os.environ.get('PORTFOLIO_SNAPSHOT_RETENTION_DAYS', 90))
+PORTFOLIO_SNAPSHOT_LAG = int(os.environ.get('PORTFOLIO_SNAPSHOT_LAG', 60))
+
+# Trade history archival - superseded versions older than
+# PORTFOLIO_HISTORY_HOT_DAYS days are moved by archive_history into gzipped
+# JSONL files of PORTFOLIO_HISTORY_ARCHIVE_DIR
+PORTFOLIO_HISTORY_HOT_DAYS = int(
+    os.environ.get('PORTFOLIO_HISTORY_HOT_DAYS', 365))
+PORTFOLIO_HISTORY_ARCHIVE_DIR = os.environ.get(
+    'PORTFOLIO_HISTORY_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# Trades & tickers soft deleted for over PORTFOLIO_PURGE_DAYS days are hard
+# deleted by purge_inactive
+PORTFOLIO_PURGE_DAYS = int(os.environ.get('PORTFOLIO_PURGE_DAYS', 180))
+
+# Lot matching method of realized/unrealized returns - fifo, lifo or average
+PORTFOLIO_LOT_METHOD = os.environ.get('PORTFOLIO_LOT_METHOD', 'fifo')
+# Lot queues checkpoint their state PORTFOLIO_LOT_CHECKPOINT_TAIL trades before
+# their last one, edits of later trades replaying from the checkpoint only
+PORTFOLIO_LOT_CHECKPOINT_TAIL = int(
+    os.environ.get('PORTFOLIO_LOT_CHECKPOINT_TAIL', 1000))
+
+# Query budgets - requests over PORTFOLIO_QUERY_BUDGET queries & views over
+# their query_budget are logged, or raise with PORTFOLIO_QUERY_BUDGET_STRICT
+PORTFOLIO_QUERY_BUDGET = int(os.environ.get('PORTFOLIO_QUERY_BUDGET', 20))
+PORTFOLIO_QUERY_BUDGET_STRICT = bool(
+    int(os.environ.get('PORTFOLIO_QUERY_BUDGET_STRICT', 0)))
+
+# Instrumentation - timings of the latest PORTFOLIO_METRICS_BUFFER requests
+# are served to staff at /portfolio/metrics/ in the Prometheus format. With
+# PORTFOLIO_PROFILE_RATE above 0 (e.g. 0.01), that fraction of requests runs
+# under cProfile & pstats of those over PORTFOLIO_PROFILE_SLOW_MS are written
+# to PORTFOLIO_PROFILE_DIR
+PORTFOLIO_METRICS_BUFFER = int(
+    os.environ.get('PORTFOLIO_METRICS_BUFFER', 10000))
+PORTFOLIO_PROFILE_RATE = float(os.environ.get('PORTFOLIO_PROFILE_RATE', 0))
+PORTFOLIO_PROFILE_SLOW_MS = int(
+    os.environ.get('PORTFOLIO_PROFILE_SLOW_MS', 500))
+PORTFOLIO_PROFILE_DIR = os.environ.get('PORTFOLIO_PROFILE_DIR',
+    os.path.join(BASE_DIR, 'profiles'))
+
+# Background jobs - run_workers forks PORTFOLIO_JOB_WORKERS processes polling
+# the job queue every PORTFOLIO_JOB_POLL seconds when idle. Failed jobs are
+# retried PORTFOLIO_JOB_ATTEMPTS times after PORTFOLIO_JOB_RETRY_DELAY seconds
+# doubling, jobs running over PORTFOLIO_JOB_TIMEOUT seconds are requeued &
+# finished jobs kept PORTFOLIO_JOB_RETENTION_DAYS days. Deferred uploads are
+# written to PORTFOLIO_JOB_UPLOAD_DIR. With PORTFOLIO_DEFER_RECOMPUTE, lot
+# queue replays of edited trades are queued as recompute_ticker jobs
+PORTFOLIO_JOB_WORKERS = int(os.environ.get('PORTFOLIO_JOB_WORKERS', 2))
+PORTFOLIO_JOB_POLL = float(os.environ.get('PORTFOLIO_JOB_POLL', 1))
+PORTFOLIO_JOB_ATTEMPTS = int(os.environ.get('PORTFOLIO_JOB_ATTEMPTS', 3))
+PORTFOLIO_JOB_RETRY_DELAY = int(
+    os.environ.get('PORTFOLIO_JOB_RETRY_DELAY', 10))
+PORTFOLIO_JOB_TIMEOUT = int(os.environ.get('PORTFOLIO_JOB_TIMEOUT', 3600))
+PORTFOLIO_JOB_RETENTION_DAYS = int(
+    os.environ.get('PORTFOLIO_JOB_RETENTION_DAYS', 7))
+PORTFOLIO_JOB_UPLOAD_DIR = os.environ.get('PORTFOLIO_JOB_UPLOAD_DIR',
+    os.path.join(BASE_DIR, 'uploads'))
+PORTFOLIO_DEFER_RECOMPUTE = bool(
+    int(os.environ.get('PORTFOLIO_DEFER_RECOMPUTE', 0)))
+
+# Analytics - series span at most PORTFOLIO_ANALYTICS_MAX_DAYS days
+PORTFOLIO_ANALYTICS_MAX_DAYS = int(
+    os.environ.get('PORTFOLIO_ANALYTICS_MAX_DAYS', 3660))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators